@@ -0,0 +1,319 @@
+"""
+End-to-end load test of the front: the regression benchmark for front changes.
+
+Starts the fake Twitch IRC server (servidor_irc.py) replaying a chat dump
+into --canales channels at --velocidad, the simulated ia service
+(ia_simulada.py), and the front itself (Flask's threaded server, or an
+already running front with --front-url / --front-pid). Then --viewers
+synthetic SSE viewers are attached round-robin to the channels. After
+--duracion seconds it reports:
+  - latency from IRC (the fake server sending the PRIVMSG) to SSE delivery
+    of the message, and to delivery of its verdict, p50/p99
+  - messages dropped: sent to a viewer's channel while it was connected
+    but never delivered to it
+  - verdict statuses (done, unscored by reason, still pending)
+  - CPU and RSS of the front process (from /proc, Linux only)
+--salida also writes the report, with the front's /stats, as JSON for
+comparing runs.
+
+Uso: python bench_front.py [--canales 4] [--viewers 20] [--velocidad 5] [--duracion 60]
+                          [--latencia-ms 50] [--stream] [--salida resultado.json]
+"""
+import argparse, hashlib, http.client, json, os, subprocess, sys, tempfile, threading, time
+from urllib.parse import urlsplit
+from servidor_irc import FakeTwitchIRC, cargar_mensajes
+from ia_simulada import IASimulada
+
+FRONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'front')
+
+# Size of the front's message ID hash (MESSAGE_ID_BYTES in front/message_ids.py)
+MESSAGE_ID_BYTES = 12
+
+
+def message_id(tags):
+    """The ID the front gives a message with these tags (get_message_id in front/message_ids.py)"""
+    key = f"{tags['id']}|{tags.get('tmi-sent-ts', '')}|{tags.get('user-id', '')}"
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=MESSAGE_ID_BYTES).hexdigest()
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(p / 100.0 * len(valores)))]
+
+
+class Envios:
+    """Send time of every message the fake IRC server replayed, by front message ID."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mensajes = {}  # message id -> (channel, monotonic send time)
+
+    def registrar(self, channel, tags, text):
+        with self.lock:
+            self.mensajes[message_id(tags)] = (channel, time.monotonic())
+
+    def get(self, mid):
+        with self.lock:
+            return self.mensajes.get(mid)
+
+    def en_canal(self, channel, desde, hasta):
+        with self.lock:
+            return {mid for mid, (ch, t) in self.mensajes.items() if ch == channel and desde <= t <= hasta}
+
+
+class Viewer:
+    """A synthetic viewer: joins a channel and reads its SSE event stream."""
+
+    def __init__(self, front_url, channel, session_id, envios):
+        self.url = urlsplit(front_url)
+        self.channel = channel
+        self.session_id = session_id
+        self.envios = envios
+        self.recibidos = set()
+        self.latencias = []  # IRC -> SSE delivery of messages
+        self.latencias_veredicto = []  # IRC -> SSE delivery of verdicts
+        self.estados = {}  # message id -> status (and unscored reason)
+        self.conectado = None
+        self.errores = 0
+        self.activo = True
+        self.conn = None
+
+    def _conexion(self):
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=30)
+
+    def run(self):
+        headers = {"Cookie": f"session_id={self.session_id}"}
+        try:
+            conn = self._conexion()
+            body = f"channel_name={self.channel}"
+            conn.request("POST", self.url.path.rstrip("/") + "/stream-mod/front/", body,
+                         {**headers, "Content-Type": "application/x-www-form-urlencoded"})
+            conn.getresponse().read()
+            conn.close()
+
+            self.conn = self._conexion()
+            self.conn.request("GET", self.url.path.rstrip("/") + "/stream-mod/front/events", headers=headers)
+            response = self.conn.getresponse()
+            self.conectado = time.monotonic()
+            while self.activo:
+                line = response.readline()
+                if not line:
+                    break
+                if line.startswith(b"data: "):
+                    self._frame(json.loads(line[6:]), time.monotonic())
+        except Exception as e:
+            if self.activo:
+                print(f"Viewer {self.session_id}: {e}")
+                self.errores += 1
+
+    def _frame(self, events, ahora):
+        for event in events:
+            data = event.get("data")
+            if event["type"] not in ("message", "update") or not isinstance(data, dict):
+                continue
+            mid = data.get("message_id")
+            envio = self.envios.get(mid)
+            if event["type"] == "message" and mid not in self.recibidos:
+                self.recibidos.add(mid)
+                if envio is not None:
+                    self.latencias.append(ahora - envio[1])
+            status = data.get("status")
+            if status == "unscored":
+                status = f"unscored:{data.get('unscored_reason')}"
+            if status != "pending" and self.estados.get(mid, "pending") == "pending" and envio is not None:
+                self.latencias_veredicto.append(ahora - envio[1])
+            self.estados[mid] = status
+
+    def stop(self):
+        self.activo = False
+        if self.conn is not None and self.conn.sock is not None:
+            try:
+                self.conn.sock.shutdown(2)
+            except OSError:
+                pass
+
+
+class MuestreoProceso:
+    """Samples CPU time and RSS of a process from /proc once a second."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.rss = []  # bytes
+        self.cpu_inicio = self._cpu()
+        self.inicio = time.monotonic()
+        self.activo = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _cpu(self):
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                campos = f.read().rsplit(")", 1)[1].split()
+            return (int(campos[11]) + int(campos[12])) / os.sysconf('SC_CLK_TCK')
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def _rss(self):
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+
+    def _run(self):
+        while self.activo:
+            rss = self._rss()
+            if rss is not None:
+                self.rss.append(rss)
+            time.sleep(1)
+
+    def resumen(self):
+        self.activo = False
+        cpu = self._cpu()
+        transcurrido = time.monotonic() - self.inicio
+        return {
+            "cpu_percent": round(100.0 * (cpu - self.cpu_inicio) / transcurrido, 1)
+            if cpu is not None and self.cpu_inicio is not None else None,
+            "rss_mb_max": round(max(self.rss) / 2**20, 1) if self.rss else None,
+            "rss_mb_final": round(self.rss[-1] / 2**20, 1) if self.rss else None
+        }
+
+
+def esperar_front(front_url, timeout=30):
+    url = urlsplit(front_url)
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=2)
+            conn.request("GET", url.path.rstrip("/") + "/stream-mod/front/stats")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"The front at {front_url} did not start")
+
+
+def stats_front(front_url):
+    url = urlsplit(front_url)
+    try:
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=5)
+        conn.request("GET", url.path.rstrip("/") + "/stream-mod/front/stats")
+        return json.loads(conn.getresponse().read())
+    except (OSError, ValueError) as e:
+        return {"error": str(e)}
+
+
+def ms(segundos):
+    return round(1000.0 * segundos, 1) if segundos is not None else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end load test of the front")
+    parser.add_argument("--chat", default=os.path.join(os.path.dirname(__file__), '..', 'twitch_chat2.json'))
+    parser.add_argument("--canales", type=int, default=4)
+    parser.add_argument("--viewers", type=int, default=20)
+    parser.add_argument("--velocidad", type=float, default=5.0, help="Speed multiplier of the replay")
+    parser.add_argument("--duracion", type=float, default=60.0, help="Seconds of measurement")
+    parser.add_argument("--latencia-ms", type=float, default=50, help="Mean latency of the simulated ia")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--toxicos", type=float, default=0.05)
+    parser.add_argument("--concurrencia", type=int, default=None, help="Moderations the simulated ia serves at once")
+    parser.add_argument("--front-url", default=None, help="Use an already running front instead of starting one")
+    parser.add_argument("--front-pid", type=int, default=None, help="PID of that front, for CPU and RSS")
+    parser.add_argument("--front-puerto", type=int, default=17011)
+    parser.add_argument("--stream", action="store_true",
+                        help="Start the front with MODERATION_STREAM set, exercising its /moderate/batch fallback")
+    parser.add_argument("--salida", default=None, help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    envios = Envios()
+    irc = FakeTwitchIRC(cargar_mensajes(args.chat), port=0, velocidad=args.velocidad, on_send=envios.registrar).start()
+    ia = IASimulada(port=0, latencia_ms=args.latencia_ms, jitter_ms=args.jitter_ms, toxicos=args.toxicos,
+                    concurrencia=args.concurrencia).start()
+
+    front = None
+    if args.front_url:
+        front_url, front_pid = args.front_url, args.front_pid
+        print(f"Using the front at {front_url}: it must have IRC_HOST=127.0.0.1 IRC_PORT={irc.port} "
+              f"MODERATION_API_URL=http://127.0.0.1:{ia.port}/moderate")
+    else:
+        datos = tempfile.mkdtemp(prefix="stream-mod-carga-")
+        env = {
+            **os.environ,
+            "IRC_HOST": "127.0.0.1",
+            "IRC_PORT": str(irc.port),
+            "MODERATION_API_URL": f"http://127.0.0.1:{ia.port}/moderate",
+            "MODERATED_MESSAGES_JOURNAL": os.path.join(datos, "moderate.jsonl"),
+            "STATE_SQLITE_PATH": os.path.join(datos, "state.db"),
+            # comun/ (shared metrics) lives at the top of the checkout
+            "PYTHONPATH": os.pathsep.join(filter(None, [os.path.join(FRONT_DIR, '..'), os.environ.get("PYTHONPATH")]))
+        }
+        env.pop("MODERATION_STREAM", None)
+        if args.stream:
+            env["MODERATION_STREAM"] = "1"
+        front = subprocess.Popen(
+            [sys.executable, "-c",
+             f"from app import app; app.run(host='127.0.0.1', port={args.front_puerto}, threaded=True)"],
+            cwd=FRONT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        front_url, front_pid = f"http://127.0.0.1:{args.front_puerto}", front.pid
+
+    try:
+        esperar_front(front_url)
+        muestreo = MuestreoProceso(front_pid) if front_pid else None
+        canales = [f"carga{i}" for i in range(args.canales)]
+        viewers = [Viewer(front_url, canales[i % len(canales)], f"carga-{i}", envios) for i in range(args.viewers)]
+        for viewer in viewers:
+            threading.Thread(target=viewer.run, daemon=True).start()
+
+        print(f"{args.viewers} viewers on {args.canales} channels, replay x{args.velocidad}, {args.duracion:.0f}s")
+        time.sleep(args.duracion)
+        fin = time.monotonic()
+        # Let what was sent just before the end arrive
+        time.sleep(2)
+        for viewer in viewers:
+            viewer.stop()
+        recursos = muestreo.resumen() if muestreo else {}
+        stats = stats_front(front_url)
+    finally:
+        if front is not None:
+            front.terminate()
+            front.wait()
+        irc.stop()
+        ia.stop()
+
+    latencias = [l for viewer in viewers for l in viewer.latencias]
+    latencias_veredicto = [l for viewer in viewers for l in viewer.latencias_veredicto]
+    esperados = perdidos = 0
+    for viewer in viewers:
+        if viewer.conectado is None:
+            continue
+        esperado = envios.en_canal(viewer.channel, viewer.conectado, fin)
+        esperados += len(esperado)
+        perdidos += len(esperado - viewer.recibidos)
+    estados = {}
+    for viewer in viewers:
+        for status in viewer.estados.values():
+            estados[status] = estados.get(status, 0) + 1
+
+    reporte = {
+        "parametros": vars(args),
+        "enviados": irc.sent,
+        "moderaciones_ia": ia.requests,
+        "entregas": len(latencias),
+        "latencia_mensaje_ms": {"p50": ms(percentil(latencias, 50)), "p99": ms(percentil(latencias, 99))},
+        "latencia_veredicto_ms": {"p50": ms(percentil(latencias_veredicto, 50)),
+                                  "p99": ms(percentil(latencias_veredicto, 99))},
+        "perdidos": perdidos,
+        "perdidos_pct": round(100.0 * perdidos / esperados, 2) if esperados else 0.0,
+        "estados": estados,
+        "viewers_con_error": sum(1 for viewer in viewers if viewer.errores),
+        "front": recursos
+    }
+    print(json.dumps(reporte, indent=2, ensure_ascii=False))
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump({**reporte, "stats_front": stats}, f, indent=2, ensure_ascii=False)
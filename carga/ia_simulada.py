@@ -0,0 +1,126 @@
+"""
+Stand-in for the ia service's POST /moderate endpoint with configurable latency.
+
+Answers {"mensaje": ...} like ia/main.py does, after a latency drawn from a
+normal distribution (mean and jitter in milliseconds), flagging a
+configurable fraction of the messages. Requests are served concurrently, as
+the real service does, so only the latency is simulated, not the capacity
+limit (use --concurrencia for that). POST /moderate/batch ({"mensajes": [...]})
+pays one latency per request. The NDJSON /moderate/stream endpoint answers
+411, as mod_wsgi does (see ia/main.py): a front with MODERATION_STREAM set
+falls back to /moderate/batch, which is what the production setup runs.
+
+Uso: python ia_simulada.py [--puerto 17012] [--latencia-ms 50] [--jitter-ms 10] [--toxicos 0.05]
+"""
+import argparse, json, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RAZONES = ["Garabato", "Spam", "Insulto", "Otros"]
+
+
+class IASimulada:
+    """Simulated moderation service running in a background thread."""
+
+    def __init__(self, host="127.0.0.1", port=17012, latencia_ms=50, jitter_ms=10, toxicos=0.05, concurrencia=None):
+        """
+        Parameters:
+        host (str): Interface to listen on
+        port (int): Port to listen on, 0 for any free port
+        latencia_ms (float): Mean latency of a moderation
+        jitter_ms (float): Standard deviation of the latency
+        toxicos (float): Fraction of messages flagged
+        concurrencia (int): Moderations served at once (like the model's workers), None for no limit
+        """
+        self.latencia = latencia_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.toxicos = toxicos
+        self.slots = threading.Semaphore(concurrencia) if concurrencia else None
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="ia-simulada", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def moderar(self, mensaje):
+        return self.moderar_lote([mensaje])[0]
+
+    def moderar_lote(self, mensajes):
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            time.sleep(max(0.0, random.gauss(self.latencia, self.jitter)))
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+        with self.lock:
+            self.requests += 1
+        return [(False, [random.choice(RAZONES)]) if random.random() < self.toxicos else (True, ["No baneable"])
+                for _ in mensajes]
+
+    def _handler(self):
+        ia = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                path = self.path.rstrip("/").split("?")[0]
+                if path.endswith("/moderate/stream"):
+                    self.close_connection = True
+                    return self._reply(411, {"error": "Length Required", "status": "error"})
+                if path.endswith("/moderate/batch"):
+                    try:
+                        data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                        mensajes = [str(mensaje) for mensaje in data["mensajes"]]
+                    except (ValueError, KeyError, TypeError):
+                        return self._reply(400, {"error": "'mensajes' must be a list of strings", "status": "error"})
+                    veredictos = ia.moderar_lote(mensajes)
+                    return self._reply(200, {"status": "success", "results": [
+                        {"approved": approved, "reasons": reasons, "stage": "simulada", "message": mensaje}
+                        for mensaje, (approved, reasons) in zip(mensajes, veredictos)]})
+                if path.endswith("/moderate"):
+                    try:
+                        data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                        mensaje = data["mensaje"]
+                    except (ValueError, KeyError, TypeError):
+                        return self._reply(400, {"error": "No message provided", "status": "error"})
+                    approved, reasons = ia.moderar(mensaje)
+                    return self._reply(200, {"status": "success", "approved": approved, "reasons": reasons,
+                                             "stage": "simulada", "message": mensaje})
+                self._reply(404, {"error": "Not found", "status": "error"})
+
+            def _reply(self, status, body):
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated ia moderation service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=17012)
+    parser.add_argument("--latencia-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--toxicos", type=float, default=0.05, help="Fraction of messages flagged")
+    parser.add_argument("--concurrencia", type=int, default=None, help="Moderations served at once")
+    args = parser.parse_args()
+
+    ia = IASimulada(args.host, args.puerto, args.latencia_ms, args.jitter_ms, args.toxicos, args.concurrencia)
+    print(f"Simulated moderation on http://{args.host}:{ia.port}/moderate")
+    try:
+        ia.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
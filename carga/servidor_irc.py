@@ -0,0 +1,197 @@
+"""
+Local stand-in for Twitch IRC that replays chat dumps.
+
+Speaks enough of the Twitch protocol for the front's IRC ingest: CAP REQ
+(twitch.tv/tags), PASS, NICK, JOIN, PART and PING/PONG. The first JOIN of a
+channel starts replaying a dump (twitch_chat2.json or any Datos.py output)
+into it as PRIVMSGs with IRCv3 tags (id, tmi-sent-ts, user-id, display-name,
+badges, first-msg), keeping the recorded gaps between messages divided by
+the speed multiplier and looping over the dump. Every channel replays the
+same dump from a different starting point, so many channels can be loaded
+at once.
+
+Uso: python servidor_irc.py [--chat ../twitch_chat2.json] [--puerto 16667] [--velocidad 1]
+"""
+import argparse, asyncio, json, os, random, threading, time, uuid
+
+TAG_ESCAPES = {"\\": "\\\\", ";": "\\:", " ": "\\s", "\r": "\\r", "\n": "\\n"}
+
+
+def escape_tag_value(value):
+    return "".join(TAG_ESCAPES.get(char, char) for char in str(value))
+
+
+def cargar_mensajes(path):
+    """
+    Messages of a chat dump, oldest first.
+
+    Returns:
+    List[dict]: {"offset" (seconds since the first message), "username", "user_id",
+        "text", "badges", "first_msg"}
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        dump = json.load(f)
+    mensajes = []
+    for item in dump:
+        if not item.get("message"):
+            continue
+        author = item.get("author", {})
+        badges = [f"{badge['name']}/{badge.get('version', 1)}" for badge in author.get("badges", []) if badge.get("name")]
+        mensajes.append({
+            "timestamp": item.get("timestamp", 0) / 1e6,
+            "username": (author.get("name") or author.get("display_name") or "anon").lower(),
+            "user_id": author.get("id", ""),
+            "text": " ".join(item["message"].split()),
+            "badges": ",".join(badges),
+            "first_msg": bool(item.get("is_first_message"))
+        })
+    if not mensajes:
+        raise ValueError(f"No messages found in {path}")
+    mensajes.sort(key=lambda m: m["timestamp"])
+    inicio = mensajes[0]["timestamp"]
+    for mensaje in mensajes:
+        mensaje["offset"] = mensaje.pop("timestamp") - inicio
+    return mensajes
+
+
+class FakeTwitchIRC:
+    """
+    Fake Twitch IRC server running its own asyncio loop in a background thread.
+    """
+
+    def __init__(self, mensajes, host="127.0.0.1", port=16667, velocidad=1.0, on_send=None, ping_interval=60):
+        """
+        Parameters:
+        mensajes (List[dict]): Messages from cargar_mensajes
+        host (str): Interface to listen on
+        port (int): Port to listen on, 0 for any free port
+        velocidad (float): Speed multiplier of the replay
+        on_send (callable): Called with (channel, tags, text) right before each message is sent
+        ping_interval (float): Seconds between the server's PINGs
+        """
+        self.mensajes = mensajes
+        self.host = host
+        self.port = port
+        self.velocidad = velocidad
+        self.on_send = on_send
+        self.ping_interval = ping_interval
+        self.members = {}  # channel -> set of writers
+        self.replays = {}  # channel -> replay task
+        self.sent = 0
+        self.loop = None
+        self.server = None
+        self.ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=lambda: asyncio.run(self._serve()), name="fake-irc", daemon=True).start()
+        self.ready.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    async def _handle(self, reader, writer):
+        nick = "justinfan"
+        joined = set()
+        pinger = asyncio.create_task(self._ping(writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command, _, rest = line.decode('utf-8', 'replace').strip().partition(" ")
+                if command == "CAP":
+                    writer.write(b":tmi.twitch.tv CAP * ACK :twitch.tv/tags\r\n")
+                elif command == "NICK":
+                    nick = rest
+                    writer.write(f":tmi.twitch.tv 001 {nick} :Welcome, GLHF!\r\n".encode())
+                elif command == "JOIN":
+                    for channel in rest.lstrip("#").split(",#"):
+                        joined.add(channel)
+                        self.members.setdefault(channel, set()).add(writer)
+                        writer.write(f":{nick}!{nick}@{nick}.tmi.twitch.tv JOIN #{channel}\r\n".encode())
+                        if channel not in self.replays:
+                            self.replays[channel] = asyncio.create_task(self._replay(channel))
+                elif command == "PART":
+                    channel = rest.lstrip("#")
+                    joined.discard(channel)
+                    self.members.get(channel, set()).discard(writer)
+                elif command == "PING":
+                    writer.write(f"PONG {rest}\r\n".encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            pinger.cancel()
+            for channel in joined:
+                self.members.get(channel, set()).discard(writer)
+            writer.close()
+
+    async def _ping(self, writer):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            writer.write(b"PING :tmi.twitch.tv\r\n")
+
+    async def _replay(self, channel):
+        # Start each channel at a random point of the dump so channels do not burst together
+        start = random.randrange(len(self.mensajes))
+        duracion = self.mensajes[-1]["offset"] + 1.0
+        origen = time.monotonic() - self.mensajes[start]["offset"] / self.velocidad
+        vuelta = 0
+        while True:
+            for mensaje in self.mensajes[start:]:
+                delay = origen + (vuelta * duracion + mensaje["offset"]) / self.velocidad - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._send(channel, mensaje)
+            start = 0
+            vuelta += 1
+
+    def _send(self, channel, mensaje):
+        tags = {
+            "badges": mensaje["badges"],
+            "display-name": mensaje["username"],
+            "first-msg": "1" if mensaje["first_msg"] else "0",
+            "id": str(uuid.uuid4()),
+            "tmi-sent-ts": str(int(time.time() * 1000)),
+            "user-id": mensaje["user_id"]
+        }
+        if self.on_send is not None:
+            self.on_send(channel, tags, mensaje["text"])
+        tag_string = ";".join(f"{key}={escape_tag_value(value)}" for key, value in tags.items())
+        username = mensaje["username"]
+        line = f"@{tag_string} :{username}!{username}@{username}.tmi.twitch.tv PRIVMSG #{channel} :{mensaje['text']}\r\n"
+        data = line.encode('utf-8')
+        for writer in list(self.members.get(channel, ())):
+            writer.write(data)
+        self.sent += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Twitch IRC server replaying a chat dump")
+    parser.add_argument("--chat", default=os.path.join(os.path.dirname(__file__), '..', 'twitch_chat2.json'))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=16667)
+    parser.add_argument("--velocidad", type=float, default=1.0, help="Speed multiplier of the replay")
+    args = parser.parse_args()
+
+    mensajes = cargar_mensajes(args.chat)
+    servidor = FakeTwitchIRC(mensajes, args.host, args.puerto, args.velocidad).start()
+    print(f"Replaying {len(mensajes)} messages at x{args.velocidad} on {args.host}:{servidor.port}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"{servidor.sent} messages sent to {len(servidor.replays)} channels")
+    except KeyboardInterrupt:
+        servidor.stop()
@@ -0,0 +1,294 @@
+"""
+Prometheus metrics and non-blocking logging shared by the front and the ia service.
+
+Each service keeps its metric definitions in its own metrics.py and imports
+the machinery from here. Metrics are rendered in the Prometheus text
+exposition format by hand, so prometheus_client is not needed.
+
+Values are kept per process, and every sample carries a `process` label
+(host:pid) so the series of different processes never mix. Prometheus
+scrapes one port, and each scrape reaches a single process behind it: with
+several mod_wsgi processes (--processes N) a scrape sees only one of them
+and the others' series go stale in between. There is no multiprocess
+aggregation here; run each service as one process with threads (the
+mod_wsgi-express default, as server_app_*.sh do) for complete scrapes.
+Forked helper processes (the ia WorkerPool) send their observations back
+with their results through take_delta / merge_delta, so their parent
+exports them.
+
+Logging goes through a bounded queue drained by a background thread, so a
+slow stdout (mod_wsgi's error log, a pipe) never blocks a request. Per-message
+lines are sampled with LOG_SAMPLE_RATE; lines that find the queue full are
+dropped and counted instead of waiting.
+"""
+import os, queue, random, socket, threading, time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from sub-millisecond tokenization to multi-second queueing
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Fraction of per-message log lines that are written
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _process_label():
+    return ("process", f"{socket.gethostname()}:{os.getpid()}")
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, *extra):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> value
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            lines.extend(self._samples(_process_label()))
+        return lines
+
+    def _empty(self):
+        return {}
+
+    def take(self):
+        """The values observed since the last take (or reset), clearing them"""
+        with self.lock:
+            values, self.values = self.values, self._empty()
+        return values
+
+
+class Counter(_Metric):
+    """Monotonic count, optionally split by labels."""
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values = self._empty()
+
+    def _empty(self):
+        return {(): 0} if not self.labels else {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Current count, including what other processes merged into it"""
+        key = self._key(labels)
+        with self.lock:
+            return self.values.get(key, 0)
+
+    def merge(self, values):
+        with self.lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+    def _samples(self, process):
+        return [f"{self.name}{_format_labels(self.labels, key, process)} {_format_value(value)}"
+                for key, value in self.values.items()]
+
+
+class Gauge(_Metric):
+    """Value read from a function at scrape time (queue depths, in-flight counts)."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, function):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def take(self):
+        return {}  # Read from the function, nothing to ship
+
+    def _samples(self, process):
+        try:
+            value = self.function()
+        except Exception:
+            return []
+        return [] if value is None else [f"{self.name}{_format_labels((), (), process)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, optionally split by labels."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def merge(self, values):
+        with self.lock:
+            for key, (counts, total, count) in values.items():
+                entry = self.values.get(key)
+                if entry is None:
+                    entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the `with` block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self, process):
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, process, ('le', _format_value(bound)))} {cumulative}")
+            labels = _format_labels(self.labels, key, process)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render():
+    """
+    Every metric of this process in the Prometheus text format
+
+    Returns:
+    str: Body for a /metrics response (content type CONTENT_TYPE)
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def take_delta():
+    """
+    Values observed by this process since the last call, cleared afterwards: run in a
+    forked worker (after reset()) to send its observations to the parent
+
+    Returns:
+    dict: metric name -> values, picklable, for merge_delta
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    delta = {}
+    for metric in metrics:
+        values = metric.take()
+        if values and values != {(): 0}:
+            delta[metric.name] = values
+    return delta
+
+
+def merge_delta(delta):
+    """Add the values of a take_delta() from another process to this process' metrics"""
+    with _registry_lock:
+        by_name = {metric.name: metric for metric in _registry}
+    for name, values in delta.items():
+        metric = by_name.get(name)
+        if metric is not None:
+            metric.merge(values)
+
+
+def reset():
+    """Clear every value, e.g. in a forked child so the parent's values are not sent back twice"""
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        metric.take()
+
+
+class _AsyncLog:
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _ensure_writer(self):
+        # Started lazily (and again after a fork, where the thread does not survive)
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._write, name="log-writer", daemon=True)
+                    self.thread.start()
+
+    def _write(self):
+        while True:
+            line = self.queue.get()
+            try:
+                print(line, flush=True)
+            except Exception:
+                pass
+
+    def put(self, line):
+        self._ensure_writer()
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+            log_lines_dropped.inc()
+
+
+log_lines_dropped = Counter("log_lines_dropped_total", "Log lines dropped because the log queue was full")
+_log = _AsyncLog(LOG_QUEUE_SIZE)
+
+
+def log(message, sample_rate=1.0):
+    """
+    Write a log line from a background thread, without blocking the caller
+
+    Parameters:
+    message (str): Line to write
+    sample_rate (float): Probability of writing it (use LOG_SAMPLE_RATE for per-message lines)
+    """
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    _log.put(message)
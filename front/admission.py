@@ -0,0 +1,233 @@
+import math, random, re, threading, time
+from collections import OrderedDict
+import metrics
+
+# Holders of these badges are sampled first when their channel is over capacity
+LOW_RISK_BADGES = ("broadcaster", "moderator", "vip")
+
+
+class RateMeter:
+    """Events per second, averaged with an exponential decay of `half_life` seconds."""
+
+    def __init__(self, half_life=5.0):
+        self.half_life = half_life
+        self.value = 0.0
+        self.updated = time.monotonic()
+
+    def _decay(self, now):
+        self.value *= 0.5 ** ((now - self.updated) / self.half_life)
+        self.updated = now
+
+    def add(self, count=1, now=None):
+        self._decay(time.monotonic() if now is None else now)
+        self.value += count
+
+    def rate(self, now=None):
+        self._decay(time.monotonic() if now is None else now)
+        return self.value * math.log(2) / self.half_life
+
+
+class _ChannelLoad:
+    def __init__(self, half_life):
+        # Arrival rates of first-time chatters, low-risk and other messages
+        self.arrivals = {kind: RateMeter(half_life) for kind in ("first", "low_risk", "other")}
+        self.admit = {"first": 1.0, "low_risk": 1.0, "other": 1.0}  # Probability of scoring a message of each kind
+        self.seen = OrderedDict()  # normalized text -> [verdict or None while in flight, waiting callbacks, expires]
+        self.approved = OrderedDict()  # username -> approved messages
+        self.counts = {"scored": 0, "priority": 0, "reused": 0, "sampled_out": 0}
+
+
+class AdmissionController:
+    """
+    Admission control in front of the moderation pipeline.
+
+    Measures each channel's message arrival rate against the inference
+    throughput the pipeline observes, and splits that capacity between the
+    channels max-min fairly: quiet channels keep everything they need and busy
+    ones share the rest. A channel arriving faster than its share is degraded
+    by policy instead of queueing without limit:
+      - first-time chatters (the "first-msg" tag) are always scored, ahead of the queue
+      - a text already seen in the channel within `window` seconds reuses the
+        verdict of the first one (or waits for it) instead of calling the model
+      - the rest of the share goes to the other messages, sampled at random;
+        low-risk messages (privileged badges, emote-only messages, chatters
+        with `trusted_after` approved messages) are only scored once every
+        other message fits, and are reported as "sampled" otherwise
+    The pipeline's max_wait still skips whatever would be late. Callbacks
+    receive (approved, reasons), or the reason the message was not scored
+    ("sampled", or the pipeline's "overflow" / "stale").
+    """
+
+    def __init__(self, pipeline, target_latency=2.0, window=30.0, headroom=0.9, trusted_after=3,
+                 max_seen=1000, half_life=5.0):
+        """
+        Parameters:
+        pipeline (ModerationPipeline): Where admitted messages are moderated
+        target_latency (float): Seconds of backlog above which admissions are cut further to drain it
+        window (float): Seconds a text's verdict is reused for
+        headroom (float): Fraction of the measured capacity handed out to the channels
+        trusted_after (int): Approved messages after which a chatter is low-risk
+        max_seen (int): Texts and chatters remembered per channel
+        half_life (float): Seconds over which arrival rates are averaged
+        """
+        self.pipeline = pipeline
+        self.target_latency = target_latency
+        self.window = window
+        self.headroom = headroom
+        self.trusted_after = trusted_after
+        self.max_seen = max_seen
+        self.half_life = half_life
+        self.channels = {}  # channel -> _ChannelLoad
+        self.lock = threading.Lock()
+        self.random = random.Random()
+        self.capacity = None
+        self.last_update = 0
+
+    def submit(self, text, callback, channel, username=None, tags=None):
+        """
+        Moderate a chat message, or settle it without the model if its channel is over capacity.
+
+        Parameters:
+        text (str): Message to moderate
+        callback (callable): Called with (approved, reasons) or with the reason it was not scored
+        channel (str): Channel the message comes from
+        username (str): Its author
+        tags (dict): Its IRCv3 tags
+        """
+        tags = tags or {}
+        key = re.sub(r"\s+", " ", text.strip().lower())
+        now = time.monotonic()
+        reused = None
+        with self.lock:
+            load = self.channels.get(channel)
+            if load is None:
+                load = self.channels[channel] = _ChannelLoad(self.half_life)
+            if tags.get("first-msg") == "1":
+                kind = "first"
+            elif self._low_risk(load, username, tags):
+                kind = "low_risk"
+            else:
+                kind = "other"
+            load.arrivals[kind].add(1, now)
+            if now - self.last_update > 0.5:
+                self._update_shares(now)
+            self._expire(load, now)
+
+            seen = load.seen.get(key)
+            if seen is not None and seen[0] is not None and seen[2] <= now:
+                seen = None
+            over_capacity = load.admit["other"] < 1.0 or load.admit["low_risk"] < 1.0
+            priority = kind == "first" and over_capacity
+            if over_capacity and kind != "first" and seen is not None:
+                load.counts["reused"] += 1
+                if seen[0] is None:
+                    seen[1].append(callback)  # Same text still being moderated
+                    return
+                reused = seen[0]
+            elif self.random.random() >= load.admit[kind]:
+                load.counts["sampled_out"] += 1
+                reused = "sampled"
+            else:
+                load.counts["priority" if priority else "scored"] += 1
+                if seen is None or seen[0] is not None:
+                    seen = load.seen[key] = [None, [], now + self.window]
+                    load.seen.move_to_end(key)
+                    while len(load.seen) > self.max_seen:
+                        load.seen.popitem(last=False)
+
+        if reused is not None:
+            callback(reused)
+            return
+        self.pipeline.submit(text, lambda result: self._on_verdict(load, key, seen, username, callback, result),
+                             channel=channel, priority=priority)
+
+    def _on_verdict(self, load, key, seen, username, callback, result):
+        waiting = []
+        with self.lock:
+            # The entry may have left load.seen meanwhile; its waiting callbacks are still served
+            if seen[0] is None:
+                waiting, seen[1] = seen[1], []
+                if isinstance(result, tuple):
+                    seen[0] = result
+                elif load.seen.get(key) is seen:
+                    del load.seen[key]  # Not scored: the next copy tries again
+            if isinstance(result, tuple) and result[0] and username:
+                load.approved[username] = load.approved.get(username, 0) + 1
+                load.approved.move_to_end(username)
+                while len(load.approved) > self.max_seen:
+                    load.approved.popitem(last=False)
+        for pending in [callback] + waiting:
+            try:
+                pending(result)
+            except Exception as e:
+                metrics.errors.inc(where="verdict_callback")
+                metrics.log(f"Error publishing moderation verdict: {str(e)}")
+
+    def _low_risk(self, load, username, tags):
+        badges = tags.get("badges", "")
+        if any(badge.split("/")[0] in LOW_RISK_BADGES for badge in badges.split(",") if badge):
+            return True
+        if tags.get("emote-only") == "1":
+            return True
+        return load.approved.get(username, 0) >= self.trusted_after
+
+    def _expire(self, load, now):
+        # Called with self.lock held: forget texts older than the window
+        while load.seen:
+            key, seen = next(iter(load.seen.items()))
+            if seen[2] > now or seen[0] is None:
+                break
+            del load.seen[key]
+
+    def _update_shares(self, now):
+        # Called with self.lock held: split the capacity between the channels (water-filling)
+        self.last_update = now
+        self.capacity = self.pipeline.capacity()
+        rates = {}
+        for channel, load in list(self.channels.items()):
+            rate = sum(meter.rate(now) for meter in load.arrivals.values())
+            if rate < 0.01 and not load.seen:
+                del self.channels[channel]
+                continue
+            rates[channel] = rate
+        if self.capacity is None:
+            return
+        budget = self.capacity * self.headroom
+        backlog_latency = self.pipeline.backlog() / self.capacity
+        if backlog_latency > self.target_latency:
+            # Behind already: admit less until the backlog drains
+            budget *= self.target_latency / backlog_latency
+        remaining = sorted(rates.items(), key=lambda item: item[1])
+        while remaining:
+            share = budget / len(remaining)
+            channel, rate = remaining[0]
+            if rate > share:
+                for channel, rate in remaining:
+                    self._split_share(self.channels[channel], share, now)
+                break
+            self.channels[channel].admit = {"first": 1.0, "low_risk": 1.0, "other": 1.0}
+            budget -= rate
+            remaining.pop(0)
+
+    def _split_share(self, load, share, now):
+        # First-time chatters first, then the other messages, then the low-risk ones
+        load.admit["first"] = 1.0
+        share -= load.arrivals["first"].rate(now)
+        for kind in ("other", "low_risk"):
+            rate = load.arrivals[kind].rate(now)
+            load.admit[kind] = min(1.0, max(0.0, share) / rate) if rate > 0 else 1.0
+            share -= rate
+
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return {
+                "capacity_per_second": self.capacity,
+                "channels": {
+                    channel: {
+                        "arrivals_per_second": {kind: round(meter.rate(now), 2) for kind, meter in load.arrivals.items()},
+                        "admit": {kind: round(admit, 3) for kind, admit in load.admit.items()},
+                        **load.counts
+                    } for channel, load in self.channels.items()
+                }
+            }
@@ -1,8 +1,20 @@
 from flask import Flask, render_template, request, Response, jsonify, make_response
-import socket, threading, json, datetime, re, uuid
-import requests, os
+import threading, datetime, uuid, itertools, json, socket, queue
+import os
 from dotenv import load_dotenv
-from collections import defaultdict
+from stream_client import ModerationStreamClient, ModerationBatchClient
+from moderation_client import ModerationClient
+from irc import IRCIngest
+from pipeline import ModerationPipeline
+from admission import AdmissionController
+from flood import FloodDetector
+from journal import ModerationJournal
+from message_ids import get_message_id, normalize_message_id
+from expiry import ExpiryScheduler
+from broadcaster import Broadcaster, encode_event, format_frame
+from shared_state import create_state
+import metrics
+from collections import defaultdict, deque
 import time
 
 # Load .env from parent directory
@@ -22,19 +34,88 @@ app = Flask(
 
 # Simple session storage (in production, use Redis or database)
 user_sessions = {}  # session_id -> user data
+user_sessions_lock = threading.Lock()
 
-HOST = "irc.chat.twitch.tv"
-PORT = 6667
+# Sessions expire after this long without any request
+SESSION_TTL_SECONDS = float(os.getenv('SESSION_TTL_SECONDS', '3600'))
+# ...or this long after their last event stream closed, so a channel is left soon after its last viewer
+VIEWER_GRACE_SECONDS = float(os.getenv('VIEWER_GRACE_SECONDS', '30'))
+
+# Overridable to point the front at a local stand-in (see carga/servidor_irc.py)
+HOST = os.getenv('IRC_HOST', "irc.chat.twitch.tv")
+PORT = int(os.getenv('IRC_PORT', '6667'))
 NICK = "justinfan12345"  # Anonymous
 TOKEN = "oauth:"
 
-if os.getenv('LOCAL'):
+# One asyncio engine reads every channel, over as few IRC connections as possible
+irc_ingest = IRCIngest(HOST, PORT, NICK, TOKEN)
+
+if os.getenv('MODERATION_API_URL'):
+    MODERATION_API_URL = os.getenv('MODERATION_API_URL')
+elif os.getenv('LOCAL'):
     MODERATION_API_URL = "http://localhost:7012/moderate"
 else:
     MODERATION_API_URL = "http://gate.dcc.uchile.cl/stream-mod/ia/moderate"
 
+# With MODERATION_STREAM set, every message goes through one long-lived
+# NDJSON stream per process instead of a new HTTP request. mod_wsgi cannot
+# serve the stream: once ia refuses it, or while the stream waits to reconnect,
+# messages go in /moderate/batch requests
+moderation_stream = ModerationStreamClient(MODERATION_API_URL + "/stream") if os.getenv('MODERATION_STREAM') else None
+moderation_batch = ModerationBatchClient(
+    MODERATION_API_URL + "/batch", max_in_flight=int(os.getenv('MODERATION_MAX_IN_FLIGHT', '4'))
+) if moderation_stream is not None else None
+
+# Shared by every channel: pooled connections, fair in-flight limit, adaptive timeout and circuit breaker
+moderation_client = ModerationClient(
+    MODERATION_API_URL,
+    stream=moderation_stream,
+    batch=moderation_batch,
+    max_in_flight=int(os.getenv('MODERATION_MAX_IN_FLIGHT', '4')),
+    timeout=float(os.getenv('MODERATION_TIMEOUT', '2')),
+    failure_threshold=int(os.getenv('MODERATION_BREAKER_FAILURES', '5')),
+    reset_timeout=float(os.getenv('MODERATION_BREAKER_RESET', '10'))
+)
+
 MODERATED_MESSAGES_FILE = "/moderate_json"
 
+# Manually moderated messages, shared by every channel; imports MODERATED_MESSAGES_FILE the first time
+moderation_journal = ModerationJournal(
+    os.getenv('MODERATED_MESSAGES_JOURNAL', MODERATED_MESSAGES_FILE + ".jsonl"),
+    legacy_path=MODERATED_MESSAGES_FILE,
+    normalize_id=normalize_message_id
+)
+
+# Number of chat events (messages, verdict updates, filter changes) kept per channel
+CHAT_BUFFER_SIZE = int(os.getenv('CHAT_BUFFER_SIZE', '500'))
+
+# Events published within this window are sent to a viewer as one frame
+EVENTS_COALESCE_SECONDS = float(os.getenv('EVENTS_COALESCE_MS', '50')) / 1000.0
+
+# State shared by the front processes: "local" (a single process), "sqlite" (processes of one
+# host) or "redis". One process per channel is elected to read its IRC and moderate it, and
+# publishes the chat events to a shared log that every process relays to its own viewers
+# ("local" skips the log: the one process publishes straight to its viewers)
+shared_state = create_state(
+    os.getenv('STATE_BACKEND', 'local'),
+    capacity=CHAT_BUFFER_SIZE,
+    sqlite_path=os.getenv('STATE_SQLITE_PATH', '/tmp/stream-mod-front.db'),
+    redis_url=os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+)
+
+# Near-duplicate and flood detection of each channel (Spam), see flood.FloodDetector
+FLOOD_DETECTION = os.getenv('FLOOD_DETECTION', '1') in ('1', 'true')
+FLOOD_WINDOW_SECONDS = float(os.getenv('FLOOD_WINDOW_SECONDS', '30'))
+FLOOD_COPYPASTA_USERS = int(os.getenv('FLOOD_COPYPASTA_USERS', '3'))
+FLOOD_USER_LIMIT = int(os.getenv('FLOOD_USER_LIMIT', '8'))  # Messages per 10 seconds
+FLOOD_REUSE_DISTANCE = int(os.getenv('FLOOD_REUSE_DISTANCE', '0'))
+
+# Identifies this process in the per-channel leader elections
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# A channel's leader renews its lease every third of this; if it dies, another process takes over after it
+LEADER_LEASE_SECONDS = float(os.getenv('LEADER_LEASE_SECONDS', '15'))
+
 def set_session_cookie(response, session_id):
     """Consistent session cookie setting"""
     response.set_cookie(
@@ -53,6 +134,9 @@ class ChatManager:
         self.lock = threading.Lock()
 
     def get_or_create_chat(self, channel_name, session_id):
+        # Any front process can serve the session's next request
+        shared_state.set("session:" + session_id, {"channel": channel_name, "last_activity": time.time()},
+                         SESSION_TTL_SECONDS)
         with self.lock:
             # Check if channel already has an active chat
             if channel_name in self.active_chats:
@@ -86,17 +170,42 @@ class ChatManager:
                         del self.active_chats[chat_session.channel_name]
     
     def get_chat_for_session(self, session_id):
-        return self.user_sessions.get(session_id)
+        chat_session = self.user_sessions.get(session_id)
+        if chat_session is None:
+            # The session may have been created by another front process
+            shared = shared_state.get("session:" + session_id)
+            if shared is not None:
+                chat_session = self.get_or_create_chat(shared["channel"], session_id)
+        return chat_session
 
 class ChatSession:
     def __init__(self, channel_name):
         self.channel_name = channel_name
-        self.chat_lines = []
+        # Recent chat messages, verdict updates and filter changes, serialized once for every viewer
+        self.chat_events = Broadcaster(CHAT_BUFFER_SIZE)
+        # Sequence id of the last event relayed from the channel's shared log
+        self.last_shared_seq = 0
+        # Whether this process reads and moderates the channel for every process
+        self.is_leader = False
+        # Start from the clock so ids keep increasing when another process takes over the channel
+        self.message_ids = itertools.count(int(time.time() * 1000))
+        # IDs of the last CHAT_BUFFER_SIZE messages, for dedup
+        self.recent_message_order = deque(maxlen=CHAT_BUFFER_SIZE)
+        self.recent_message_ids = set()
+        # Copypastas and floods are flagged as Spam here, and repeated texts reuse their verdict
+        self.flood = FloodDetector(
+            window=FLOOD_WINDOW_SECONDS,
+            copypasta_users=FLOOD_COPYPASTA_USERS,
+            user_limit=FLOOD_USER_LIMIT,
+            reuse_distance=FLOOD_REUSE_DISTANCE
+        ) if FLOOD_DETECTION else None
+        # Appends to the shared log and journal lookups run on this channel's publisher thread,
+        # in order, so neither the IRC ingest loop nor the moderation workers wait on the backend
+        self.outbox = queue.Queue(maxsize=4 * CHAT_BUFFER_SIZE)
+        threading.Thread(target=self._publisher, name=f"publisher-{channel_name}", daemon=True).start()
         self.user_sessions = set()
         self.stop_event = threading.Event()
-        self.chat_thread = None
         self.lock = threading.Lock()
-        self.moderated_messages = load_moderated_messages()
         self.selected_reasons = set([
             'Garabato',
             'Spam',
@@ -109,6 +218,10 @@ class ChatSession:
             'Otros',
             'Amenaza/acoso violento'
         ])
+        # Filters chosen by a viewer served by another process
+        shared_reasons = shared_state.get("filters:" + channel_name)
+        if shared_reasons is not None:
+            self.selected_reasons = set(shared_reasons)
     
     def add_user_session(self, session_id):
         with self.lock:
@@ -123,196 +236,254 @@ class ChatSession:
             return len(self.user_sessions) > 0
     
     def start(self):
-        if self.chat_thread is None or not self.chat_thread.is_alive():
-            self.chat_thread = threading.Thread(
-                target=self._connect_to_chat, 
-                daemon=True
-            )
-            self.chat_thread.start()
+        self.stop_event.clear()
+        self.check_leadership()
     
     def stop(self):
         self.stop_event.set()
-        if self.chat_thread and self.chat_thread.is_alive():
-            self.chat_thread.join(timeout=5)
-    
-    def update_selected_reasons(self, reasons):
         with self.lock:
-            self.selected_reasons = set(reasons)
-    
-    def toggle_message_moderation(self, username, timestamp, text, reason):
-        message_id = get_message_id(username, timestamp, text)
+            if self.is_leader:
+                irc_ingest.part(self.channel_name)
+                shared_state.release("leader:" + self.channel_name, PROCESS_ID)
+                self.is_leader = False
+        self.chat_events.close()
+        try:
+            self.outbox.put(None, timeout=5)  # The publisher exits once the queued events are appended
+        except queue.Full:
+            pass
 
+    def check_leadership(self):
+        """Take or renew the channel's lease: only its holder reads the channel and moderates it"""
+        leader = shared_state.acquire("leader:" + self.channel_name, PROCESS_ID, LEADER_LEASE_SECONDS)
         with self.lock:
-            if message_id in self.moderated_messages:
-                # Unmoderate
-                del self.moderated_messages[message_id]
-                self._persist_moderated_messages()
-                action = "unmoderated"
-            else:
-                # Moderate
-                self.moderated_messages[message_id] = {
-                    "id": message_id,
-                    "username": username,
-                    "text": text,
-                    "reason": reason,
-                    "timestamp": datetime.datetime.now().isoformat()
-                }
-                self._persist_moderated_messages()
-                action = "moderated"
-
-        return action
-
-    def _persist_moderated_messages(self):
+            if self.stop_event.is_set():
+                return
+            if leader and not self.is_leader:
+                metrics.log(f"Leading channel {self.channel_name}")
+                irc_ingest.join(self.channel_name, self._on_irc_message)
+            elif not leader and self.is_leader:
+                metrics.log(f"Lost the lead of channel {self.channel_name}")
+                irc_ingest.part(self.channel_name)
+            self.is_leader = leader
+
+    def publish(self, event, data):
+        """
+        Queue an event for the channel's viewers. Never blocks: the append runs
+        on the channel's publisher thread.
+        """
+        self._enqueue(lambda: self._append(event, data))
+
+    def _append(self, event, data):
+        """
+        Append an event to the channel's shared log, from which every process relays it.
+        With a single process (LocalState) there is nothing to relay: it goes
+        straight to this process' viewers.
+        """
+        encoded = encode_event(event, data)
+        if shared_state.shared:
+            shared_state.append(self.channel_name, encoded)
+        else:
+            self.chat_events.publish(event, data, encoded=encoded)
+
+    def _enqueue(self, job):
         try:
-            with open(MODERATED_MESSAGES_FILE, 'w', encoding='utf-8') as f:
-                json.dump({'messages': list(self.moderated_messages.values())}, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Error saving moderated messages: {e}")
+            self.outbox.put_nowait(job)
+        except queue.Full:
+            # The shared state backend is stalled: drop rather than block the caller
+            metrics.errors.inc(where="publish_overflow")
+            metrics.log(f"Publish queue of {self.channel_name} full, event dropped", sample_rate=metrics.LOG_SAMPLE_RATE)
 
+    def _publisher(self):
+        while True:
+            job = self.outbox.get()
+            if job is None:
+                return
+            try:
+                job()
+            except Exception as e:
+                metrics.errors.inc(where="publish")
+                metrics.log(f"Error publishing to {self.channel_name}: {str(e)}")
+
+    def relay_shared_events(self):
+        """Publish the events appended to the shared log since the last call to this process' viewers"""
+        for seq, encoded in shared_state.read(self.channel_name, self.last_shared_seq):
+            event = json.loads(encoded)
+            if event["type"] == "filters":
+                with self.lock:
+                    self.selected_reasons = set(event["data"])
+            self.chat_events.publish(event["type"], event["data"], seq=seq, encoded=encoded)
+            self.last_shared_seq = seq
     
-    def _connect_to_chat(self):
-        sock = socket.socket()
-        try:
-            sock.connect((HOST, PORT))
-            sock.send(f"PASS {TOKEN}\n".encode('utf-8'))
-            sock.send(f"NICK {NICK}\n".encode('utf-8'))
-            sock.send(f"JOIN #{self.channel_name}\n".encode('utf-8'))
+    def update_selected_reasons(self, reasons):
+        with self.lock:
+            self.selected_reasons = set(reasons)
+        shared_state.set("filters:" + self.channel_name, list(reasons), SESSION_TTL_SECONDS)
+        self.publish("filters", list(reasons))
+    
+    def toggle_message_moderation(self, username, timestamp, text, reason, message_id=None):
+        if message_id is None:
+            message_id = get_message_id(username, timestamp, text)
+
+        # The journal has its own lock: toggling never blocks this channel
+        return moderation_journal.toggle({
+            "id": message_id,
+            "username": username,
+            "text": text,
+            "reason": reason,
+            "timestamp": datetime.datetime.now().isoformat()
+        })
 
-            while not self.stop_event.is_set():
-                try:
-                    sock.settimeout(1.0)  # Allow periodic checking of stop_event
-                    response = sock.recv(2048).decode('utf-8')
-                    
-                    if "PING" in response:
-                        sock.send("PONG :tmi.twitch.tv\n".encode('utf-8'))
-                    else:
-                        matches = re.search(r'^:(\w+)!.*? PRIVMSG #[\w]+ :(.+)$', response)
-                        if matches:
-                            username = matches.group(1)
-                            message = matches.group(2).strip()
-                            timestamp = datetime.datetime.now().strftime('%H:%M:%S')
-                            message_id = get_message_id(username, timestamp, message)
-
-                            # Default values
-                            is_moderated = False
-                            moderation_reasons = []
-
-                            # Check if message is manually moderated
-                            with self.lock:
-                                if message_id in self.moderated_messages:
-                                    is_moderated = True
-                                    moderation_reasons = ["Moderado manualmente"]
-                                else:
-                                    # Check with AI
-                                    approved, reasons = moderate_message(message)
-                                    if not approved:
-                                        moderation_reasons = [reason for reason in reasons if reason != "No baneable"]
-                                        # Flag if at least one reason matches the selected ones
-                                        is_moderated = any(r in self.selected_reasons for r in reasons)
-                                    else:
-                                        moderation_reasons = ["No baneable"]
-
-                                self.chat_lines.append({
-                                    "text": message,
-                                    "moderated": is_moderated,
-                                    "reasons": moderation_reasons,
-                                    "username": username,
-                                    "timestamp": timestamp
-                                })
-                                
-                except socket.timeout:
-                    continue  # Continue checking stop_event
-                except Exception as e:
-                    print(f"Error in chat connection: {str(e)}")
-                    break
-        except Exception as e:
-            print(f"Failed to connect to chat: {str(e)}")
-        finally:
-            sock.close()
+    def _on_irc_message(self, channel, username, message, tags):
+        # Runs on the IRC ingest loop, which must not block: only drop repeats here
+        # and hand the message to the channel's publisher thread
+        if self.stop_event.is_set():
+            return
+        timestamp = datetime.datetime.now().strftime('%H:%M:%S')
+        message_id = get_message_id(username, timestamp, message, tags)
 
-# Global chat manager
-chat_manager = ChatManager()
+        with self.lock:
+            # The same message delivered twice (e.g. around a reconnect) is shown once
+            if message_id in self.recent_message_ids:
+                return
+            if len(self.recent_message_order) == self.recent_message_order.maxlen:
+                self.recent_message_ids.discard(self.recent_message_order[0])
+            self.recent_message_order.append(message_id)
+            self.recent_message_ids.add(message_id)
+
+        self._enqueue(lambda: self._append_message(username, message, tags, timestamp, message_id))
+
+    def _append_message(self, username, message, tags, timestamp, message_id):
+        # Runs on the publisher thread: append the message right away as pending
+        # and leave the AI verdict to the moderation pipeline
+        line = {
+            "id": next(self.message_ids),
+            "message_id": message_id,
+            "text": message,
+            "moderated": False,
+            "reasons": [],
+            "status": "pending",
+            "username": username,
+            "timestamp": timestamp
+        }
+        # Appended here rather than queued, so it precedes any update of the line. A copy,
+        # since the verdict is set on the line later: it travels in its own update event
+        self._append("message", dict(line))
 
-def load_moderated_messages():
-    """Load previously moderated messages from file"""
-    if os.path.exists(MODERATED_MESSAGES_FILE):
+        metrics.messages.inc(channel=self.channel_name)
         try:
-            with open(MODERATED_MESSAGES_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                messages = data.get('messages', [])
-                # Convert list -> dict by ID
-                return { msg['id']: msg for msg in messages }
-        except Exception as e:
-            print(f"Error loading moderated messages: {e}")
-    else:
-        print(f"No moderated messages file found at {MODERATED_MESSAGES_FILE}")
-    return {}
-
-def save_moderated_message(message_id, username, text, reason):
-    """Save or update a single moderated message"""
-    try:
-        # Load existing data
-        if os.path.exists(MODERATED_MESSAGES_FILE):
-            with open(MODERATED_MESSAGES_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            metrics.irc_lag_seconds.observe(max(0.0, time.time() - int(tags["tmi-sent-ts"]) / 1000.0))
+        except (KeyError, TypeError, ValueError):
+            pass  # Untagged message: no send time to measure from
+
+        score = lambda callback: admission_control.submit(message, callback, self.channel_name,
+                                                          username=username, tags=tags)
+        if self.flood is None:
+            score(lambda result: self._apply_verdict(line, result))
         else:
-            data = {'messages': []}
-
-        # Remove any message with the same id
-        data['messages'] = [msg for msg in data['messages'] if msg['id'] != message_id]
-
-        # Add the new version
-        data['messages'].append({
-            'id': message_id,
-            'username': username,
-            'text': text,
-            'reason': reason,
-            'timestamp': datetime.datetime.now().isoformat()
-        })
+            self.flood.submit(message, username, lambda result, spam: self._apply_verdict(line, result, spam), score)
+
+    def _apply_verdict(self, line, result, spam=()):
+        """
+        Store the AI verdict of a pending chat line and publish it as an update
+
+        Parameters:
+        line (dict): The chat line
+        result: (approved, reasons), or the reason the model did not score it
+        spam (List[str]): Signals of the flood detector; any of them adds "Spam" to the verdict
+        """
+        if spam:
+            if isinstance(result, str):
+                result = (False, ["Spam"])
+            elif "Spam" not in result[1]:
+                result = (False, [reason for reason in result[1] if reason != "No baneable"] + ["Spam"])
+        with self.lock:
+            if isinstance(result, str):
+                # Not scored by the model: "sampled", "overflow" or "stale"
+                line["status"] = "unscored"
+                line["unscored_reason"] = result
+                metrics.verdicts.inc(channel=self.channel_name, category=result)
+            else:
+                approved, reasons = result
+                if not approved:
+                    line["reasons"] = [reason for reason in reasons if reason != "No baneable"]
+                    # Flag if at least one reason matches the selected ones
+                    line["moderated"] = any(r in self.selected_reasons for r in reasons)
+                else:
+                    line["reasons"] = ["No baneable"]
+                for reason in line["reasons"]:
+                    metrics.verdicts.inc(channel=self.channel_name, category=reason)
+                line["status"] = "done"
+        self.publish("update", line)
+
+    def recent_lines(self):
+        """Chat lines still held in the ring buffer, oldest first"""
+        return self.chat_events.snapshot("message")
+
+    def manual_moderation_events(self):
+        """
+        Update events flagging the buffered lines moderated by hand, keyed like the
+        journal on the message_id that toggleModeration sends. Sent after the replay
+        of a viewer's first frame, since a line is always appended before anyone
+        can moderate it.
+        """
+        return [encode_event("update", {"id": line["id"], "moderated": True,
+                                        "reasons": ["Moderado manualmente"], "status": "done"})
+                for line in self.recent_lines() if line["message_id"] in moderation_journal]
 
-        # Save back to file
-        with open(MODERATED_MESSAGES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+# Global chat manager
+chat_manager = ChatManager()
 
-    except Exception as e:
-        print(f"Error saving moderated message: {e}")
+def relay_shared_state():
+    """
+    Background loop of every front process: relays the shared chat events of
+    its channels to its viewers (when the state is shared between processes),
+    and keeps its channel leases up to date.
+    """
+    last_lease_check = 0
+    while True:
+        shared_state.wait(1.0)
+        with chat_manager.lock:
+            chat_sessions = list(chat_manager.active_chats.values())
+        for chat_session in chat_sessions if shared_state.shared else ():
+            try:
+                chat_session.relay_shared_events()
+            except Exception as e:
+                metrics.errors.inc(where="relay")
+                metrics.log(f"Error relaying events of {chat_session.channel_name}: {str(e)}")
+        if time.time() - last_lease_check > LEADER_LEASE_SECONDS / 3:
+            last_lease_check = time.time()
+            for chat_session in chat_sessions:
+                try:
+                    chat_session.check_leadership()
+                except Exception as e:
+                    metrics.errors.inc(where="lease")
+                    metrics.log(f"Error renewing the lease of {chat_session.channel_name}: {str(e)}")
+
+threading.Thread(target=relay_shared_state, name="shared-state-relay", daemon=True).start()
 
-def moderate_message(message):
+def moderate_message(message, channel=None):
     """
     Call the moderation API to check a message.
     Returns (approved: bool, reasons: list[str])
     """
-    try:
-        response = requests.post(
-            MODERATION_API_URL,
-            json={"mensaje": message},
-            timeout=2  # 2 second timeout
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data["status"] == "success":
-                # Handle both single reason and multi-label reasons
-                reasons = data.get("reasons", [])
-                if not reasons and "reason" in data:
-                    # Fallback for single reason format
-                    reasons = [data["reason"]]
-                elif not reasons:
-                    reasons = ["No baneable"]
-                
-                return data["approved"], reasons
-        
-        # If there's any error, approve the message
-        print(f"Moderation API error: {response.text}")
-        return True, ["appropriate"]
-        
-    except Exception as e:
-        print(f"Error calling moderation API: {str(e)}")
-        return True, ["appropriate"]
+    return moderation_client.moderate(message, channel)
+
+# Bounded worker pool moderating chat lines off the IRC read loop
+moderation_pipeline = ModerationPipeline(
+    moderate_message,
+    workers=int(os.getenv('MODERATION_WORKERS', '8')),
+    max_pending=int(os.getenv('MODERATION_QUEUE_SIZE', '1000')),
+    overflow=os.getenv('MODERATION_OVERFLOW', 'drop_oldest'),
+    max_wait=float(os.getenv('MODERATION_MAX_WAIT', '5'))
+)
 
-def get_message_id(username, timestamp, text):
-    """Generate a unique ID for a message"""
-    return f"{username}-{timestamp}-{text}"
+# Keeps verdict latency bounded when chat outpaces inference: per-channel fair shares
+# of the measured throughput, degraded by policy when a channel goes over its share
+admission_control = AdmissionController(
+    moderation_pipeline,
+    target_latency=float(os.getenv('ADMISSION_TARGET_LATENCY', '2')),
+    window=float(os.getenv('ADMISSION_WINDOW', '30'))
+)
 
 def get_or_create_session_id(request):
     """Get session ID from cookie or create new one"""
@@ -333,28 +504,47 @@ def get_or_create_session_id(request):
 
     return session_id
 
-def cleanup_old_sessions():
-    """Clean up sessions older than 1 hour"""
-    current_time = time.time()
-    expired_sessions = []
-    
-    for session_id, session_data in user_sessions.items():
-        if current_time - session_data.get('last_activity', 0) > 3600:  # 1 hour
-            expired_sessions.append(session_id)
-    
-    for session_id in expired_sessions:
-        chat_manager.remove_user_session(session_id)
-        if session_id in user_sessions:
-            del user_sessions[session_id]
+def touch_session(session_id, create=False, **fields):
+    """Record activity of a session, optionally creating it, and push back its expiry"""
+    with user_sessions_lock:
+        if session_id not in user_sessions:
+            # Sessions created by another front process exist here too
+            if not create and shared_state.get("session:" + session_id) is None:
+                return
+            user_sessions[session_id] = {'open_streams': 0}
+        user_sessions[session_id]['last_activity'] = time.time()
+        user_sessions[session_id].update(fields)
+    session_expiry.touch(session_id)
+    chat_session = chat_manager.user_sessions.get(session_id)
+    if chat_session is not None:
+        shared_state.set("session:" + session_id,
+                         {"channel": chat_session.channel_name, "last_activity": time.time()},
+                         SESSION_TTL_SECONDS)
+
+def expire_session(session_id):
+    """Drop a session that has been inactive for SESSION_TTL_SECONDS and leave its channel"""
+    with user_sessions_lock:
+        session_data = user_sessions.get(session_id)
+        if session_data and session_data['open_streams'] > 0:
+            # An open event stream means the viewer is still watching
+            session_expiry.touch(session_id)
+            return
+        shared = shared_state.get("session:" + session_id)
+        if shared is not None and session_data and shared["last_activity"] > session_data['last_activity'] + 1:
+            # Active on another front process since
+            session_expiry.touch(session_id, ttl=shared["last_activity"] + SESSION_TTL_SECONDS - time.time())
+            return
+        user_sessions.pop(session_id, None)
+    chat_manager.remove_user_session(session_id)
+
+# Expires inactive sessions in the background
+session_expiry = ExpiryScheduler(SESSION_TTL_SECONDS, expire_session)
 
 @app.route('/stream-mod/front/', methods=["GET", "POST"])
 def index():
     session_id = get_or_create_session_id(request)
 
-    user_sessions[session_id] = {
-        'last_activity': time.time(),
-        'current_channel': user_sessions.get(session_id, {}).get('current_channel')
-    }
+    touch_session(session_id, create=True)
 
     if request.method == "POST":
         channel = request.form.get("channel_name", "").strip().lower()
@@ -370,7 +560,7 @@ def index():
 
         chat_manager.remove_user_session(session_id)
         chat_session = chat_manager.get_or_create_chat(channel, session_id)
-        user_sessions[session_id]['current_channel'] = channel
+        touch_session(session_id, current_channel=channel)
 
         resp = make_response(render_template(
             "index.html",
@@ -394,8 +584,7 @@ def update_reasons():
     session_id = get_or_create_session_id(request)
     
     # Update session activity
-    if session_id in user_sessions:
-        user_sessions[session_id]['last_activity'] = time.time()
+    touch_session(session_id)
     
     chat_session = chat_manager.get_chat_for_session(session_id)
     
@@ -409,56 +598,12 @@ def update_reasons():
     
     return jsonify({"status": "error", "message": "Invalid request"}), 400
 
-@app.route('/stream-mod/front/filters')
-def filters_stream():
-    session_id = get_or_create_session_id(request)
-    
-    # Update session activity
-    if session_id in user_sessions:
-        user_sessions[session_id]['last_activity'] = time.time()
-    
-    chat_session = chat_manager.get_chat_for_session(session_id)
-    
-    if not chat_session:
-        return jsonify({"status": "error", "message": "No active chat session"}), 400
-    
-    def stream_filters():
-        last_check = time.time()
-        last_filters = set()
-        
-        # Send current filters immediately
-        with chat_session.lock:
-            current_filters = list(chat_session.selected_reasons)
-            last_filters = set(current_filters)
-            yield f"data: {json.dumps({'type': 'filters_update', 'filters': current_filters})}\n\n"
-        
-        while True:
-            # Check if session is still active every 30 seconds
-            current_time = time.time()
-            if current_time - last_check > 30:
-                if not chat_session.has_active_users():
-                    break
-                last_check = current_time
-            
-            # Check for filter changes
-            with chat_session.lock:
-                current_filters = set(chat_session.selected_reasons)
-                if current_filters != last_filters:
-                    last_filters = current_filters
-                    yield f"data: {json.dumps({'type': 'filters_update', 'filters': list(current_filters)})}\n\n"
-            
-            time.sleep(0.5)  # Check every second
-    
-    return Response(stream_filters(), mimetype='text/event-stream')
-
-
 @app.route('/stream-mod/front/toggle_moderation', methods=['POST'])
 def toggle_moderation():
     session_id = get_or_create_session_id(request)
     
     # Update session activity
-    if session_id in user_sessions:
-        user_sessions[session_id]['last_activity'] = time.time()
+    touch_session(session_id)
     
     chat_session = chat_manager.get_chat_for_session(session_id)
     
@@ -466,7 +611,8 @@ def toggle_moderation():
         return jsonify({"status": "error", "message": "No active chat session"}), 400
     
     data = request.get_json()
-    if not data or 'username' not in data or 'timestamp' not in data or 'text' not in data:
+    # Messages are identified by message_id, or by username, timestamp and text for older clients
+    if not data or ('message_id' not in data and ('username' not in data or 'timestamp' not in data or 'text' not in data)):
         return jsonify({"status": "error", "message": "Missing required fields"}), 400
     
     # Handle both single reason (backward compatibility) and multiple reasons
@@ -486,69 +632,136 @@ def toggle_moderation():
         pass  # Let the chat_session method handle this
     
     action = chat_session.toggle_message_moderation(
-        data['username'], 
-        data['timestamp'], 
-        data['text'], 
-        reasons  # Pass the reasons array instead of single reason
+        data.get('username'), 
+        data.get('timestamp'), 
+        data.get('text'), 
+        reasons,  # Pass the reasons array instead of single reason
+        message_id=data.get('message_id')
     )
     
     return jsonify({"status": "success", "action": action})
 
-@app.route('/stream-mod/front/chat')
-def stream_chat():
+@app.route('/stream-mod/front/events')
+def stream_events():
+    """
+    The viewer's single event stream. Each SSE frame carries a JSON array of
+    typed events: "message" (new chat line, possibly pending), "update" (its
+    moderation verdict), "filters" (selected reasons changed) and "keepalive".
+    """
     session_id = get_or_create_session_id(request)
     
     # Update session activity
-    if session_id in user_sessions:
-        user_sessions[session_id]['last_activity'] = time.time()
+    touch_session(session_id)
     
     chat_session = chat_manager.get_chat_for_session(session_id)
     
     if not chat_session:
         return jsonify({"status": "error", "message": "No active chat session"}), 400
     
+    # EventSource sends the id of the last event it received when it reconnects
+    try:
+        resume_from = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        resume_from = 0
+
     def stream():
-        prev_len = 0
+        with user_sessions_lock:
+            session_data = user_sessions.get(session_id)
+            if session_data is not None:
+                session_data['open_streams'] += 1
+        try:
+            yield from stream_frames()
+        finally:
+            closed_last = False
+            if session_data is not None:
+                with user_sessions_lock:
+                    session_data['open_streams'] -= 1
+                    closed_last = session_data['open_streams'] == 0
+            if closed_last:
+                # Viewer gone: expire soon unless they reconnect
+                session_expiry.touch(session_id, ttl=VIEWER_GRACE_SECONDS)
+
+    def stream_frames():
+        last_seq = resume_from
         last_check = time.time()
-        last_ping = time.time()
+
+        # Current filters first, whatever the buffer still holds
+        with chat_session.lock:
+            pending_events = [encode_event("filters", list(chat_session.selected_reasons))]
         
+        first_frame = True
         while True:
-            current_time = time.time()
-            # Send keep-alive ping every 5 seconds
-            if current_time - last_ping > 5:
-                yield ": keep-alive\n\n"
-                last_ping = current_time
+            # Sleeps until something is published, or 5 seconds for a keep-alive
+            frame_from = last_seq
+            events, last_seq = chat_session.chat_events.read(last_seq, timeout=0 if pending_events else 5)
+            if chat_session.chat_events.closed:
+                break
+            if events:
+                # Let a burst accumulate, then send it all in one frame
+                time.sleep(EVENTS_COALESCE_SECONDS)
+                more, last_seq = chat_session.chat_events.read(last_seq, timeout=0)
+                pending_events += events + more
+                if first_frame:
+                    pending_events += chat_session.manual_moderation_events()
+            if pending_events:
+                # The first frame replays the buffer on (re)connect: its lag is not fan-out lag
+                published = chat_session.chat_events.published_after(frame_from) if events and not first_frame else None
+                if published is not None:
+                    metrics.fanout_lag_seconds.observe(time.monotonic() - published)
+                yield format_frame(pending_events, last_seq)
+                pending_events = []
+                first_frame = False
+            else:
+                yield format_frame([encode_event("keepalive", None)])
             
             # Check if session is still active every 30 seconds
+            current_time = time.time()
             if current_time - last_check > 30:
                 if not chat_session.has_active_users():
                     break
+                # Keeps the session alive for the other front processes too
+                touch_session(session_id)
                 last_check = current_time
-            
-            with chat_session.lock:
-                if len(chat_session.chat_lines) > prev_len:
-                    for msg in chat_session.chat_lines[prev_len:]:
-                        yield f"data: {json.dumps(msg)}\n\n"
-                    prev_len = len(chat_session.chat_lines)
-            
-            time.sleep(0.1)  # Small delay to prevent busy waiting
     
     return Response(stream(), mimetype='text/event-stream')
 
+@app.route('/stream-mod/front/stats')
+def stats():
+    """Moderation client, pipeline, admission control, flood detection, IRC ingest, journal and shared state metrics"""
+    return jsonify({
+        "status": "success",
+        "moderation_client": moderation_client.stats(),
+        "pipeline": moderation_pipeline.stats(),
+        "admission": admission_control.stats(),
+        "flood": {chat.channel_name: chat.flood.stats() for chat in list(chat_manager.active_chats.values())
+                  if chat.flood is not None and chat.is_leader},
+        "irc": irc_ingest.stats(),
+        "journal": moderation_journal.stats(),
+        "shared_state": {
+            "backend": type(shared_state).__name__,
+            "process": PROCESS_ID,
+            "leading": [chat.channel_name for chat in list(chat_manager.active_chats.values()) if chat.is_leader]
+        }
+    })
+
+metrics.Gauge("front_moderation_backlog", "Messages waiting for a moderation worker", moderation_pipeline.backlog)
+metrics.Gauge("front_active_channels", "Channels with a chat session in this process", lambda: len(chat_manager.active_chats))
+metrics.Gauge("front_leading_channels", "Channels this process reads and moderates",
+              lambda: sum(1 for chat in list(chat_manager.active_chats.values()) if chat.is_leader))
+
+@app.route('/stream-mod/front/metrics')
+def prometheus_metrics():
+    """
+    Prometheus metrics of this process: IRC and SSE fan-out lag histograms,
+    moderation API latency, and message and verdict counters per channel.
+    """
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/stream-mod/front/embed-chat/<string:channel_name>')
 def embed_chat(channel_name):
     session_id = get_or_create_session_id(request)
     
-    # Check if we already have a session for this user
-    existing_session = None
-    if session_id in user_sessions:
-        existing_session = user_sessions[session_id]
-        existing_session['last_activity'] = time.time()
-    else:
-        user_sessions[session_id] = {
-            "channel": channel_name,
-            "last_activity": time.time()
-        }
+    touch_session(session_id, create=True, channel=channel_name)
 
     # Always get or create chat - this will reuse existing chat if available
     chat_session = chat_manager.get_or_create_chat(channel_name, session_id)
@@ -559,7 +772,7 @@ def embed_chat(channel_name):
         'chat_only.html',
         channel_name=channel_name,
         moderation_reason=moderation_reason,
-        chat_lines=chat_session.chat_lines,  # This will be empty on fresh start
+        chat_lines=chat_session.recent_lines(),  # This will be empty on fresh start
         session_id=session_id
     ))
 
@@ -568,11 +781,5 @@ def embed_chat(channel_name):
 
     return response
 
-
-@app.before_request
-def cleanup_sessions():
-    """Clean up old sessions before each request"""
-    cleanup_old_sessions()
-
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,109 @@
+import json, threading, time
+from ring_buffer import RingBuffer
+
+
+def encode_event(event, data):
+    """
+    Serialize one typed event as it travels inside an SSE frame.
+
+    Returns:
+    bytes: JSON object {"type": event, "data": data}
+    """
+    return json.dumps({"type": event, "data": data}).encode('utf-8')
+
+
+def format_frame(events, event_id=None):
+    """
+    Pack already-encoded events into one Server-Sent Events frame whose data
+    is a JSON array; joining the bytes does not serialize them again.
+
+    Parameters:
+    events (List[bytes]): Events from encode_event
+    event_id (int): Value of the frame's id: field (the last event's sequence id)
+
+    Returns:
+    bytes: The frame
+    """
+    frame = b"id: %d\n" % event_id if event_id is not None else b""
+    return frame + b"data: [" + b",".join(events) + b"]\n\n"
+
+
+class Broadcaster:
+    """
+    Publish/subscribe fan-out of typed events for one channel.
+
+    Every published event is serialized once and kept in a ring buffer under
+    its sequence id; subscribers block until the sequence moves past the last
+    id they sent and then all reuse the same bytes objects. Idle subscribers
+    cost nothing, and publishing wakes each one once.
+    """
+
+    def __init__(self, capacity=500):
+        self.events = RingBuffer(capacity)  # (event type, payload, encoded event, monotonic publish time)
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def publish(self, event, data, seq=None, encoded=None):
+        """
+        Serialize an event and wake up the subscribers.
+
+        Parameters:
+        event (str): Event type
+        data: JSON-serializable payload
+        seq (int): Sequence id already assigned to the event, e.g. by the shared event log
+        encoded (bytes): The event as returned by encode_event, if already serialized
+
+        Returns:
+        int: The event's sequence id
+        """
+        if encoded is None:
+            encoded = encode_event(event, data)
+        with self.condition:
+            seq = self.events.append((event, data, encoded, time.monotonic()), seq)
+            self.condition.notify_all()
+        return seq
+
+    def read(self, last_seq, timeout=None):
+        """
+        Wait (up to `timeout` seconds) for events published after `last_seq`.
+
+        Parameters:
+        last_seq (int): Sequence id of the last event the subscriber has sent,
+            0 for everything still buffered
+        timeout (float): Maximum time to wait when there is nothing new, 0 to not wait
+
+        Returns:
+        (List[bytes], int): The new encoded events and the sequence id to pass next time
+        """
+        with self.condition:
+            if last_seq > self.events.last_seq:
+                # Id from before a server restart: replay the buffer instead
+                last_seq = 0
+            if self.events.last_seq == last_seq and not self.closed and timeout != 0:
+                self.condition.wait(timeout)
+            items = self.events.since(last_seq)
+        if not items:
+            return [], last_seq
+        return [encoded for _, (_, _, encoded, _) in items], items[-1][0]
+
+    def snapshot(self, event):
+        """Payloads of the buffered events of one type, oldest first"""
+        with self.condition:
+            return [data for _, (kind, data, _, _) in self.events.since(0) if kind == event]
+
+    def published_after(self, last_seq):
+        """
+        When the oldest buffered event after `last_seq` was published, to measure fan-out lag
+
+        Returns:
+        float: Its time.monotonic() at publish, or None if no such event is buffered
+        """
+        with self.condition:
+            item = self.events.first_after(last_seq)
+        return item[1][3] if item is not None else None
+
+    def close(self):
+        """Wake up every subscriber for good, e.g. when the channel stops"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
@@ -0,0 +1,77 @@
+import heapq, threading, time
+
+
+class ExpiryScheduler:
+    """
+    Expires keys (e.g. viewer sessions) that were not touched for `ttl` seconds.
+
+    Deadlines live in a dict; a min-heap orders them for a background thread
+    that sleeps until the earliest one. Touching a key only moves its deadline
+    later in the dict (the heap entry is re-checked when it comes up), so a
+    touch costs O(1) and the heap holds about one entry per key. Expired keys
+    are passed to `on_expire` from the scheduler thread, outside its lock.
+    """
+
+    def __init__(self, ttl, on_expire):
+        """
+        Parameters:
+        ttl (float): Default seconds of inactivity before a key expires
+        on_expire (callable): Called with each expired key
+        """
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self.deadlines = {}  # key -> monotonic deadline
+        self.heap = []  # (deadline, key), possibly stale
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="session-expiry", daemon=True)
+        self.thread.start()
+
+    def touch(self, key, ttl=None):
+        """
+        (Re)schedule a key to expire `ttl` seconds from now (default: the scheduler's ttl).
+        """
+        deadline = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.condition:
+            previous = self.deadlines.get(key)
+            self.deadlines[key] = deadline
+            if previous is None or deadline < previous:
+                # New key, or a shorter deadline than the one already in the heap
+                heapq.heappush(self.heap, (deadline, key))
+                if self.heap[0][1] == key:
+                    self.condition.notify()
+
+    def discard(self, key):
+        """Forget a key without expiring it"""
+        with self.condition:
+            self.deadlines.pop(key, None)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    deadline, key = self.heap[0]
+                    now = time.monotonic()
+                    if deadline > now:
+                        self.condition.wait(deadline - now)
+                        continue
+                    heapq.heappop(self.heap)
+                    current = self.deadlines.get(key)
+                    if current is None or current < deadline:
+                        continue  # Discarded, or an entry superseded by a shorter deadline
+                    if current > now:
+                        heapq.heappush(self.heap, (current, key))  # Touched since
+                        continue
+                    del self.deadlines[key]
+                    break
+
+            try:
+                self.on_expire(key)
+            except Exception as e:
+                print(f"Error expiring {key}: {str(e)}")
+
+    def __len__(self):
+        with self.condition:
+            return len(self.deadlines)
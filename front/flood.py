@@ -0,0 +1,235 @@
+import hashlib, re, threading, time
+from collections import deque
+import metrics
+
+SIGNATURE_BITS = 64
+# The signature is split in BANDS bands: two signatures within BANDS - 1 bits of each
+# other share at least one band exactly, so only same-band signatures are compared
+BANDS = 4
+BAND_BITS = SIGNATURE_BITS // BANDS
+# Most recent signatures of a band compared against a new one
+BAND_PROBES = 8
+
+
+def normalize_text(text):
+    """Lowercase, collapse whitespace and cut character runs to two ("jajaaaaa" -> "jajaa")"""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return re.sub(r"(.)\1{2,}", r"\1\1", text)
+
+
+def simhash(text, shingle=3):
+    """
+    64-bit SimHash of a (normalized) text over its character shingles: texts
+    differing in a few characters get signatures differing in a few bits.
+    """
+    if len(text) <= shingle:
+        shingles = [text]
+    else:
+        shingles = [text[i:i + shingle] for i in range(len(text) - shingle + 1)]
+    # Per-bit counts of the shingle hashes, bit-sliced: counters[i] holds bit i of all 64 counts,
+    # so adding a hash is a ripple-carry over a few integers instead of a loop over 64 bits
+    counters = []
+    for s in shingles:
+        carry = int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big')
+        i = 0
+        while carry:
+            if i == len(counters):
+                counters.append(0)
+            counters[i], carry = counters[i] ^ carry, counters[i] & carry
+            i += 1
+    # A signature bit is set where more than half the shingles have it: compare every
+    # count against len(shingles) // 2 at once, from the most significant counter bit down
+    threshold = len(shingles) // 2
+    full = (1 << SIGNATURE_BITS) - 1
+    greater, equal = 0, full
+    for i in range(max(len(counters), threshold.bit_length()) - 1, -1, -1):
+        counter = counters[i] if i < len(counters) else 0
+        if threshold >> i & 1:
+            equal &= counter
+        else:
+            greater |= equal & counter
+            equal &= ~counter & full
+    return greater
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class _Cluster:
+    def __init__(self):
+        self.users = {}        # username -> messages of the cluster still in the window
+        self.verdict = None    # (signature, (approved, reasons)) of the last scored message
+        self.scoring = None    # (signature, waiting callbacks) while a message is with the model
+
+
+class _Entry:
+    __slots__ = ("signature", "username", "time", "cluster")
+
+    def __init__(self, signature, username, time, cluster):
+        self.signature = signature
+        self.username = username
+        self.time = time
+        self.cluster = cluster
+
+
+class FloodDetector:
+    """
+    Streaming near-duplicate and flood detection for one channel.
+
+    Keeps the SimHash signatures of the messages of the last `window` seconds,
+    indexed by band (LSH), so each message is matched against a bounded number
+    of candidates and the window is expired from its oldest end: O(1) amortized
+    work per message whatever the chat rate. Near-duplicates (within `distance`
+    bits) are grouped in clusters. A message is flagged as Spam when:
+      - its cluster was sent by `copypasta_users` different chatters (copypasta),
+        for texts of at least `min_length` characters, so emote walls are not flagged
+      - its author sent `repeat_limit` messages of the cluster (repeated variants)
+      - its author sent more than `user_limit` messages in `user_window` seconds (flood)
+    A message within `reuse_distance` bits of an already-scored one reuses its
+    verdict instead of calling the model, and one within that distance of a
+    message being scored waits for that verdict.
+    """
+
+    def __init__(self, window=30.0, distance=3, copypasta_users=3, min_length=20, repeat_limit=3,
+                 user_window=10.0, user_limit=8, reuse_distance=0, max_entries=5000):
+        """
+        Parameters:
+        window (float): Seconds a message is remembered for
+        distance (int): Signature bits two near-duplicates may differ in (at most BANDS - 1)
+        copypasta_users (int): Chatters sending the same text that make it a copypasta
+        min_length (int): Normalized length below which a text is never a copypasta
+        repeat_limit (int): Near-duplicates of one chatter within the window that make a flood
+        user_window (float): Seconds over which a chatter's message rate is counted
+        user_limit (int): Messages per user_window above which a chatter is flooding
+        reuse_distance (int): Signature bits within which a verdict is reused, 0 for same-signature only
+        max_entries (int): Messages remembered at most, whatever the window
+        """
+        self.window = window
+        self.distance = min(distance, BANDS - 1)
+        self.copypasta_users = copypasta_users
+        self.min_length = min_length
+        self.repeat_limit = repeat_limit
+        self.user_window = user_window
+        self.user_limit = user_limit
+        self.reuse_distance = min(reuse_distance, self.distance)
+        self.max_entries = max_entries
+        self.entries = deque()  # _Entry, oldest first
+        self.bands = {}         # (band, band value) -> deque of _Entry, oldest first
+        self.user_times = {}    # username -> deque of recent message times
+        self.lock = threading.Lock()
+        self.counts = {"messages": 0, "copypasta": 0, "repeated": 0, "flood": 0, "reused": 0, "coalesced": 0, "scored": 0}
+
+    def submit(self, text, username, callback, score):
+        """
+        Check a message for spam and get its verdict, from the model or from a near-duplicate.
+
+        Parameters:
+        text (str): The message
+        username (str): Its author
+        callback (callable): Called with (result, spam), where result is what `score` delivers
+            ((approved, reasons) or the reason it was not scored) and spam the list of signals
+            found ("copypasta", "repeated", "flood"); may be called before submit returns
+        score (callable): Called with a callback to send the message to the model, unless a
+            near-duplicate's verdict is reused
+        """
+        normalized = normalize_text(text)
+        signature = simhash(normalized)
+        now = time.monotonic()
+        reused = None
+        with self.lock:
+            self._expire(now)
+            self.counts["messages"] += 1
+            cluster = self._match(signature)
+            entry = _Entry(signature, username, now, cluster)
+            self.entries.append(entry)
+            for key in self._band_keys(signature):
+                self.bands.setdefault(key, deque()).append(entry)
+            cluster.users[username] = cluster.users.get(username, 0) + 1
+            times = self.user_times.setdefault(username, deque())
+            times.append(now)
+            while times[0] <= now - self.user_window:
+                times.popleft()
+
+            spam = []
+            if len(cluster.users) >= self.copypasta_users and len(normalized) >= self.min_length:
+                spam.append("copypasta")
+            if cluster.users[username] >= self.repeat_limit:
+                spam.append("repeated")
+            if len(times) > self.user_limit:
+                spam.append("flood")
+            for signal in spam:
+                self.counts[signal] += 1
+
+            if cluster.verdict is not None and hamming(signature, cluster.verdict[0]) <= self.reuse_distance:
+                self.counts["reused"] += 1
+                reused = cluster.verdict[1]
+            elif cluster.scoring is not None and hamming(signature, cluster.scoring[0]) <= self.reuse_distance:
+                self.counts["coalesced"] += 1
+                cluster.scoring[1].append(lambda result: callback(result, spam))
+                return
+            else:
+                self.counts["scored"] += 1
+                scoring = (signature, [])
+                if cluster.scoring is None:
+                    cluster.scoring = scoring
+
+        if reused is not None:
+            callback(reused, spam)
+            return
+        score(lambda result: self._on_verdict(cluster, scoring, result, lambda result: callback(result, spam)))
+
+    def _on_verdict(self, cluster, scoring, result, callback):
+        with self.lock:
+            if isinstance(result, tuple):
+                cluster.verdict = (scoring[0], result)
+            waiting = list(scoring[1])
+            if cluster.scoring is scoring:
+                cluster.scoring = None
+        for pending in [callback] + waiting:
+            try:
+                pending(result)
+            except Exception as e:
+                metrics.errors.inc(where="verdict_callback")
+                metrics.log(f"Error publishing moderation verdict: {str(e)}")
+
+    def _band_keys(self, signature):
+        mask = (1 << BAND_BITS) - 1
+        return [(band, (signature >> (band * BAND_BITS)) & mask) for band in range(BANDS)]
+
+    def _match(self, signature):
+        # Called with self.lock held: the cluster of the closest recent near-duplicate, or a new one
+        best = None
+        for key in self._band_keys(signature):
+            candidates = self.bands.get(key)
+            if not candidates:
+                continue
+            for i in range(1, min(BAND_PROBES, len(candidates)) + 1):
+                candidate = candidates[-i]
+                d = hamming(signature, candidate.signature)
+                if d <= self.distance and (best is None or d < best[0]):
+                    best = (d, candidate.cluster)
+                    if d == 0:
+                        return candidate.cluster
+        return best[1] if best is not None else _Cluster()
+
+    def _expire(self, now):
+        # Called with self.lock held: forget the messages older than the window
+        while self.entries and (self.entries[0].time <= now - self.window or len(self.entries) >= self.max_entries):
+            entry = self.entries.popleft()
+            for key in self._band_keys(entry.signature):
+                candidates = self.bands[key]
+                candidates.popleft()  # Entries leave their bands in the order they entered
+                if not candidates:
+                    del self.bands[key]
+            users = entry.cluster.users
+            users[entry.username] -= 1
+            if not users[entry.username]:
+                del users[entry.username]
+            times = self.user_times.get(entry.username)
+            if times is not None and (not times or times[-1] <= now - self.user_window):
+                del self.user_times[entry.username]
+
+    def stats(self):
+        with self.lock:
+            return {"window_messages": len(self.entries), "bands": len(self.bands), **self.counts}
@@ -0,0 +1,239 @@
+import asyncio, random, threading, time
+import metrics
+
+# IRCv3 message-tag value escapes
+TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def unescape_tag_value(value):
+    out = []
+    chars = iter(value)
+    for char in chars:
+        if char == "\\":
+            escaped = next(chars, "")
+            out.append(TAG_ESCAPES.get(escaped, escaped))
+        else:
+            out.append(char)
+    return "".join(out)
+
+
+def parse_irc_line(line):
+    """
+    Parse one IRC line (without its CRLF) into its parts.
+
+    Returns:
+    dict: {"tags": dict, "prefix": str or None, "command": str, "params": List[str]},
+    or None for an empty line
+    """
+    tags = {}
+    if line.startswith('@'):
+        raw_tags, _, line = line[1:].partition(' ')
+        for item in raw_tags.split(';'):
+            key, _, value = item.partition('=')
+            tags[key] = unescape_tag_value(value) if '\\' in value else value
+
+    prefix = None
+    if line.startswith(':'):
+        prefix, _, line = line[1:].partition(' ')
+
+    line, separator, trailing = line.partition(' :')
+    params = line.split()
+    if not params:
+        return None
+    command = params.pop(0).upper()
+    if separator:
+        params.append(trailing)
+    return {"tags": tags, "prefix": prefix, "command": command, "params": params}
+
+
+class _Connection:
+    """
+    One IRC connection carrying a group of channels.
+    """
+
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.index = index
+        self.channels = set()
+        self.writer = None
+        self.task = None
+        self.connected = asyncio.Event()
+
+    async def send(self, line):
+        if self.writer is None:
+            return
+        self.writer.write((line + "\r\n").encode('utf-8'))
+        await self.writer.drain()
+
+    async def join(self, channel):
+        self.channels.add(channel)
+        if self.connected.is_set():
+            await self.engine.join_limiter.wait()
+            await self.send(f"JOIN #{channel}")
+
+    async def part(self, channel):
+        self.channels.discard(channel)
+        if self.connected.is_set():
+            await self.send(f"PART #{channel}")
+
+    async def run(self):
+        backoff = 0
+        while self.channels:
+            try:
+                reader, self.writer = await asyncio.open_connection(self.engine.host, self.engine.port)
+                # Message tags carry each message's id, tmi-sent-ts and user-id
+                await self.send("CAP REQ :twitch.tv/tags")
+                await self.send(f"PASS {self.engine.token}")
+                await self.send(f"NICK {self.engine.nick}")
+                self.connected.set()
+                for channel in list(self.channels):
+                    await self.engine.join_limiter.wait()
+                    await self.send(f"JOIN #{channel}")
+                backoff = 0
+
+                while self.channels:
+                    # readline buffers partial reads and returns one complete line at a time
+                    raw = await reader.readline()
+                    if not raw:
+                        raise ConnectionError("Connection closed by server")
+                    message = parse_irc_line(raw.decode('utf-8', errors='replace').rstrip('\r\n'))
+                    if message is None:
+                        continue
+                    if message["command"] == "PING":
+                        await self.send("PONG :" + (message["params"][-1] if message["params"] else "tmi.twitch.tv"))
+                    elif message["command"] == "RECONNECT":
+                        raise ConnectionError("Server requested reconnect")
+                    elif message["command"] == "PRIVMSG":
+                        self.engine.dispatch(message)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"IRC connection {self.index} error: {str(e)}")
+            finally:
+                self.connected.clear()
+                if self.writer is not None:
+                    self.writer.close()
+                    self.writer = None
+
+            if self.channels:
+                backoff = min(self.engine.max_backoff, max(1, backoff * 2))
+                delay = backoff * random.uniform(0.5, 1.0)
+                print(f"IRC connection {self.index} reconnecting in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+class _JoinLimiter:
+    """
+    Spaces out JOIN commands to stay under Twitch's join rate limit.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_slot = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class IRCIngest:
+    """
+    Asyncio IRC ingest engine multiplexing many channels over a few connections.
+
+    Runs its own event loop in a background thread. Channels are packed onto
+    connections of up to `channels_per_connection` JOINs each; every connection
+    splits the byte stream on CRLF (so several PRIVMSGs per read, or one split
+    across reads, are all delivered), answers PING inline and reconnects with
+    exponential backoff, rejoining its channels.
+
+    Callbacks run on the ingest thread and must not block.
+    """
+
+    def __init__(self, host, port, nick, token, channels_per_connection=50, join_interval=0.5, max_backoff=60):
+        self.host = host
+        self.port = port
+        self.nick = nick
+        self.token = token
+        self.channels_per_connection = channels_per_connection
+        self.max_backoff = max_backoff
+        self.join_limiter = _JoinLimiter(join_interval)
+        self.callbacks = {}     # channel -> callback(channel, username, text, tags)
+        self.connections = []
+        self.channel_connection = {}  # channel -> _Connection
+        self.loop = None
+        self.thread = None
+        self.start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self.start_lock:
+            if self.thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name="irc-ingest", daemon=True)
+            self.thread.start()
+
+    def dispatch(self, message):
+        if len(message["params"]) < 2:
+            return
+        channel = message["params"][0].lstrip('#').lower()
+        callback = self.callbacks.get(channel)
+        if callback is None:
+            return
+        username = (message["prefix"] or "").split('!', 1)[0]
+        try:
+            callback(channel, username, message["params"][1].strip(), message["tags"])
+        except Exception as e:
+            metrics.errors.inc(where="irc_dispatch")
+            metrics.log(f"Error handling message for #{channel}: {str(e)}", sample_rate=metrics.LOG_SAMPLE_RATE)
+
+    async def _join(self, channel):
+        if channel in self.channel_connection:
+            return
+        connection = next((c for c in self.connections if len(c.channels) < self.channels_per_connection), None)
+        if connection is None:
+            connection = _Connection(self, len(self.connections))
+            self.connections.append(connection)
+        self.channel_connection[channel] = connection
+        await connection.join(channel)
+        if connection.task is None or connection.task.done():
+            connection.task = asyncio.ensure_future(connection.run())
+
+    async def _part(self, channel):
+        connection = self.channel_connection.pop(channel, None)
+        if connection is None:
+            return
+        await connection.part(channel)
+        if not connection.channels:
+            # Last channel left: close the connection right away
+            if connection.task is not None:
+                connection.task.cancel()
+            self.connections.remove(connection)
+            for i, c in enumerate(self.connections):
+                c.index = i
+
+    def join(self, channel, callback):
+        """
+        Start delivering the channel's messages to callback(channel, username, text, tags).
+        """
+        self._ensure_started()
+        channel = channel.lower()
+        self.callbacks[channel] = callback
+        asyncio.run_coroutine_threadsafe(self._join(channel), self.loop)
+
+    def part(self, channel):
+        """
+        Stop delivering the channel's messages and leave it.
+        """
+        channel = channel.lower()
+        self.callbacks.pop(channel, None)
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._part(channel), self.loop)
+
+    def stats(self):
+        return {
+            "connections": len(self.connections),
+            "channels": len(self.channel_connection),
+        }
@@ -0,0 +1,196 @@
+import fcntl, json, os, threading, time
+from contextlib import contextmanager
+
+
+class ModerationJournal:
+    """
+    Append-only store of manually moderated messages, shared by every channel.
+
+    Each toggle appends one JSON line ({"op": "set", "message": {...}} or
+    {"op": "del", "id": ...}) and fsyncs it, so it costs O(1) I/O; the current
+    state lives in one in-memory index keyed by message id. On load the
+    journal is replayed, ignoring a torn last line left by a crash. Once the
+    journal holds `compact_ratio` times more lines than live entries (and at
+    least `compact_min_lines`), it is rewritten to the live entries through a
+    temporary file and an atomic rename.
+
+    Several front processes can share one journal: appends and compactions
+    take an exclusive lock on `path`.lock, and every process tails the lines
+    the others appended (before each toggle, and at most every
+    `refresh_interval` seconds on lookups), replaying from the start when the
+    file was compacted under it.
+    """
+
+    def __init__(self, path, legacy_path=None, compact_ratio=2.0, compact_min_lines=1000, normalize_id=None,
+                 refresh_interval=1.0):
+        """
+        Parameters:
+        path (str): JSONL journal file
+        legacy_path (str): Former whole-file JSON store ({"messages": [...]}), imported
+            when the journal does not exist yet
+        compact_ratio (float): Journal lines per live entry that trigger a compaction
+        compact_min_lines (int): Never compact journals shorter than this
+        normalize_id (callable): Maps the IDs of records loaded from disk to their current
+            form; the next compaction persists the new IDs
+        refresh_interval (float): Seconds between checks for lines appended by other processes
+        """
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.compact_min_lines = compact_min_lines
+        self.normalize_id = normalize_id or (lambda message_id: message_id)
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.index = {}  # message id -> record
+        self.lines = 0
+        self.inode = None  # Journal file the index was read from
+        self.offset = 0  # Bytes of that file already applied (complete lines only)
+        self.last_refresh = 0
+
+        with self.lock:
+            try:
+                if not os.path.exists(path) and legacy_path and os.path.exists(legacy_path):
+                    with self._file_lock():
+                        if not os.path.exists(path):
+                            self._migrate(legacy_path)
+                self._refresh()
+            except Exception as e:
+                # Keep working in memory, as the JSON store did when it could not read or write
+                print(f"Error opening moderation journal {self.path}: {e}")
+
+    @contextmanager
+    def _file_lock(self):
+        # Serializes writers across processes; closing the file releases the lock
+        with open(self.path + ".lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _refresh(self):
+        # Called with self.lock held: apply the lines appended since the last call
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self.inode:
+                # First load, or compacted by another process: replay from the start
+                self.index, self.lines, self.offset, self.inode = {}, 0, 0, inode
+            f.seek(self.offset)
+            data = f.read()
+        # Stop after the last complete line: another process may be writing the next one
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                print(f"Skipping unreadable line of {self.path}")
+                continue
+            self._apply(entry)
+            self.lines += 1
+        self.offset += end
+        self.last_refresh = time.monotonic()
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self.last_refresh < self.refresh_interval:
+            return
+        with self.lock:
+            try:
+                self._refresh()
+            except Exception as e:
+                print(f"Error reading moderation journal {self.path}: {e}")
+                self.last_refresh = time.monotonic()
+
+    def _migrate(self, legacy_path):
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                messages = json.load(f).get('messages', [])
+        except Exception as e:
+            print(f"Error loading moderated messages: {e}")
+            return
+        self.index = {}
+        for msg in messages:
+            self._apply({"op": "set", "message": msg})
+        try:
+            self._rewrite()
+            print(f"Imported {len(self.index)} moderated messages from {legacy_path} into {self.path}")
+        except Exception as e:
+            print(f"Error writing moderation journal {self.path}: {e}")
+
+    def _apply(self, entry):
+        if entry.get("op") == "set":
+            message = entry["message"]
+            message_id = self.normalize_id(message["id"])
+            if message_id != message["id"]:
+                message = {**message, "id": message_id}
+            self.index[message_id] = message
+        elif entry.get("op") == "del":
+            self.index.pop(self.normalize_id(entry["id"]), None)
+
+    def _append(self, entry):
+        # Called with self.lock and the file lock held, right after _refresh
+        with open(self.path, 'ab') as f:
+            if os.fstat(f.fileno()).st_size > self.offset:
+                # Terminate a line torn by a crash so the next entry starts clean
+                f.write(b"\n")
+            f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        self._refresh()
+        if self.lines >= self.compact_min_lines and self.lines > self.compact_ratio * max(1, len(self.index)):
+            try:
+                self._rewrite()
+            except Exception as e:
+                print(f"Error compacting moderation journal: {e}")
+
+    def _rewrite(self):
+        # Write the live entries to a new journal and swap it in atomically
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            for message in self.index.values():
+                f.write((json.dumps({"op": "set", "message": message}, ensure_ascii=False) + "\n").encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            inode, size = os.fstat(f.fileno()).st_ino, f.tell()
+        os.replace(tmp_path, self.path)
+        self.lines, self.inode, self.offset = len(self.index), inode, size
+
+    def __contains__(self, message_id):
+        self._maybe_refresh()
+        return message_id in self.index
+
+    def get(self, message_id):
+        self._maybe_refresh()
+        return self.index.get(message_id)
+
+    def toggle(self, record):
+        """
+        Moderate a message, or unmoderate it if it already was.
+
+        Parameters:
+        record (dict): The moderated message, with at least an "id" key
+
+        Returns:
+        str: "moderated" or "unmoderated"
+        """
+        with self.lock:
+            try:
+                with self._file_lock():
+                    self._refresh()
+                    entry, result = self._toggle_entry(record)
+                    self._append(entry)
+            except Exception as e:
+                print(f"Error saving moderated messages: {e}")
+                entry, result = self._toggle_entry(record)
+                self._apply(entry)
+            return result
+
+    def _toggle_entry(self, record):
+        if record["id"] in self.index:
+            return {"op": "del", "id": record["id"]}, "unmoderated"
+        return {"op": "set", "message": record}, "moderated"
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.index), "journal_lines": self.lines}
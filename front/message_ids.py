@@ -0,0 +1,24 @@
+import hashlib, re
+
+# Size of the hash used as message ID
+MESSAGE_ID_BYTES = 12
+
+
+def get_message_id(username, timestamp, text, tags=None):
+    """
+    Compact, fixed-size ID of a chat message: a hash of its IRCv3 id, tmi-sent-ts
+    and user-id tags, or of the legacy username-timestamp-text key when the
+    message has no tags.
+    """
+    if tags and tags.get('id'):
+        key = f"{tags['id']}|{tags.get('tmi-sent-ts', '')}|{tags.get('user-id', '')}"
+    else:
+        key = f"{username}-{timestamp}-{text}"
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=MESSAGE_ID_BYTES).hexdigest()
+
+
+def normalize_message_id(message_id):
+    """Turn a legacy username-timestamp-text record ID into its compact form"""
+    if re.fullmatch(f"[0-9a-f]{{{2 * MESSAGE_ID_BYTES}}}", message_id):
+        return message_id
+    return hashlib.blake2b(message_id.encode('utf-8'), digest_size=MESSAGE_ID_BYTES).hexdigest()
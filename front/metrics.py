@@ -0,0 +1,21 @@
+"""
+Prometheus metrics of the front (see comun/metricas.py).
+"""
+# The machinery is shared with the ia service: comun/ at the top of the checkout must be on
+# the Python path (--python-path in server_app_*.sh, pythonpath in pytest.ini, PYTHONPATH=.. for scripts)
+try:
+    from comun.metricas import (CONTENT_TYPE, LATENCY_BUCKETS, LOG_SAMPLE_RATE, Counter, Gauge, Histogram,
+                                log, render, take_delta, merge_delta, reset)
+except ImportError as e:
+    raise ImportError("The metrics need the top of the checkout on the Python path (e.g. PYTHONPATH=..)") from e
+
+# Metrics of the front. Lags are measured from the moment the event existed to the
+# moment it was handed on: a message's tmi-sent-ts tag (Twitch's clock, so skew
+# between the hosts shows up here too) to its append to the channel's log, and
+# an event's publish in this process to the SSE frame carrying it.
+irc_lag_seconds = Histogram("front_irc_lag_seconds", "Seconds from a chat message's tmi-sent-ts to its append to the channel log")
+fanout_lag_seconds = Histogram("front_sse_fanout_lag_seconds", "Seconds from the publish of the oldest event of an SSE frame to the frame being sent")
+moderation_seconds = Histogram("front_moderation_request_seconds", "Seconds of one call to the moderation API", labels=("outcome",))
+messages = Counter("front_messages_total", "Chat messages appended per channel", labels=("channel",))
+verdicts = Counter("front_verdicts_total", "Verdicts per channel and category (or reason the message was not scored)", labels=("channel", "category"))
+errors = Counter("front_errors_total", "Errors per place they were raised", labels=("where",))
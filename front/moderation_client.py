@@ -0,0 +1,249 @@
+import threading, time
+from collections import deque, OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeout
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+# Verdict used whenever the ia service cannot give one: approve the message
+FALLBACK = (True, ["appropriate"])
+
+
+class _FairLimiter:
+    """
+    Caps concurrent calls; waiting callers are served round-robin across
+    channels, so one busy channel cannot starve the others.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self.in_flight = 0
+        self.waiting = OrderedDict()  # channel -> deque of threading.Event, in turn order
+        self.lock = threading.Lock()
+
+    def acquire(self, channel, timeout):
+        with self.lock:
+            if self.in_flight < self.limit and not self.waiting:
+                self.in_flight += 1
+                return True
+            turn = threading.Event()
+            self.waiting.setdefault(channel, deque()).append(turn)
+
+        if turn.wait(timeout):
+            return True
+        with self.lock:
+            if turn.is_set():
+                return True  # Granted just as the wait timed out
+            queue = self.waiting[channel]
+            queue.remove(turn)
+            if not queue:
+                del self.waiting[channel]
+            return False
+
+    def release(self):
+        with self.lock:
+            if not self.waiting:
+                self.in_flight -= 1
+                return
+            # Hand the slot to the next channel in line; it goes to the back afterwards
+            channel, queue = self.waiting.popitem(last=False)
+            turn = queue.popleft()
+            if queue:
+                self.waiting[channel] = queue
+            turn.set()
+
+    def queued(self):
+        with self.lock:
+            return sum(len(queue) for queue in self.waiting.values())
+
+
+class ModerationClient:
+    """
+    Process-wide client for the ia moderation service.
+
+    Reuses keep-alive connections from one requests.Session (or the NDJSON
+    stream client when given), caps in-flight calls with fair queuing across
+    channels, and sets each call's timeout from the observed latency
+    percentiles. A circuit breaker opens after `failure_threshold` consecutive
+    failures and answers with the "approve on error" fallback without calling
+    ia for `reset_timeout` seconds, then lets one trial call through.
+    """
+
+    def __init__(self, url, stream=None, batch=None, max_in_flight=4, timeout=2, min_timeout=0.2,
+                 failure_threshold=5, reset_timeout=10):
+        """
+        Parameters:
+        url (str): The ia service's /moderate URL
+        stream (ModerationStreamClient): Send messages through this stream instead of HTTP requests
+        batch (ModerationBatchClient): Send messages in batch requests instead, and while the
+            stream is refused or waiting to reconnect
+        max_in_flight (int): Maximum concurrent calls to ia
+        timeout (float): Initial and maximum timeout of a call, in seconds
+        min_timeout (float): Lower bound of the adaptive timeout
+        failure_threshold (int): Consecutive failures that open the circuit
+        reset_timeout (float): Seconds the circuit stays open before a trial call
+        """
+        self.url = url
+        self.stream = stream
+        self.batch = batch
+        self.stream_refusal_logged = False
+        self.max_timeout = timeout
+        self.min_timeout = min_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.limiter = _FairLimiter(max_in_flight)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.limiter.limit)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = threading.Lock()
+        # Seconds of recent calls; a timed-out call counts as max_timeout (its real latency is
+        # at least its timeout), so the percentiles cannot shrink while calls time out
+        self.latencies = deque(maxlen=500)
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.counts = {"calls": 0, "success": 0, "errors": 0, "timeouts": 0, "short_circuited": 0, "queue_timeouts": 0}
+
+    def _percentile(self, q):
+        # Called with self.lock held
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def current_timeout(self):
+        """Twice the p99 latency, within [min_timeout, timeout] once there are enough samples"""
+        with self.lock:
+            if len(self.latencies) < 20:
+                return self.max_timeout
+            return min(self.max_timeout, max(self.min_timeout, 2 * self._percentile(0.99)))
+
+    def _allow_call(self):
+        with self.lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.counts["short_circuited"] += 1
+                    return False
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self.trial_in_flight:
+                    self.counts["short_circuited"] += 1
+                    return False
+                self.trial_in_flight = True
+            return True
+
+    def _record(self, success, latency=None, timed_out=False):
+        with self.lock:
+            self.trial_in_flight = False
+            if success:
+                self.counts["success"] += 1
+                self.latencies.append(latency)
+                self.consecutive_failures = 0
+                self.state = "closed"
+                return
+            self.counts["timeouts" if timed_out else "errors"] += 1
+            if timed_out:
+                self.latencies.append(self.max_timeout)
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    metrics.log(f"Moderation circuit open after {self.consecutive_failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def _call(self, message, timeout):
+        if self.stream is not None:
+            if self.batch is None or self.stream.available():
+                return self.stream.moderate(message, timeout=timeout)
+            # Refused for good, or backing off before reconnecting
+            if self.stream.refused is not None and not self.stream_refusal_logged:
+                self.stream_refusal_logged = True
+                metrics.log(f"Moderation stream unsupported by the server ({self.stream.refused}), using /moderate/batch")
+        if self.batch is not None:
+            return self.batch.moderate(message, timeout=timeout)
+        response = self.session.post(self.url, json={"mensaje": message}, timeout=timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text}")
+        return response.json()
+
+    def moderate(self, message, channel=None):
+        """
+        Moderate a message, falling back to approving it on any failure.
+
+        Parameters:
+        message (str): Message to moderate
+        channel (str): Channel the message comes from, for fair queuing
+
+        Returns:
+        (approved: bool, reasons: list[str])
+        """
+        with self.lock:
+            self.counts["calls"] += 1
+        if not self._allow_call():
+            return FALLBACK
+
+        timeout = self.current_timeout()
+        if not self.limiter.acquire(channel, timeout):
+            with self.lock:
+                self.counts["queue_timeouts"] += 1
+                self.trial_in_flight = False
+            return FALLBACK
+
+        started = time.perf_counter()
+        try:
+            data = self._call(message, timeout)
+        except (requests.Timeout, FutureTimeout, TimeoutError) as e:
+            # FutureTimeout: the stream and batch clients; it is not the builtin before Python 3.11
+            metrics.moderation_seconds.observe(time.perf_counter() - started, outcome="timeout")
+            metrics.log(f"Moderation API timeout after {timeout:.2f}s: {str(e)}", sample_rate=metrics.LOG_SAMPLE_RATE)
+            self._record(False, timed_out=True)
+            return FALLBACK
+        except Exception as e:
+            metrics.moderation_seconds.observe(time.perf_counter() - started, outcome="error")
+            metrics.log(f"Error calling moderation API: {str(e)}", sample_rate=metrics.LOG_SAMPLE_RATE)
+            self._record(False)
+            return FALLBACK
+        finally:
+            self.limiter.release()
+
+        latency = time.perf_counter() - started
+        if data.get("status") != "success":
+            metrics.moderation_seconds.observe(latency, outcome="error")
+            metrics.log(f"Moderation API error: {data}", sample_rate=metrics.LOG_SAMPLE_RATE)
+            self._record(False)
+            return FALLBACK
+        metrics.moderation_seconds.observe(latency, outcome="success")
+        self._record(True, latency=latency)
+
+        # Handle both single reason and multi-label reasons
+        reasons = data.get("reasons", [])
+        if not reasons and "reason" in data:
+            # Fallback for single reason format
+            reasons = [data["reason"]]
+        elif not reasons:
+            reasons = ["No baneable"]
+        return data["approved"], reasons
+
+    def stats(self):
+        timeout = self.current_timeout()
+        transport = ("stream" if self.stream is not None and (self.batch is None or self.stream.available())
+                     else "batch" if self.batch is not None else "http")
+        with self.lock:
+            return {
+                **self.counts,
+                "transport": transport,
+                "circuit": self.state,
+                "in_flight": self.limiter.in_flight,
+                "queued": self.limiter.queued(),
+                "max_in_flight": self.limiter.limit,
+                "timeout_s": timeout,
+                "latency_ms": {
+                    "p50": 1000.0 * self._percentile(0.5),
+                    "p95": 1000.0 * self._percentile(0.95),
+                    "p99": 1000.0 * self._percentile(0.99),
+                },
+            }
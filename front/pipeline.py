@@ -0,0 +1,146 @@
+import threading, time
+from collections import deque
+import metrics
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest")
+
+
+class ModerationPipeline:
+    """
+    Bounded pool of moderation workers between IRC ingest and the chat sessions.
+
+    Ingest submits each message with a callback and returns immediately; up to
+    `workers` messages are moderated concurrently, taken in arrival order. When
+    `max_pending` messages are already waiting, the overflow policy decides which
+    one is skipped: "drop_oldest" gives up on the stalest queued message (chat
+    viewers care about what is being said now), "drop_newest" refuses the new one.
+    Messages that waited more than `max_wait` seconds for a worker are skipped
+    too, which bounds the verdict latency. Priority messages are taken before
+    the others and never dropped by the overflow policy.
+    Skipped messages get their callback called with the reason ("overflow" or
+    "stale") instead of a verdict.
+    """
+
+    def __init__(self, moderate_fn, workers=8, max_pending=1000, overflow="drop_oldest", max_wait=None):
+        """
+        Parameters:
+        moderate_fn (callable): Takes a message and its channel and returns (approved, reasons)
+        workers (int): Number of messages moderated concurrently
+        max_pending (int): Maximum number of messages waiting for a worker
+        overflow (str): One of OVERFLOW_POLICIES
+        max_wait (float): Seconds a message may wait for a worker before it is skipped, None for no limit
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}', expected one of {OVERFLOW_POLICIES}")
+        self.moderate_fn = moderate_fn
+        self.max_pending = max(1, int(max_pending))
+        self.overflow = overflow
+        self.max_wait = max_wait
+        self.pending = deque()  # (text, channel, callback, enqueued)
+        self.priority = deque()  # Same, taken first
+        self.condition = threading.Condition()
+        self.submitted = 0
+        self.moderated = 0
+        self.skipped = 0
+        self.total_wait = 0.0
+        self.total_moderation_time = 0.0
+        self.service_time = None  # Moving average of the seconds one moderation takes
+
+        self.workers = []
+        for _ in range(max(1, int(workers))):
+            worker = threading.Thread(target=self._run, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, text, callback, channel=None, priority=False):
+        """
+        Queue a message for moderation without blocking.
+
+        Parameters:
+        text (str): Message to moderate
+        callback (callable): Called from a worker thread with (approved, reasons),
+            or with the reason the message was skipped ("overflow" or "stale")
+        channel (str): Channel the message comes from, passed on to moderate_fn
+        priority (bool): Moderate the message before the non-priority ones
+        """
+        skipped = None
+        with self.condition:
+            self.submitted += 1
+            if priority:
+                self.priority.append((text, channel, callback, time.perf_counter()))
+                self.condition.notify()
+                return
+            if len(self.pending) >= self.max_pending:
+                self.skipped += 1
+                if self.overflow == "drop_newest":
+                    skipped = callback
+                else:
+                    skipped = self.pending.popleft()[2]
+            if skipped is not callback:
+                self.pending.append((text, channel, callback, time.perf_counter()))
+                self.condition.notify()
+
+        if skipped is not None:
+            self._call(skipped, "overflow")
+
+    def _call(self, callback, result):
+        try:
+            callback(result)
+        except Exception as e:
+            metrics.errors.inc(where="verdict_callback")
+            metrics.log(f"Error publishing moderation verdict: {str(e)}")
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.priority:
+                    self.condition.wait()
+                text, channel, callback, enqueued = (self.priority or self.pending).popleft()
+
+            started = time.perf_counter()
+            if self.max_wait is not None and started - enqueued > self.max_wait:
+                with self.condition:
+                    self.skipped += 1
+                self._call(callback, "stale")
+                continue
+            result = self.moderate_fn(text, channel)
+            finished = time.perf_counter()
+            with self.condition:
+                self.moderated += 1
+                self.total_wait += started - enqueued
+                self.total_moderation_time += finished - started
+                elapsed = finished - started
+                self.service_time = elapsed if self.service_time is None else 0.9 * self.service_time + 0.1 * elapsed
+            self._call(callback, result)
+
+    def capacity(self):
+        """
+        Messages per second the workers can moderate at the recently observed
+        moderation time, or None before the first one.
+        """
+        with self.condition:
+            if self.service_time is None:
+                return None
+            return len(self.workers) / max(self.service_time, 1e-3)
+
+    def backlog(self):
+        """Messages waiting for a worker"""
+        with self.condition:
+            return len(self.pending) + len(self.priority)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "pending": len(self.pending),
+                "priority_pending": len(self.priority),
+                "max_wait": self.max_wait,
+                "max_pending": self.max_pending,
+                "workers": len(self.workers),
+                "overflow": self.overflow,
+                "submitted": self.submitted,
+                "moderated": self.moderated,
+                "skipped": self.skipped,
+                "avg_wait_ms": 1000.0 * self.total_wait / self.moderated if self.moderated else 0.0,
+                "avg_moderation_ms": 1000.0 * self.total_moderation_time / self.moderated if self.moderated else 0.0,
+                "capacity_per_second": len(self.workers) / max(self.service_time, 1e-3) if self.service_time else None,
+            }
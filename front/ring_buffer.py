@@ -0,0 +1,66 @@
+class RingBuffer:
+    """
+    Fixed-capacity buffer numbering every appended item with a monotonically
+    increasing sequence id (starting at 1). Once full, each append overwrites
+    the oldest item, so memory stays constant however long a channel runs.
+
+    Not thread-safe: callers serialize access themselves (Broadcaster under its
+    condition, LocalState under its lock).
+    """
+
+    def __init__(self, capacity=500):
+        self.capacity = max(1, int(capacity))
+        self.slots = [None] * self.capacity  # (seq, item)
+        self.last_seq = 0
+
+    def append(self, item, seq=None):
+        """
+        Store an item, overwriting the oldest one if the buffer is full.
+
+        Parameters:
+        item: The item
+        seq (int): Sequence id assigned elsewhere (e.g. by a shared event log); must be
+            greater than the last one, ids skipped in between are simply missing
+
+        Returns:
+        int: The item's sequence id
+        """
+        self.last_seq = self.last_seq + 1 if seq is None else seq
+        self.slots[self.last_seq % self.capacity] = (self.last_seq, item)
+        return self.last_seq
+
+    @property
+    def first_seq(self):
+        """Sequence id of the oldest item still in the buffer"""
+        return max(1, self.last_seq - self.capacity + 1)
+
+    def since(self, seq):
+        """
+        Items appended after sequence id `seq`, oldest first. Items that were
+        already overwritten (or never received) are skipped.
+
+        Returns:
+        List[(int, item)]: (sequence id, item) pairs
+        """
+        items = []
+        for s in range(max(seq + 1, self.first_seq), self.last_seq + 1):
+            slot = self.slots[s % self.capacity]
+            if slot is not None and slot[0] == s:
+                items.append(slot)
+        return items
+
+    def first_after(self, seq):
+        """
+        The oldest item appended after sequence id `seq`
+
+        Returns:
+        (int, item): (sequence id, item) pair, or None if there is none
+        """
+        for s in range(max(seq + 1, self.first_seq), self.last_seq + 1):
+            slot = self.slots[s % self.capacity]
+            if slot is not None and slot[0] == s:
+                return slot
+        return None
+
+    def __len__(self):
+        return len(self.since(0))
@@ -0,0 +1,263 @@
+"""
+Shared state for running the front in several worker processes.
+
+Every backend offers the same small API:
+  - leases (leader election): acquire(name, owner, ttl) / release(name, owner)
+  - a per-channel event log with per-channel sequence ids, trimmed to the
+    last `capacity` events: append(channel, payload) / read(channel, after)
+  - an expiring key/value store: set(key, value, ttl) / get(key) / delete(key)
+  - wait(timeout): block until new events may be available
+  - shared: whether other processes see the state
+
+LocalState keeps everything in the process (single-process deployments, the
+default), where nothing needs to go through the event log; SQLiteState shares it between processes on one host through a WAL
+database; RedisState (optional, needs the redis package) across hosts.
+Payloads are bytes, values are JSON-serializable.
+"""
+import json, sqlite3, threading, time
+from ring_buffer import RingBuffer
+
+
+class LocalState:
+    """In-process backend: the behaviour of a single front process."""
+    shared = False
+
+    def __init__(self, capacity=500):
+        self.capacity = capacity
+        self.lock = threading.Condition()
+        self.leases = {}  # name -> (owner, expires)
+        self.logs = {}  # channel -> RingBuffer of payloads, indexed by seq
+        self.values = {}  # key -> (value, expires)
+        self.appended = 0  # Appends so far, and as of the last wait()
+        self.waited = 0
+
+    def acquire(self, name, owner, ttl):
+        with self.lock:
+            holder = self.leases.get(name)
+            if holder is None or holder[0] == owner or holder[1] < time.time():
+                self.leases[name] = (owner, time.time() + ttl)
+                return True
+            return False
+
+    def release(self, name, owner):
+        with self.lock:
+            if self.leases.get(name, (None,))[0] == owner:
+                del self.leases[name]
+
+    def append(self, channel, payload):
+        with self.lock:
+            events = self.logs.get(channel)
+            if events is None:
+                events = self.logs[channel] = RingBuffer(self.capacity)
+            seq = events.append(payload)
+            self.appended += 1
+            self.lock.notify_all()
+            return seq
+
+    def read(self, channel, after):
+        with self.lock:
+            events = self.logs.get(channel)
+            return events.since(after) if events is not None else []
+
+    def wait(self, timeout):
+        with self.lock:
+            # Do not sleep through events appended since the previous call
+            if self.appended == self.waited:
+                self.lock.wait(timeout)
+            self.waited = self.appended
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.values[key] = (value, time.time() + ttl)
+
+    def get(self, key):
+        with self.lock:
+            item = self.values.get(key)
+            if item is None or item[1] < time.time():
+                self.values.pop(key, None)
+                return None
+            return item[0]
+
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+
+
+class SQLiteState:
+    """Backend shared by the processes of one host through a SQLite database in WAL mode."""
+    shared = True
+
+    def __init__(self, path, capacity=500, poll_interval=0.05):
+        self.path = path
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.local = threading.local()
+        self._connect().execute("PRAGMA journal_mode=WAL")
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS events (channel TEXT, seq INTEGER, payload BLOB, PRIMARY KEY (channel, seq))")
+            db.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+
+    def _connect(self):
+        # One connection per thread; "with" blocks are transactions
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = _Transactional(db)
+        return self.local.db
+
+    def acquire(self, name, owner, ttl):
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE "
+                "SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE leases.owner = excluded.owner OR leases.expires < ?",
+                (name, owner, now + ttl, now))
+            row = db.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def release(self, name, owner):
+        with self._connect() as db:
+            db.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def append(self, channel, payload):
+        with self._connect() as db:
+            (last_seq,) = db.execute("SELECT COALESCE(MAX(seq), 0) FROM events WHERE channel = ?", (channel,)).fetchone()
+            seq = last_seq + 1
+            db.execute("INSERT INTO events VALUES (?, ?, ?)", (channel, seq, payload))
+            if seq % 100 == 0:
+                db.execute("DELETE FROM events WHERE channel = ? AND seq <= ?", (channel, seq - self.capacity))
+        return seq
+
+    def read(self, channel, after):
+        db = self._connect()
+        rows = db.execute(
+            "SELECT seq, payload FROM events WHERE channel = ? AND seq > ? AND seq > "
+            "(SELECT COALESCE(MAX(seq), 0) FROM events WHERE channel = ?) - ? ORDER BY seq",
+            (channel, after, channel, self.capacity)).fetchall()
+        return [(seq, bytes(payload)) for seq, payload in rows]
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.poll_interval))
+
+    def set(self, key, value, ttl):
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, json.dumps(value), time.time() + ttl))
+
+    def get(self, key):
+        row = self._connect().execute("SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def delete(self, key):
+        with self._connect() as db:
+            db.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+
+class _Transactional:
+    """sqlite3 connection whose "with" block is a BEGIN IMMEDIATE transaction."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, *args):
+        return self.db.execute(*args)
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class RedisState:
+    """Backend shared across hosts through Redis (requires the redis package)."""
+    shared = True
+
+    # Renew a lease only if we still hold it, or take it if it is free
+    ACQUIRE = """
+    local holder = redis.call('GET', KEYS[1])
+    if holder == false or holder == ARGV[1] then
+        redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+        return 1
+    end
+    return 0
+    """
+    APPEND = """
+    local seq = redis.call('INCR', KEYS[1])
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], seq .. '-1', 'p', ARGV[1])
+    return seq
+    """
+    RELEASE = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url, capacity=500, poll_interval=0.05, prefix="stream-mod:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("The 'redis' state backend requires the redis package") from e
+        self.redis = redis.Redis.from_url(url)
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self.acquire_script = self.redis.register_script(self.ACQUIRE)
+        self.release_script = self.redis.register_script(self.RELEASE)
+        self.append_script = self.redis.register_script(self.APPEND)
+
+    def acquire(self, name, owner, ttl):
+        return bool(self.acquire_script(keys=[self.prefix + "lease:" + name], args=[owner, int(ttl * 1000)]))
+
+    def release(self, name, owner):
+        self.release_script(keys=[self.prefix + "lease:" + name], args=[owner])
+
+    def append(self, channel, payload):
+        # Stream entry ids are the channel's sequence ids, taken atomically with the append
+        return int(self.append_script(keys=[self.prefix + "seq:" + channel, self.prefix + "log:" + channel],
+                                      args=[payload, self.capacity]))
+
+    def read(self, channel, after):
+        entries = self.redis.xrange(self.prefix + "log:" + channel, min=f"{after + 1}-0", max="+")
+        return [(int(entry_id.split(b"-")[0]), fields[b"p"]) for entry_id, fields in entries]
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.poll_interval))
+
+    def set(self, key, value, ttl):
+        self.redis.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+
+    def get(self, key):
+        value = self.redis.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def delete(self, key):
+        self.redis.delete(self.prefix + key)
+
+
+STATE_BACKENDS = ("local", "sqlite", "redis")
+
+
+def create_state(backend="local", capacity=500, sqlite_path=None, redis_url=None):
+    """
+    Build the configured shared-state backend.
+
+    Parameters:
+    backend (str): One of STATE_BACKENDS
+    capacity (int): Events kept per channel
+    sqlite_path (str): Database file for the "sqlite" backend
+    redis_url (str): Server URL for the "redis" backend
+    """
+    if backend == "local":
+        return LocalState(capacity)
+    if backend == "sqlite":
+        return SQLiteState(sqlite_path, capacity)
+    if backend == "redis":
+        return RedisState(redis_url, capacity)
+    raise ValueError(f"Unknown state backend '{backend}', expected one of {STATE_BACKENDS}")
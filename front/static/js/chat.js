@@ -8,6 +8,10 @@ const copyLinkButton = document.getElementById("copy-embed-link-btn");
 
 // Store all messages and current modal state
 let chatMessages = [];
+let messageElements = new Map(); // message id -> rendered element
+let seenMessageIds = new Set(); // message_id of every received message, for exact dedup
+let pendingEvents = []; // received events waiting for the next animation frame
+let flushScheduled = false;
 let currentMessage = null;
 
 // Default moderation reasons for filtering display
@@ -22,6 +26,14 @@ if (typeof window.selectedReasons === 'undefined') {
 }
 
 // ===== UTILITY FUNCTIONS =====
+function isSameMessage(a, b) {
+    // Exact identity from the IRCv3 tags when the server sent it
+    if (a.message_id && b.message_id) {
+        return a.message_id === b.message_id;
+    }
+    return a.username === b.username && a.timestamp === b.timestamp && a.text === b.text;
+}
+
 function getSelectedReasons() {
     const checkboxes = document.querySelectorAll('#moderation-reason input[type="checkbox"]:checked');
     return Array.from(checkboxes).map(cb => cb.value);
@@ -73,6 +85,17 @@ function createMessageElement(message) {
         msgElement.innerHTML = `<strong>${message.timestamp} - ${message.username}:</strong> ${message.text}`;
     }
     
+    // Still waiting for the AI verdict
+    if (message.status === 'pending') {
+        msgElement.classList.add("pending");
+    }
+    
+    // Shown without an AI verdict: the channel was over the moderation capacity
+    if (message.status === 'unscored') {
+        msgElement.classList.add("unscored");
+        msgElement.title = "Sin verificar";
+    }
+    
     // Add click handler to open modal
     msgElement.addEventListener("click", () => openMessageModal(message));
     
@@ -81,30 +104,46 @@ function createMessageElement(message) {
 
 function refreshChatDisplay() {
     chatBox.innerHTML = '';
+    messageElements.clear();
     
     chatMessages.forEach(message => {
         const msgElement = createMessageElement(message);
+        messageElements.set(message.id, msgElement);
         chatBox.appendChild(msgElement);
     });
     
     chatBox.scrollTop = chatBox.scrollHeight;
 }
 
-function addNewMessage(messageData) {
+function addNewMessage(messageData, container) {
     // Check for duplicates
-    const isDuplicate = chatMessages.some(msg => 
-        msg.username === messageData.username && 
-        msg.timestamp === messageData.timestamp && 
-        msg.text === messageData.text
-    );
-    
-    if (isDuplicate) return;
+    if (messageData.message_id) {
+        if (seenMessageIds.has(messageData.message_id)) return;
+        seenMessageIds.add(messageData.message_id);
+    } else if (chatMessages.some(msg => isSameMessage(msg, messageData))) {
+        return;
+    }
     
     // Add to store and display
     chatMessages.push(messageData);
     const msgElement = createMessageElement(messageData);
-    chatBox.appendChild(msgElement);
-    chatBox.scrollTop = chatBox.scrollHeight;
+    messageElements.set(messageData.id, msgElement);
+    container.appendChild(msgElement);
+}
+
+function applyMessageUpdate(update) {
+    // The AI verdict of a message that was displayed as pending
+    // Search from the end: ids restart if the server restarts
+    const message = chatMessages.findLast(msg => msg.id === update.id);
+    if (!message) return;
+    
+    Object.assign(message, update);
+    const oldElement = messageElements.get(message.id);
+    if (oldElement) {
+        const msgElement = createMessageElement(message);
+        oldElement.replaceWith(msgElement);
+        messageElements.set(message.id, msgElement);
+    }
 }
 
 // ===== MODAL FUNCTIONS =====
@@ -162,6 +201,7 @@ async function toggleModeration(message, reasons = null) {
                 'X-Session-ID': sessionId
             },
             body: JSON.stringify({
+                message_id: message.message_id,
                 username: message.username,
                 timestamp: message.timestamp,
                 text: message.text,
@@ -187,11 +227,7 @@ async function toggleModeration(message, reasons = null) {
 }
 
 function updateMessageModerationStatus(message, action, reasons) {
-    const messageIndex = chatMessages.findIndex(msg => 
-        msg.username === message.username && 
-        msg.timestamp === message.timestamp && 
-        msg.text === message.text
-    );
+    const messageIndex = chatMessages.findIndex(msg => isSameMessage(msg, message));
     
     if (messageIndex === -1) return;
     
@@ -207,10 +243,7 @@ function updateMessageModerationStatus(message, action, reasons) {
     }
     
     // Update current message if it's the same one
-    if (currentMessage && 
-        currentMessage.username === message.username &&
-        currentMessage.timestamp === message.timestamp &&
-        currentMessage.text === message.text) {
+    if (currentMessage && isSameMessage(currentMessage, message)) {
         currentMessage = chatMessages[messageIndex];
     }
 }
@@ -246,17 +279,47 @@ window.updateSelectedReasons = function(reason, isChecked) {
 };
 
 // ===== EVENT SOURCE SETUP =====
+function queueEvents(events) {
+    pendingEvents.push(...events);
+    if (!flushScheduled) {
+        flushScheduled = true;
+        requestAnimationFrame(flushEvents);
+    }
+}
+
+function flushEvents() {
+    // Apply everything received since the last frame in a single DOM pass
+    flushScheduled = false;
+    const events = pendingEvents;
+    pendingEvents = [];
+    const fragment = document.createDocumentFragment();
+    
+    events.forEach(event => {
+        if (event.type === 'message') {
+            addNewMessage(event.data, fragment);
+        } else if (event.type === 'update') {
+            applyMessageUpdate(event.data);
+        }
+        // 'filters' and 'keepalive' need nothing here: this page keeps its own filters
+    });
+    
+    if (fragment.childNodes.length > 0) {
+        chatBox.appendChild(fragment);
+        chatBox.scrollTop = chatBox.scrollHeight;
+    }
+}
+
 function initializeEventSource() {
-    const evtSource = new EventSource(window.location.origin + `/stream-mod/front/chat?session_id=${sessionId}`);
+    const evtSource = new EventSource(window.location.origin + `/stream-mod/front/events?session_id=${sessionId}`);
     
+    // Each frame carries an array of typed events
     evtSource.onmessage = function(event) {
-        const messageData = JSON.parse(event.data);
-        addNewMessage(messageData);
+        queueEvents(JSON.parse(event.data));
     };
     
     evtSource.onerror = function(event) {
         console.error('EventSource failed:', event);
-        // Could implement reconnection logic here
+        // EventSource reconnects on its own, resuming from the last event id
     };
     
     // Clean up on page unload
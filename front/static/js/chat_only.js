@@ -5,10 +5,22 @@ const modal = document.getElementById("message-modal");
 
 // Global state
 let chatMessages = [];
+let messageElements = new Map(); // message id -> rendered element
+let seenMessageIds = new Set(); // message_id of every received message, for exact dedup
+let pendingEvents = []; // received events waiting for the next animation frame
+let flushScheduled = false;
 let currentMessage = null;
 let activeFilters = []; // Track current moderation filters
 
 // ===== UTILITY FUNCTIONS =====
+function isSameMessage(a, b) {
+    // Exact identity from the IRCv3 tags when the server sent it
+    if (a.message_id && b.message_id) {
+        return a.message_id === b.message_id;
+    }
+    return a.username === b.username && a.timestamp === b.timestamp && a.text === b.text;
+}
+
 function getSelectedReasons() {
     return Array.from(document.querySelectorAll('#moderation-reason input[type="checkbox"]:checked'))
         .map(cb => cb.value);
@@ -48,11 +60,6 @@ function shouldBlurMessage(message) {
     return messageReasons.some(reason => activeFilters.includes(reason));
 }
 
-function updateActiveFilters(filters) {
-    activeFilters = filters;
-    refreshChatDisplay();
-}
-
 // ===== MESSAGE DISPLAY =====
 function createMessageElement(message) {
     const messageElement = document.createElement("p");
@@ -66,31 +73,58 @@ function createMessageElement(message) {
         messageElement.textContent = `${timestampWithoutSeconds} ${message.username}: ${message.text}`;
     }
     
+    // Still waiting for the AI verdict
+    if (message.status === 'pending') {
+        messageElement.classList.add("pending");
+    }
+    
+    // Shown without an AI verdict: the channel was over the moderation capacity
+    if (message.status === 'unscored') {
+        messageElement.classList.add("unscored");
+        messageElement.title = "Sin verificar";
+    }
+    
     messageElement.addEventListener("click", () => openModal(message));
     return messageElement;
 }
 
-function addNewMessage(message) {
+function addNewMessage(message, container) {
     // Check for duplicates
-    const isDuplicate = chatMessages.some(msg => 
-        msg.username === message.username && 
-        msg.timestamp === message.timestamp && 
-        msg.text === message.text
-    );
-    
-    if (isDuplicate) return;
+    if (message.message_id) {
+        if (seenMessageIds.has(message.message_id)) return;
+        seenMessageIds.add(message.message_id);
+    } else if (chatMessages.some(msg => isSameMessage(msg, message))) {
+        return;
+    }
     
     // Add to store and display (all messages are always shown)
     chatMessages.push(message);
     const messageElement = createMessageElement(message);
-    chatBox.appendChild(messageElement);
-    chatBox.scrollTop = chatBox.scrollHeight;
+    messageElements.set(message.id, messageElement);
+    container.appendChild(messageElement);
+}
+
+function applyMessageUpdate(update) {
+    // The AI verdict of a message that was displayed as pending
+    // Search from the end: ids restart if the server restarts
+    const message = chatMessages.findLast(msg => msg.id === update.id);
+    if (!message) return;
+    
+    Object.assign(message, update);
+    const oldElement = messageElements.get(message.id);
+    if (oldElement) {
+        const messageElement = createMessageElement(message);
+        oldElement.replaceWith(messageElement);
+        messageElements.set(message.id, messageElement);
+    }
 }
 
 function refreshChatDisplay() {
     chatBox.innerHTML = '';
+    messageElements.clear();
     chatMessages.forEach(message => {
         const messageElement = createMessageElement(message);
+        messageElements.set(message.id, messageElement);
         chatBox.appendChild(messageElement);
     });
     chatBox.scrollTop = chatBox.scrollHeight;
@@ -164,6 +198,7 @@ async function toggleModeration(action, reasons = []) {
                 'X-Session-ID': sessionId
             },
             body: JSON.stringify({
+                message_id: currentMessage.message_id,
                 username: currentMessage.username,
                 timestamp: currentMessage.timestamp,
                 text: currentMessage.text,
@@ -188,11 +223,7 @@ async function toggleModeration(action, reasons = []) {
 }
 
 function updateMessageStatus(action, reasons) {
-    const messageIndex = chatMessages.findIndex(msg => 
-        msg.username === currentMessage.username && 
-        msg.timestamp === currentMessage.timestamp && 
-        msg.text === currentMessage.text
-    );
+    const messageIndex = chatMessages.findIndex(msg => isSameMessage(msg, currentMessage));
     
     if (messageIndex !== -1) {
         chatMessages[messageIndex].moderated = action === 'moderated';
@@ -208,12 +239,48 @@ function updateMessageStatus(action, reasons) {
 }
 
 // ===== EVENT SOURCE SETUP =====
+function queueEvents(events) {
+    pendingEvents.push(...events);
+    if (!flushScheduled) {
+        flushScheduled = true;
+        requestAnimationFrame(flushEvents);
+    }
+}
+
+function flushEvents() {
+    // Apply everything received since the last frame in a single DOM pass
+    flushScheduled = false;
+    const events = pendingEvents;
+    pendingEvents = [];
+    const fragment = document.createDocumentFragment();
+    let filtersChanged = false;
+    
+    events.forEach(event => {
+        if (event.type === 'message') {
+            addNewMessage(event.data, fragment);
+        } else if (event.type === 'update') {
+            applyMessageUpdate(event.data);
+        } else if (event.type === 'filters') {
+            activeFilters = event.data;
+            filtersChanged = true;
+        }
+    });
+    
+    if (filtersChanged) {
+        // Redraws every message, including the ones just added
+        refreshChatDisplay();
+    } else if (fragment.childNodes.length > 0) {
+        chatBox.appendChild(fragment);
+        chatBox.scrollTop = chatBox.scrollHeight;
+    }
+}
+
 function initializeEventSource() {
-    const evtSource = new EventSource(`${window.location.origin}/stream-mod/front/chat?session_id=${sessionId}`);
+    const evtSource = new EventSource(`${window.location.origin}/stream-mod/front/events?session_id=${sessionId}`);
     
+    // Each frame carries an array of typed events: message, update, filters, keepalive
     evtSource.onmessage = function(event) {
-        const message = JSON.parse(event.data);
-        addNewMessage(message);
+        queueEvents(JSON.parse(event.data));
     };
     
     evtSource.onerror = function(event) {
@@ -226,26 +293,6 @@ function initializeEventSource() {
     return evtSource;
 }
 
-function initializeFiltersEventSource() {
-    const filtersEvtSource = new EventSource(`${window.location.origin}/stream-mod/front/filters?session_id=${sessionId}`);
-    
-    filtersEvtSource.onmessage = function(event) {
-        const data = JSON.parse(event.data);
-        if (data.type === 'filters_update') {
-            updateActiveFilters(data.filters);
-        }
-    };
-    
-    filtersEvtSource.onerror = function(event) {
-        console.error('Filters EventSource failed:', event);
-    };
-    
-    // Clean up on page unload
-    window.addEventListener('beforeunload', () => filtersEvtSource.close());
-    
-    return filtersEvtSource;
-}
-
 // ===== EVENT LISTENERS =====
 function setupEventListeners() {
     // Modal close button
@@ -278,5 +325,4 @@ function setupEventListeners() {
 document.addEventListener('DOMContentLoaded', function() {
     setupEventListeners();
     initializeEventSource();
-    initializeFiltersEventSource();
 });
\ No newline at end of file
@@ -0,0 +1,272 @@
+import http.client, itertools, json, queue, socket, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from urllib.parse import urlsplit
+
+# Answers meaning the server cannot serve the stream at all (411: mod_wsgi without
+# --chunked-request), as opposed to errors worth retrying later
+UNSUPPORTED_STATUSES = (404, 405, 411)
+
+
+class ModerationStreamClient:
+    """
+    Client for the ia service's /moderate/stream endpoint.
+
+    Keeps one long-lived HTTP request open per process: moderation requests are
+    written to it as pipelined NDJSON frames (chunked transfer encoding) and a
+    reader thread matches the streamed results back to their callers by id, in
+    whatever order they complete. Many messages can be in flight on the one
+    connection. If the connection breaks, pending calls fail and the next call
+    reconnects. A connection that breaks before answering any frame (connect
+    errors, 5xx, a first frame that times out) doubles the wait before the
+    next attempt, up to `max_backoff`; `available()` is False meanwhile.
+
+    The stream needs full-duplex chunked I/O from the server, which mod_wsgi
+    does not provide (see /moderate/stream in ia/main.py). Only when the
+    server answers with one of UNSUPPORTED_STATUSES does the client set
+    `refused` and stop using the stream for good; the caller then falls back
+    to ModerationBatchClient.
+    """
+
+    def __init__(self, url, connect_timeout=2, max_backoff=30):
+        """
+        Parameters:
+        url (str): Full URL of the /moderate/stream endpoint
+        connect_timeout (float): Seconds allowed to open the connection
+        max_backoff (float): Upper bound of the wait between reconnection attempts
+        """
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or "/"
+        self.connect_timeout = connect_timeout
+        self.max_backoff = max_backoff
+
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.ids = itertools.count()
+        self.pending = {}  # frame id -> Future
+        self.conn = None
+        self.sock = None
+        self.backoff = 0
+        self.next_attempt = 0
+        self.results = 0  # Result frames received on the current connection
+        self.refused = None  # Why the server cannot serve the stream, once known
+
+    def available(self):
+        """Whether calls should use the stream now: not refused, and connected or due to reconnect"""
+        with self.lock:
+            return self.refused is None and (self.conn is not None or time.monotonic() >= self.next_attempt)
+
+    def _back_off(self):
+        # Called with self.lock held
+        self.backoff = min(self.max_backoff, max(0.5, self.backoff * 2))
+        self.next_attempt = time.monotonic() + self.backoff
+
+    def _connect(self):
+        if self.scheme == "https":
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.connect_timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        conn.putrequest("POST", self.path)
+        conn.putheader("Content-Type", "application/x-ndjson")
+        conn.putheader("Transfer-Encoding", "chunked")
+        conn.endheaders()
+        conn.sock.settimeout(None)  # The stream stays open indefinitely
+
+        self.conn = conn
+        self.sock = conn.sock
+        self.results = 0
+        threading.Thread(target=self._read_results, args=(conn,), daemon=True).start()
+
+    def _ensure_connected(self):
+        # Called with self.lock held
+        if self.conn is not None:
+            return
+        if self.refused is not None:
+            raise ConnectionError(f"Moderation stream unsupported by the server ({self.refused})")
+        if time.monotonic() < self.next_attempt:
+            raise ConnectionError("Moderation stream unavailable, waiting to reconnect")
+        try:
+            self._connect()
+        except Exception:
+            self._back_off()
+            raise
+
+    def _read_results(self, conn):
+        try:
+            response = conn.getresponse()
+            if response.status in UNSUPPORTED_STATUSES:
+                self.refused = f"HTTP {response.status}"
+            if response.status != 200:
+                raise ConnectionError(f"Moderation stream answered HTTP {response.status}")
+            for line in response:
+                if not line.strip():
+                    continue
+                frame = json.loads(line)
+                if frame.get("id") is None:
+                    continue  # ready / keep-alive, or a frame the server could not parse
+                with self.lock:
+                    self.results += 1
+                    self.backoff = 0
+                    future = self.pending.pop(frame["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(frame)
+            error = ConnectionError("Moderation stream closed by the server")
+        except Exception as e:
+            error = e
+        self._disconnect(conn, error)
+
+    def _disconnect(self, conn, error):
+        with self.lock:
+            if self.conn is not conn:
+                return
+            sock = self.sock
+            self.conn = None
+            self.sock = None
+            if self.results == 0:
+                self._back_off()
+            pending = list(self.pending.values())
+            self.pending.clear()
+        try:
+            # Wakes the reader thread first: closing the response waits for its blocked read
+            sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+        for future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    def submit(self, message):
+        """
+        Send a message on the stream.
+
+        Returns:
+        Future: Resolves to the result frame ({"id", "status", "approved", "reasons", ...})
+        """
+        future = Future()
+        with self.lock:
+            self._ensure_connected()
+            frame_id = next(self.ids)
+            future.frame_id = frame_id
+            self.pending[frame_id] = future
+            conn, sock = self.conn, self.sock
+
+        data = (json.dumps({"id": frame_id, "mensaje": message}, ensure_ascii=False) + "\n").encode("utf-8")
+        try:
+            with self.send_lock:
+                sock.sendall(b"%x\r\n%s\r\n" % (len(data), data))
+        except Exception as e:
+            self._disconnect(conn, e)
+        return future
+
+    def moderate(self, message, timeout=2):
+        """
+        Moderate a message through the stream, waiting at most `timeout` seconds.
+
+        Returns:
+        dict: The result frame
+        """
+        future = self.submit(message)
+        try:
+            return future.result(timeout=timeout)
+        except Exception as e:
+            with self.lock:
+                self.pending.pop(future.frame_id, None)
+                conn = self.conn
+                silent = isinstance(e, FutureTimeout) and conn is not None and self.results == 0
+            if silent:
+                # No frame came back on this connection: the server may be overloaded, or not
+                # reading the request body while it streams the response. Retry after a backoff
+                self._disconnect(conn, ConnectionError("No results on the moderation stream"))
+            raise
+
+    def close(self):
+        with self.lock:
+            conn, sock = self.conn, self.sock
+        if conn is None:
+            return
+        try:
+            with self.send_lock:
+                sock.sendall(b"0\r\n\r\n")  # End of the chunked request body
+        except Exception:
+            pass
+
+
+class ModerationBatchClient:
+    """
+    Client for the ia service's /moderate/batch endpoint, for servers that
+    cannot serve /moderate/stream (mod_wsgi).
+
+    Concurrent moderations are queued and `max_in_flight` sender threads post
+    them as batch requests, each waiting at most `max_wait` seconds after its
+    first message for others to join, so several messages still share one
+    round trip while up to `max_in_flight` batches are in flight.
+    """
+
+    def __init__(self, url, max_batch_size=32, max_wait=0.005, timeout=10, max_in_flight=4):
+        """
+        Parameters:
+        url (str): Full URL of the /moderate/batch endpoint
+        max_batch_size (int): Maximum messages per request
+        max_wait (float): Seconds a batch waits for more messages after its first one
+        timeout (float): Seconds allowed for one batch request
+        max_in_flight (int): Maximum concurrent batch requests
+        """
+        self.url = url
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.max_in_flight = max(1, max_in_flight)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.queue = queue.Queue()
+        for i in range(self.max_in_flight):
+            threading.Thread(target=self._run, name=f"moderation-batch-{i}", daemon=True).start()
+
+    def submit(self, message):
+        """
+        Queue a message for the next batch.
+
+        Returns:
+        Future: Resolves to its result ({"status", "approved", "reasons", ...})
+        """
+        future = Future()
+        self.queue.put((message, future))
+        return future
+
+    def moderate(self, message, timeout=2):
+        """Moderate a message in a batch, waiting at most `timeout` seconds"""
+        return self.submit(message).result(timeout=timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                response = self.session.post(self.url, json={"mensajes": [message for message, _ in batch]},
+                                             timeout=self.timeout)
+                if response.status_code != 200:
+                    raise RuntimeError(f"HTTP {response.status_code}: {response.text}")
+                results = response.json()["results"]
+                if len(results) != len(batch):
+                    raise RuntimeError(f"Expected {len(batch)} results, got {len(results)}")
+                for (_, future), result in zip(batch, results):
+                    future.set_result({"status": "success", **result})
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
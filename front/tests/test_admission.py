@@ -0,0 +1,230 @@
+import math, time
+
+import pytest
+
+from admission import AdmissionController, _ChannelLoad
+
+
+class Pipeline:
+    """Stands in for ModerationPipeline: keeps what is submitted, with a fixed capacity and backlog"""
+
+    def __init__(self, capacity=None, backlog=0):
+        self.measured_capacity = capacity
+        self.waiting = backlog
+        self.submitted = []
+
+    def submit(self, text, callback, channel=None, priority=False):
+        self.submitted.append((text, callback, priority))
+
+    def answer(self, result, index=0):
+        self.submitted.pop(index)[1](result)
+
+    def capacity(self):
+        return self.measured_capacity
+
+    def backlog(self):
+        return self.waiting
+
+
+class Random:
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+def controller(pipeline, draw=0.5, **kwargs):
+    """An AdmissionController whose shares only change when the test recomputes them"""
+    admission = AdmissionController(pipeline, **kwargs)
+    admission.random = Random(draw)
+    admission.last_update = math.inf
+    return admission
+
+
+def arrive(admission, channel, now, **rates):
+    """Make a channel's measured arrival rates (messages per second, per kind) what is given"""
+    load = admission.channels.setdefault(channel, _ChannelLoad(admission.half_life))
+    for kind, meter in load.arrivals.items():
+        meter.value = 0.0
+        meter.updated = now
+        meter.add(rates.get(kind, 0.0) * meter.half_life / math.log(2), now)
+    return load
+
+
+def submit(admission, text, channel, results, **kwargs):
+    admission.submit(text, lambda result: results.append((text, result)), channel, **kwargs)
+
+
+def test_water_filling():
+    pipeline = Pipeline(capacity=10.0)
+    admission = controller(pipeline, headroom=1.0)
+    now = time.monotonic()
+    quiet = arrive(admission, "quiet", now, other=1.0)
+    medium = arrive(admission, "medium", now, other=3.0)
+    busy = arrive(admission, "busy", now, other=20.0)
+    admission._update_shares(now)
+    # The quiet channels keep all they need; the busy one gets the 6/s left
+    assert quiet.admit == medium.admit == {"first": 1.0, "low_risk": 1.0, "other": 1.0}
+    assert busy.admit["other"] == pytest.approx(6.0 / 20.0)
+
+
+def test_equal_shares_when_every_channel_is_busy():
+    pipeline = Pipeline(capacity=10.0)
+    admission = controller(pipeline, headroom=0.8)
+    now = time.monotonic()
+    loads = [arrive(admission, channel, now, other=rate) for channel, rate in (("a", 10.0), ("b", 40.0))]
+    admission._update_shares(now)
+    assert [load.admit["other"] for load in loads] == pytest.approx([4.0 / 10.0, 4.0 / 40.0])
+
+
+def test_share_order_within_a_channel():
+    pipeline = Pipeline(capacity=7.0)
+    admission = controller(pipeline, headroom=1.0)
+    now = time.monotonic()
+    load = arrive(admission, "busy", now, first=2.0, other=4.0, low_risk=10.0)
+    admission._update_shares(now)
+    # First-time chatters, then the other messages, then the low-risk ones
+    assert load.admit["first"] == 1.0
+    assert load.admit["other"] == pytest.approx(1.0)
+    assert load.admit["low_risk"] == pytest.approx(1.0 / 10.0)
+
+
+def test_backlog_cuts_the_budget():
+    pipeline = Pipeline(capacity=10.0, backlog=40)
+    admission = controller(pipeline, headroom=1.0, target_latency=2.0)
+    now = time.monotonic()
+    load = arrive(admission, "busy", now, other=10.0)
+    admission._update_shares(now)
+    # 4 s of backlog against a 2 s target: half the capacity is handed out
+    assert load.admit["other"] == pytest.approx(0.5)
+
+
+def test_no_capacity_measured_yet():
+    admission = controller(Pipeline(capacity=None))
+    now = time.monotonic()
+    load = arrive(admission, "busy", now, other=100.0)
+    admission._update_shares(now)
+    assert load.admit == {"first": 1.0, "low_risk": 1.0, "other": 1.0}
+
+
+def test_under_capacity_everything_is_scored():
+    pipeline = Pipeline()
+    admission = controller(pipeline)
+    results = []
+    for text in ("hola", "hola", "chao"):
+        submit(admission, text, "canal", results)
+    assert [text for text, _, priority in pipeline.submitted] == ["hola", "hola", "chao"]
+    assert not any(priority for _, _, priority in pipeline.submitted)
+    pipeline.answer((True, []))
+    assert results == [("hola", (True, []))]
+
+
+def over_capacity(admission, channel="canal", other=0.5, low_risk=0.5):
+    arrive(admission, channel, time.monotonic())
+    admission.channels[channel].admit = {"first": 1.0, "low_risk": low_risk, "other": other}
+
+
+def test_unscored_when_sampled_out():
+    pipeline = Pipeline()
+    admission = controller(pipeline, draw=0.7)
+    over_capacity(admission, other=0.6)
+    results = []
+    submit(admission, "hola", "canal", results)
+    assert results == [("hola", "sampled")]
+    assert not pipeline.submitted
+    assert admission.channels["canal"].counts["sampled_out"] == 1
+
+    admission.random = Random(0.5)
+    submit(admission, "chao", "canal", results)
+    assert [text for text, _, _ in pipeline.submitted] == ["chao"]
+
+
+def test_sampled_verdicts_are_not_reused():
+    pipeline = Pipeline()
+    admission = controller(pipeline, draw=0.7)
+    over_capacity(admission, other=0.6)
+    results = []
+    submit(admission, "hola", "canal", results)
+    # The next copy of a sampled-out text gets its own draw, and is scored if admitted
+    admission.random = Random(0.1)
+    submit(admission, "hola", "canal", results)
+    assert results == [("hola", "sampled")]
+    assert [text for text, _, _ in pipeline.submitted] == ["hola"]
+
+
+def test_verdicts_reused_over_capacity():
+    pipeline = Pipeline()
+    admission = controller(pipeline, draw=0.1)
+    over_capacity(admission)
+    results = []
+    submit(admission, "compra seguidores", "canal", results)
+    # A copy while the first is with the model waits for its verdict
+    submit(admission, "Compra   SEGUIDORES", "canal", results)
+    assert len(pipeline.submitted) == 1
+    pipeline.answer((False, ["Spam"]))
+    assert results == [("compra seguidores", (False, ["Spam"])), ("Compra   SEGUIDORES", (False, ["Spam"]))]
+
+    # Later copies reuse it without calling the model, even when they would be sampled out
+    admission.random = Random(0.99)
+    submit(admission, "compra seguidores", "canal", results)
+    assert results[-1] == ("compra seguidores", (False, ["Spam"]))
+    assert not pipeline.submitted
+    assert admission.channels["canal"].counts["reused"] == 2
+
+
+def test_unscored_results_are_not_reused():
+    pipeline = Pipeline()
+    admission = controller(pipeline, draw=0.1)
+    over_capacity(admission)
+    results = []
+    submit(admission, "hola", "canal", results)
+    submit(admission, "hola", "canal", results)
+    # Skipped by the pipeline: the waiting copy gets the same reason, the next copy tries again
+    pipeline.answer("stale")
+    assert results == [("hola", "stale"), ("hola", "stale")]
+    submit(admission, "hola", "canal", results)
+    assert [text for text, _, _ in pipeline.submitted] == ["hola"]
+
+
+def test_reuse_window_expires():
+    pipeline = Pipeline()
+    admission = controller(pipeline, draw=0.1, window=30.0)
+    over_capacity(admission)
+    results = []
+    submit(admission, "hola", "canal", results)
+    pipeline.answer((True, []))
+    admission.channels["canal"].seen["hola"][2] = time.monotonic() - 1
+    submit(admission, "hola", "canal", results)
+    assert len(pipeline.submitted) == 1
+
+
+def test_first_time_chatters_jump_the_queue():
+    pipeline = Pipeline()
+    admission = controller(pipeline, draw=0.99)
+    over_capacity(admission, other=0.0, low_risk=0.0)
+    results = []
+    submit(admission, "hola", "canal", results, username="nuevo", tags={"first-msg": "1"})
+    assert pipeline.submitted[0][0] == "hola" and pipeline.submitted[0][2] is True
+    # ...only while the channel is over capacity
+    admission.channels["canal"].admit = {"first": 1.0, "low_risk": 1.0, "other": 1.0}
+    submit(admission, "hola", "canal", results, username="otro", tags={"first-msg": "1"})
+    assert pipeline.submitted[1][2] is False
+
+
+def test_low_risk_messages():
+    pipeline = Pipeline()
+    admission = controller(pipeline, draw=0.5, trusted_after=2)
+    over_capacity(admission, other=1.0, low_risk=0.0)
+    results = []
+    submit(admission, "hola", "canal", results, username="mod", tags={"badges": "moderator/1"})
+    submit(admission, "Kappa", "canal", results, username="fan", tags={"emote-only": "1"})
+    assert results == [("hola", "sampled"), ("Kappa", "sampled")]
+
+    # A chatter becomes low-risk after trusted_after approved messages
+    for text in ("uno", "dos"):
+        submit(admission, text, "canal", results, username="viewer")
+        pipeline.answer((True, []))
+    submit(admission, "tres", "canal", results, username="viewer")
+    assert results[-1] == ("tres", "sampled")
+
@@ -0,0 +1,56 @@
+import json, threading
+
+from broadcaster import Broadcaster, encode_event, format_frame
+
+
+def decode(events):
+    return [json.loads(event)["data"] for event in events]
+
+
+def test_resume_from_last_event_id():
+    broadcaster = Broadcaster(capacity=4)
+    for i in range(1, 7):
+        broadcaster.publish("message", i)
+    # A viewer reconnecting with Last-Event-ID: 4 gets what followed it
+    events, last_seq = broadcaster.read(4, timeout=0)
+    assert decode(events) == [5, 6] and last_seq == 6
+    # Up to date: nothing, and the same id to pass next time
+    assert broadcaster.read(6, timeout=0) == ([], 6)
+    # Behind the buffer: what is left of it
+    events, last_seq = broadcaster.read(1, timeout=0)
+    assert decode(events) == [3, 4, 5, 6] and last_seq == 6
+
+
+def test_id_from_before_a_restart_replays_the_buffer():
+    broadcaster = Broadcaster()
+    broadcaster.publish("message", "a")
+    broadcaster.publish("message", "b")
+    events, last_seq = broadcaster.read(500, timeout=0)
+    assert decode(events) == ["a", "b"] and last_seq == 2
+
+
+def test_frame_id_is_the_last_event():
+    broadcaster = Broadcaster()
+    broadcaster.publish("message", "a")
+    seq = broadcaster.publish("update", {"id": 1})
+    events, last_seq = broadcaster.read(0, timeout=0)
+    frame = format_frame(events, last_seq)
+    assert frame.startswith(b"id: %d\n" % seq)
+    assert json.loads(frame.split(b"data: ", 1)[1]) == [{"type": "message", "data": "a"},
+                                                       {"type": "update", "data": {"id": 1}}]
+
+
+def test_shared_log_ids_are_kept():
+    broadcaster = Broadcaster()
+    broadcaster.publish("message", "a", seq=10, encoded=encode_event("message", "a"))
+    assert broadcaster.read(9, timeout=0) == ([encode_event("message", "a")], 10)
+
+
+def test_read_waits_for_the_next_event():
+    broadcaster = Broadcaster()
+    broadcaster.publish("message", "a")
+    threading.Timer(0.05, broadcaster.publish, args=("message", "b")).start()
+    events, last_seq = broadcaster.read(1, timeout=2)
+    assert decode(events) == ["b"] and last_seq == 2
+    broadcaster.close()
+    assert broadcaster.read(2, timeout=2) == ([], 2)
@@ -0,0 +1,73 @@
+import queue, time
+
+from expiry import ExpiryScheduler
+
+
+def collector():
+    expired = queue.Queue()
+    return expired, expired.put
+
+
+def test_expires_after_ttl():
+    expired, on_expire = collector()
+    scheduler = ExpiryScheduler(0.05, on_expire)
+    start = time.monotonic()
+    scheduler.touch("a")
+    assert expired.get(timeout=2) == "a"
+    assert time.monotonic() - start >= 0.05
+    assert len(scheduler) == 0
+
+
+def test_expires_in_deadline_order():
+    expired, on_expire = collector()
+    scheduler = ExpiryScheduler(10, on_expire)
+    scheduler.touch("late", ttl=0.15)
+    scheduler.touch("early", ttl=0.05)
+    assert [expired.get(timeout=2), expired.get(timeout=2)] == ["early", "late"]
+
+
+def test_touch_postpones_expiry():
+    expired, on_expire = collector()
+    scheduler = ExpiryScheduler(0.2, on_expire)
+    scheduler.touch("a")
+    scheduler.touch("b")
+    for _ in range(3):
+        time.sleep(0.05)
+        scheduler.touch("a")
+    assert expired.get(timeout=2) == "b"
+    assert "a" in scheduler.deadlines
+    assert expired.get(timeout=2) == "a"
+
+
+def test_shorter_deadline_wakes_the_scheduler():
+    expired, on_expire = collector()
+    scheduler = ExpiryScheduler(10, on_expire)
+    scheduler.touch("a")
+    scheduler.touch("a", ttl=0.05)
+    assert expired.get(timeout=2) == "a"
+    # The superseded 10 s entry does not expire the key again
+    assert len(scheduler) == 0
+
+
+def test_discard():
+    expired, on_expire = collector()
+    scheduler = ExpiryScheduler(0.05, on_expire)
+    scheduler.touch("gone")
+    scheduler.touch("kept", ttl=0.1)
+    scheduler.discard("gone")
+    assert expired.get(timeout=2) == "kept"
+    assert expired.empty()
+
+
+def test_callback_errors_do_not_stop_the_scheduler():
+    expired = queue.Queue()
+
+    def on_expire(key):
+        if key == "bad":
+            raise ValueError("boom")
+        expired.put(key)
+
+    scheduler = ExpiryScheduler(10, on_expire)
+    scheduler.touch("bad", ttl=0.02)
+    scheduler.touch("good", ttl=0.05)
+    assert expired.get(timeout=2) == "good"
@@ -0,0 +1,165 @@
+import pytest
+
+import flood
+from flood import FloodDetector, hamming, normalize_text, simhash
+
+COPYPASTA = "este es el copypasta mas largo de todo el chat de twitch hoy"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(flood, "time", clock)
+    return clock
+
+
+class Model:
+    """
+    Stand-in for the moderation pipeline: answers every message with `verdict`,
+    or keeps their callbacks until answer() when it is None.
+    """
+
+    def __init__(self, verdict=None):
+        self.verdict = verdict
+        self.pending = []
+
+    def score(self, callback):
+        if self.verdict is not None:
+            callback(self.verdict)
+        else:
+            self.pending.append(callback)
+
+    def answer(self, result):
+        self.pending.pop(0)(result)
+
+
+def submit(detector, model, text, username):
+    """Submit a message; returns the list its (result, spam) will be appended to"""
+    delivered = []
+    detector.submit(text, username, lambda result, spam: delivered.append((result, spam)), model.score)
+    return delivered
+
+
+def test_normalize_text():
+    assert normalize_text("  JAJAAAAA   jaja\n xD ") == "jajaa jaja xd"
+
+
+def test_simhash_of_near_duplicates():
+    signature = simhash(normalize_text(COPYPASTA))
+    assert signature == simhash(normalize_text("ESTE es el   copypasta mas largo de todo el chat de twitch hoy"))
+    assert hamming(signature, simhash(normalize_text(COPYPASTA + "!"))) <= 3
+    assert hamming(signature, simhash(normalize_text("una frase completamente distinta sobre otra cosa"))) > 10
+    assert 0 <= simhash("") < 1 << flood.SIGNATURE_BITS
+
+
+def test_copypasta(clock):
+    detector, model = FloodDetector(), Model((True, []))
+    first = submit(detector, model, COPYPASTA, "a")
+    second = submit(detector, model, COPYPASTA + "!", "b")
+    third = submit(detector, model, COPYPASTA, "c")
+    assert first == [((True, []), [])]
+    assert second == [((True, []), [])]
+    assert third == [((True, []), ["copypasta"])]
+
+
+def test_short_texts_are_not_copypastas(clock):
+    detector, model = FloodDetector(), Model((True, []))
+    for username in "abcde":
+        delivered = submit(detector, model, "PogChamp", username)
+    assert delivered[0][1] == []
+
+
+def test_repeated_and_flood(clock):
+    detector, model = FloodDetector(user_limit=3), Model()
+    results = [submit(detector, model, "compren mi curso", "spammer") for _ in range(3)]
+    model.answer((True, []))
+    assert [spam for delivered in results for _, spam in delivered] == [[], [], ["repeated"]]
+
+    different = submit(detector, model, "otra cosa totalmente diferente", "spammer")
+    model.answer((True, []))
+    assert different[0][1] == ["flood"]
+    assert detector.stats()["repeated"] == 1 and detector.stats()["flood"] == 1
+
+
+def test_window_expiry(clock):
+    detector, model = FloodDetector(window=30.0, user_window=10.0), Model((True, []))
+    submit(detector, model, COPYPASTA, "a")
+    submit(detector, model, COPYPASTA, "b")
+    assert detector.stats()["window_messages"] == 2
+
+    clock.now += 31
+    delivered = submit(detector, model, COPYPASTA, "c")
+    assert delivered[0][1] == []
+    stats = detector.stats()
+    assert stats["window_messages"] == 1
+    assert stats["bands"] == flood.BANDS
+    assert set(detector.user_times) == {"c"}
+
+
+def test_max_entries(clock):
+    detector, model = FloodDetector(max_entries=10), Model()
+    for i in range(25):
+        submit(detector, model, f"mensaje numero {i} de la prueba", f"user{i}")
+    assert detector.stats()["window_messages"] <= 10
+
+
+def test_verdict_reuse(clock):
+    detector, model = FloodDetector(), Model()
+    first = submit(detector, model, "hola a todos", "a")
+    model.answer((False, ["Insulto"]))
+    second = submit(detector, model, "HOLA   a todos", "b")
+    assert not model.pending
+    assert second == [((False, ["Insulto"]), [])]
+    assert first == second
+    assert detector.stats()["reused"] == 1
+
+
+def test_reuse_distance(clock):
+    exact = FloodDetector(reuse_distance=0)
+    near = FloodDetector(reuse_distance=3)
+    for detector in (exact, near):
+        model = Model()
+        submit(detector, model, COPYPASTA, "a")
+        model.answer((True, []))
+        submit(detector, model, COPYPASTA + "!", "b")
+        assert len(model.pending) == (1 if detector is exact else 0)
+
+
+def test_coalesces_while_scoring(clock):
+    detector, model = FloodDetector(), Model()
+    first = submit(detector, model, "hola a todos", "a")
+    second = submit(detector, model, "hola a todos", "b")
+    assert len(model.pending) == 1 and not first and not second
+
+    model.answer((True, []))
+    assert first == second == [((True, []), [])]
+    assert detector.stats()["coalesced"] == 1
+
+
+def test_failures_are_not_reused(clock):
+    detector, model = FloodDetector(), Model()
+    first = submit(detector, model, "hola a todos", "a")
+    model.answer("timeout")
+    second = submit(detector, model, "hola a todos", "b")
+    assert first == [("timeout", [])]
+    assert len(model.pending) == 1 and not second
+
+
+def test_callback_errors_reach_the_other_waiters(clock):
+    detector, model = FloodDetector(), Model()
+
+    def failing(result, spam):
+        raise ValueError("boom")
+
+    detector.submit("hola a todos", "a", failing, model.score)
+    waiting = submit(detector, model, "hola a todos", "b")
+    model.answer((True, []))
+    assert waiting == [((True, []), [])]
@@ -0,0 +1,77 @@
+from irc import IRCIngest, parse_irc_line, unescape_tag_value
+
+
+def test_privmsg_with_tags():
+    line = ("@badge-info=;badges=broadcaster/1;id=b34ccfc7-4977-403a-8a94-33c6bac34fb8;"
+            "tmi-sent-ts=1507246572675;user-id=1337 "
+            ":ronni!ronni@ronni.tmi.twitch.tv PRIVMSG #Ronni :Kappa Keepo Kappa")
+    message = parse_irc_line(line)
+    assert message["command"] == "PRIVMSG"
+    assert message["prefix"] == "ronni!ronni@ronni.tmi.twitch.tv"
+    assert message["params"] == ["#Ronni", "Kappa Keepo Kappa"]
+    assert message["tags"] == {
+        "badge-info": "",
+        "badges": "broadcaster/1",
+        "id": "b34ccfc7-4977-403a-8a94-33c6bac34fb8",
+        "tmi-sent-ts": "1507246572675",
+        "user-id": "1337",
+    }
+
+
+def test_tag_without_value():
+    message = parse_irc_line("@emote-only;mod=0 :a!a@a PRIVMSG #c :hola")
+    assert message["tags"] == {"emote-only": "", "mod": "0"}
+
+
+def test_tag_value_escapes():
+    assert unescape_tag_value(r"hola\smundo") == "hola mundo"
+    assert unescape_tag_value(r"a\:b") == "a;b"
+    assert unescape_tag_value(r"back\\slash") == "back\\slash"
+    assert unescape_tag_value(r"line\r\nbreak") == "line\r\nbreak"
+    # Unknown escapes keep the character, a trailing backslash is dropped
+    assert unescape_tag_value(r"\xy") == "xy"
+    assert unescape_tag_value("end\\") == "end"
+
+
+def test_escaped_tags_in_line():
+    message = parse_irc_line(r"@system-msg=5\sraiders\sfrom\sx;display-name=A\:B :tmi.twitch.tv USERNOTICE #c")
+    assert message["tags"]["system-msg"] == "5 raiders from x"
+    assert message["tags"]["display-name"] == "A;B"
+    assert message["params"] == ["#c"]
+
+
+def test_trailing_keeps_colons_and_spaces():
+    message = parse_irc_line(":a!a@a PRIVMSG #c :hola :D  que tal")
+    assert message["params"] == ["#c", "hola :D  que tal"]
+
+
+def test_no_prefix_and_command_case():
+    assert parse_irc_line("PING :tmi.twitch.tv") == {
+        "tags": {}, "prefix": None, "command": "PING", "params": ["tmi.twitch.tv"]}
+    assert parse_irc_line("ping")["command"] == "PING"
+
+
+def test_empty_lines():
+    assert parse_irc_line("") is None
+    assert parse_irc_line("@id=1 ") is None
+    assert parse_irc_line(":prefix.only") is None
+
+
+def test_dispatch_routes_by_channel():
+    ingest = IRCIngest("localhost", 6667, "nick", "oauth:x")
+    received = []
+    ingest.callbacks["canal"] = lambda *args: received.append(args)
+    ingest.dispatch(parse_irc_line("@id=1 :Viewer!viewer@viewer.tmi.twitch.tv PRIVMSG #Canal : hola "))
+    ingest.dispatch(parse_irc_line(":a!a@a PRIVMSG #otro :nadie escucha"))
+    ingest.dispatch(parse_irc_line(":a!a@a PRIVMSG #canal"))
+    assert received == [("canal", "Viewer", "hola", {"id": "1"})]
+
+
+def test_dispatch_survives_callback_errors():
+    ingest = IRCIngest("localhost", 6667, "nick", "oauth:x")
+
+    def callback(*args):
+        raise ValueError("boom")
+
+    ingest.callbacks["canal"] = callback
+    ingest.dispatch(parse_irc_line(":a!a@a PRIVMSG #canal :hola"))
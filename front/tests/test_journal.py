@@ -0,0 +1,100 @@
+import json, os
+
+from journal import ModerationJournal
+
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_migrates_legacy_store(tmp_path):
+    legacy = tmp_path / "moderated_messages.json"
+    legacy.write_text(json.dumps({"messages": [{"id": "a", "text": "uno"}, {"id": "b", "text": "dos"}]}))
+    path = str(tmp_path / "journal.jsonl")
+
+    journal = ModerationJournal(path, legacy_path=str(legacy))
+    assert journal.get("a") == {"id": "a", "text": "uno"}
+    assert "b" in journal
+    assert read_lines(path) == [{"op": "set", "message": {"id": "a", "text": "uno"}},
+                                {"op": "set", "message": {"id": "b", "text": "dos"}}]
+
+    # Once the journal exists the legacy store is not imported again
+    legacy.write_text(json.dumps({"messages": [{"id": "c"}]}))
+    assert "c" not in ModerationJournal(path, legacy_path=str(legacy))
+
+
+def test_migration_normalizes_ids(tmp_path):
+    legacy = tmp_path / "moderated_messages.json"
+    legacy.write_text(json.dumps({"messages": [{"id": "canal:A"}]}))
+    journal = ModerationJournal(str(tmp_path / "journal.jsonl"), legacy_path=str(legacy),
+                                normalize_id=lambda message_id: message_id.lower())
+    assert journal.get("canal:a") == {"id": "canal:a"}
+
+
+def test_unreadable_legacy_store(tmp_path):
+    legacy = tmp_path / "moderated_messages.json"
+    legacy.write_text("{not json")
+    journal = ModerationJournal(str(tmp_path / "journal.jsonl"), legacy_path=str(legacy))
+    assert journal.stats() == {"entries": 0, "journal_lines": 0}
+
+
+def test_toggle_and_replay(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ModerationJournal(path)
+    assert journal.toggle({"id": "a"}) == "moderated"
+    assert journal.toggle({"id": "b"}) == "moderated"
+    assert journal.toggle({"id": "a"}) == "unmoderated"
+    assert journal.stats() == {"entries": 1, "journal_lines": 3}
+
+    reloaded = ModerationJournal(path)
+    assert "a" not in reloaded
+    assert reloaded.get("b") == {"id": "b"}
+
+
+def test_torn_last_line(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    path.write_text('{"op": "set", "message": {"id": "a"}}\n{"op": "set", "mess')
+    journal = ModerationJournal(str(path))
+    assert "a" in journal
+
+    # The next entry starts on a line of its own
+    assert journal.toggle({"id": "b"}) == "moderated"
+    assert "b" in ModerationJournal(str(path))
+
+
+def test_compaction(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ModerationJournal(path, compact_ratio=2.0, compact_min_lines=10)
+    journal.toggle({"id": "keep"})
+    for _ in range(4):
+        journal.toggle({"id": "flip"})
+        journal.toggle({"id": "flip"})
+    # 9 lines: below compact_min_lines
+    assert journal.stats() == {"entries": 1, "journal_lines": 9}
+
+    journal.toggle({"id": "flip"})
+    # 10 lines for 2 live entries: rewritten to the live entries only
+    assert journal.stats() == {"entries": 2, "journal_lines": 2}
+    assert sorted(entry["message"]["id"] for entry in read_lines(path)) == ["flip", "keep"]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    reloaded = ModerationJournal(path)
+    assert "keep" in reloaded and "flip" in reloaded
+
+
+def test_other_process_appends_and_compactions(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    reader = ModerationJournal(path, refresh_interval=0)
+    writer = ModerationJournal(path, compact_ratio=1.5, compact_min_lines=4)
+
+    writer.toggle({"id": "a"})
+    assert "a" in reader
+
+    writer.toggle({"id": "b"})
+    writer.toggle({"id": "b"})
+    writer.toggle({"id": "c"})
+    # The writer compacted the file under the reader, which replays it from the start
+    assert writer.stats()["journal_lines"] == 2
+    assert "c" in reader and "b" not in reader
+    assert reader.stats() == {"entries": 2, "journal_lines": 2}
@@ -0,0 +1,29 @@
+import hashlib
+
+from message_ids import MESSAGE_ID_BYTES, get_message_id, normalize_message_id
+
+TAGS = {"id": "b34ccfc7-4977-403a-8a94-33c6bac34fb8", "tmi-sent-ts": "1700000000000", "user-id": "1337"}
+
+
+def test_tagged_messages_hash_their_irc_ids():
+    expected = hashlib.blake2b(b"b34ccfc7-4977-403a-8a94-33c6bac34fb8|1700000000000|1337",
+                               digest_size=MESSAGE_ID_BYTES).hexdigest()
+    assert get_message_id("viewer", "12:00:00", "hola", TAGS) == expected
+    assert len(expected) == 2 * MESSAGE_ID_BYTES
+    # The same text sent again in the same second is another message
+    assert get_message_id("viewer", "12:00:00", "hola", {**TAGS, "id": "otro"}) != expected
+    # The display fields do not take part
+    assert get_message_id("otro", "12:00:01", "chao", TAGS) == expected
+
+
+def test_untagged_messages_hash_the_legacy_key():
+    expected = hashlib.blake2b(b"viewer-12:00:00-hola", digest_size=MESSAGE_ID_BYTES).hexdigest()
+    assert get_message_id("viewer", "12:00:00", "hola") == expected
+    assert get_message_id("viewer", "12:00:00", "hola", {"id": ""}) == expected
+
+
+def test_legacy_record_ids_are_normalized():
+    # A record saved under the old username-timestamp-text ID matches the untagged message
+    assert normalize_message_id("viewer-12:00:00-hola") == get_message_id("viewer", "12:00:00", "hola")
+    compact = get_message_id("viewer", "12:00:00", "hola", TAGS)
+    assert normalize_message_id(compact) == compact
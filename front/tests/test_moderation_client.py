@@ -0,0 +1,155 @@
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import requests
+
+from moderation_client import FALLBACK, ModerationClient, _FairLimiter
+
+
+class Transport:
+    """Stands in for the stream client: answers from a list of outcomes, an exception or a reply"""
+    refused = None
+
+    def __init__(self):
+        self.outcomes = []
+        self.calls = []
+
+    def moderate(self, message, timeout=2):
+        self.calls.append(message)
+        outcome = self.outcomes.pop(0) if self.outcomes else {"status": "success", "approved": True, "reasons": []}
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def client(**kwargs):
+    transport = Transport()
+    return ModerationClient("http://ia.invalid/moderate", stream=transport, **kwargs), transport
+
+
+def test_verdicts():
+    moderation, transport = client()
+    transport.outcomes = [{"status": "success", "approved": False, "reasons": ["Insulto"]},
+                          {"status": "success", "approved": True, "reason": "No baneable"},
+                          {"status": "success", "approved": True}]
+    assert moderation.moderate("a") == (False, ["Insulto"])
+    assert moderation.moderate("b") == (True, ["No baneable"])
+    assert moderation.moderate("c") == (True, ["No baneable"])
+
+
+def test_errors_approve():
+    moderation, transport = client()
+    transport.outcomes = [RuntimeError("HTTP 500"), {"status": "error", "message": "boom"}, TimeoutError()]
+    assert [moderation.moderate(text) for text in "abc"] == [FALLBACK] * 3
+    stats = moderation.stats()
+    assert (stats["errors"], stats["timeouts"]) == (2, 1)
+
+
+def test_every_kind_of_timeout_counts_as_one():
+    moderation, transport = client()
+    transport.outcomes = [FutureTimeout(), requests.Timeout(), TimeoutError()]
+    assert [moderation.moderate(text) for text in "abc"] == [FALLBACK] * 3
+    stats = moderation.stats()
+    assert (stats["errors"], stats["timeouts"]) == (0, 3)
+
+
+def test_circuit_opens_half_opens_and_closes():
+    moderation, transport = client(failure_threshold=3, reset_timeout=10)
+    transport.outcomes = [RuntimeError("down")] * 3
+    for text in "abc":
+        assert moderation.moderate(text) == FALLBACK
+    assert moderation.stats()["circuit"] == "open"
+
+    # Open: answered with the fallback without calling ia
+    assert moderation.moderate("d") == FALLBACK
+    assert transport.calls == ["a", "b", "c"]
+    assert moderation.stats()["short_circuited"] == 1
+
+    # After reset_timeout one trial call goes through, and its success closes the circuit
+    moderation.opened_at -= 10
+    assert moderation.moderate("e") == (True, ["No baneable"])
+    assert transport.calls[-1] == "e"
+    assert moderation.stats()["circuit"] == "closed"
+    assert moderation.consecutive_failures == 0
+
+
+def test_failed_trial_reopens():
+    moderation, transport = client(failure_threshold=2, reset_timeout=10)
+    transport.outcomes = [RuntimeError("down")] * 3
+    moderation.moderate("a")
+    moderation.moderate("b")
+    moderation.opened_at -= 10
+    assert moderation.moderate("trial") == FALLBACK
+    assert moderation.stats()["circuit"] == "open"
+    assert moderation.moderate("c") == FALLBACK
+    assert transport.calls == ["a", "b", "trial"]
+
+
+def test_one_trial_at_a_time():
+    moderation, transport = client(failure_threshold=1, reset_timeout=10)
+    transport.outcomes = [RuntimeError("down")]
+    moderation.moderate("a")
+    moderation.opened_at -= 10
+    assert moderation._allow_call()
+    assert moderation.stats()["circuit"] == "half_open"
+    # A second call while the trial is in flight is short-circuited
+    assert not moderation._allow_call()
+
+
+def test_timeout_is_clamped():
+    moderation, _ = client(timeout=2, min_timeout=0.2)
+    # Too few samples: the maximum
+    for _ in range(19):
+        moderation._record(True, latency=0.001)
+    assert moderation.current_timeout() == 2
+    moderation._record(True, latency=0.001)
+    assert moderation.current_timeout() == 0.2
+
+    moderation, _ = client(timeout=2, min_timeout=0.2)
+    for _ in range(20):
+        moderation._record(True, latency=0.3)
+    assert moderation.current_timeout() == 0.6
+
+    moderation, _ = client(timeout=2, min_timeout=0.2)
+    for _ in range(20):
+        moderation._record(True, latency=5.0)
+    assert moderation.current_timeout() == 2
+
+
+def test_limiter_caps_calls():
+    limiter = _FairLimiter(2)
+    assert limiter.acquire("a", 0.01)
+    assert limiter.acquire("a", 0.01)
+    assert not limiter.acquire("b", 0.01)
+    assert limiter.queued() == 0
+    limiter.release()
+    assert limiter.acquire("b", 0.01)
+
+
+def test_limiter_serves_channels_round_robin():
+    limiter = _FairLimiter(1)
+    assert limiter.acquire("busy", 1)
+    served = []
+    granted = threading.Semaphore(0)
+
+    def wait_turn(channel):
+        assert limiter.acquire(channel, 5)
+        served.append(channel)
+        granted.release()
+
+    def queue(channel):
+        waiting = limiter.queued()
+        threading.Thread(target=wait_turn, args=(channel,), daemon=True).start()
+        while limiter.queued() == waiting:
+            threading.Event().wait(0.001)
+
+    # The busy channel queues five calls before the quiet ones queue theirs
+    for _ in range(5):
+        queue("busy")
+    queue("quiet")
+    queue("other")
+    for _ in range(7):
+        limiter.release()
+        assert granted.acquire(timeout=2)
+    # The quiet channels are served after one busy call each, not after all five
+    assert served == ["busy", "quiet", "other", "busy", "busy", "busy", "busy"]
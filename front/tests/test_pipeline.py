@@ -0,0 +1,121 @@
+import queue, threading
+
+import pytest
+
+from pipeline import ModerationPipeline
+
+
+class Moderator:
+    """moderate_fn that holds each message until release() and records the order they came in"""
+
+    def __init__(self):
+        self.started = queue.Queue()
+        self.gate = threading.Semaphore(0)
+
+    def __call__(self, text, *args):
+        self.started.put(text)
+        self.gate.acquire()
+        return (text != "malo", [] if text != "malo" else ["Insulto"])
+
+    def release(self, count=1):
+        for _ in range(count):
+            self.gate.release()
+
+
+def submit(pipeline, text, results, **kwargs):
+    pipeline.submit(text, lambda result: results.put((text, result)), **kwargs)
+
+
+def busy_pipeline(**kwargs):
+    """A one-worker pipeline whose worker is held on a first message"""
+    moderator = Moderator()
+    pipeline = ModerationPipeline(moderator, workers=1, **kwargs)
+    results = queue.Queue()
+    submit(pipeline, "primero", results)
+    assert moderator.started.get(timeout=2) == "primero"
+    return pipeline, moderator, results
+
+
+def test_verdicts_in_arrival_order():
+    pipeline, moderator, results = busy_pipeline()
+    for text in ("hola", "malo", "chao"):
+        submit(pipeline, text, results)
+    moderator.release(4)
+    assert [results.get(timeout=2) for _ in range(4)] == [
+        ("primero", (True, [])), ("hola", (True, [])), ("malo", (False, ["Insulto"])), ("chao", (True, []))]
+    assert pipeline.stats()["moderated"] == 4
+
+
+def test_drop_oldest():
+    pipeline, moderator, results = busy_pipeline(max_pending=2)
+    for text in ("a", "b", "c"):
+        submit(pipeline, text, results)
+    # The stalest queued message is given up on right away
+    assert results.get(timeout=2) == ("a", "overflow")
+    moderator.release(3)
+    assert sorted(results.get(timeout=2)[0] for _ in range(3)) == ["b", "c", "primero"]
+    assert pipeline.stats()["skipped"] == 1
+
+
+def test_drop_newest():
+    pipeline, moderator, results = busy_pipeline(max_pending=2, overflow="drop_newest")
+    for text in ("a", "b", "c"):
+        submit(pipeline, text, results)
+    assert results.get(timeout=2) == ("c", "overflow")
+    moderator.release(3)
+    assert sorted(results.get(timeout=2)[0] for _ in range(3)) == ["a", "b", "primero"]
+
+
+def test_unknown_overflow_policy():
+    with pytest.raises(ValueError):
+        ModerationPipeline(lambda text, *args: (True, []), overflow="drop_random")
+
+
+def test_callback_errors_do_not_stop_the_workers():
+    pipeline, moderator, results = busy_pipeline()
+    pipeline.submit("a", lambda result: 1 / 0)
+    submit(pipeline, "b", results)
+    moderator.release(3)
+    assert [results.get(timeout=2)[0] for _ in range(2)] == ["primero", "b"]
+
+
+def test_priority_lane():
+    pipeline, moderator, results = busy_pipeline(max_pending=2)
+    for text in ("a", "b"):
+        submit(pipeline, text, results)
+    for text in ("p1", "p2", "p3"):
+        submit(pipeline, text, results, priority=True)
+    # Priority messages are taken first and not counted against max_pending
+    assert pipeline.stats()["skipped"] == 0
+    moderator.release(6)
+    assert [results.get(timeout=2)[0] for _ in range(6)] == ["primero", "p1", "p2", "p3", "a", "b"]
+
+
+def test_priority_messages_are_never_dropped():
+    pipeline, moderator, results = busy_pipeline(max_pending=1)
+    submit(pipeline, "p", results, priority=True)
+    submit(pipeline, "a", results)
+    submit(pipeline, "b", results)
+    assert results.get(timeout=2) == ("a", "overflow")
+    moderator.release(3)
+    assert [results.get(timeout=2)[0] for _ in range(3)] == ["primero", "p", "b"]
+
+
+def test_stale_messages_are_skipped():
+    pipeline, moderator, results = busy_pipeline(max_wait=0.05)
+    submit(pipeline, "tarde", results)
+    assert results.empty()
+    threading.Event().wait(0.1)
+    moderator.release()
+    assert results.get(timeout=2) == ("primero", (True, []))
+    # Waited longer than max_wait: skipped without calling the model
+    assert results.get(timeout=2) == ("tarde", "stale")
+    assert moderator.started.empty()
+    assert pipeline.stats()["skipped"] == 1
+
+
+def test_channel_is_passed_on():
+    channels = queue.Queue()
+    pipeline = ModerationPipeline(lambda text, channel: channels.put(channel) or (True, []), workers=1)
+    pipeline.submit("hola", lambda result: None, channel="canal")
+    assert channels.get(timeout=2) == "canal"
@@ -0,0 +1,40 @@
+from ring_buffer import RingBuffer
+
+
+def test_numbering():
+    buffer = RingBuffer(3)
+    assert buffer.since(0) == []
+    assert len(buffer) == 0
+    assert [buffer.append(item) for item in "abc"] == [1, 2, 3]
+    assert buffer.since(0) == [(1, "a"), (2, "b"), (3, "c")]
+    assert buffer.first_seq == 1 and buffer.last_seq == 3
+
+
+def test_wrap_around():
+    buffer = RingBuffer(3)
+    for item in "abcdefg":
+        buffer.append(item)
+    # Only the newest `capacity` items are left, still under their own ids
+    assert buffer.first_seq == 5 and buffer.last_seq == 7
+    assert buffer.since(0) == [(5, "e"), (6, "f"), (7, "g")]
+    assert len(buffer) == 3
+    assert len(buffer.slots) == 3
+
+
+def test_resume_from_last_event_id():
+    buffer = RingBuffer(4)
+    for i in range(1, 11):
+        buffer.append(f"m{i}")
+    # A client that received id 8 gets what followed it
+    assert buffer.since(8) == [(9, "m9"), (10, "m10")]
+    # Up to date: nothing to send
+    assert buffer.since(10) == []
+    # Fell behind the buffer: it gets what is left, from the oldest item still held
+    assert buffer.since(2) == [(7, "m7"), (8, "m8"), (9, "m9"), (10, "m10")]
+
+
+def test_minimum_capacity():
+    buffer = RingBuffer(0)
+    buffer.append("a")
+    buffer.append("b")
+    assert buffer.since(0) == [(2, "b")]
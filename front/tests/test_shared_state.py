@@ -0,0 +1,35 @@
+import pytest
+
+from shared_state import LocalState, SQLiteState, create_state
+
+
+@pytest.fixture(params=["local", "sqlite"])
+def state(request, tmp_path):
+    return create_state(request.param, capacity=3, sqlite_path=str(tmp_path / "state.db"))
+
+
+def test_sequence_ids_per_channel(state):
+    assert [state.append("a", b"1"), state.append("a", b"2"), state.append("b", b"x")] == [1, 2, 1]
+    assert state.read("a", 0) == [(1, b"1"), (2, b"2")]
+    assert state.read("a", 1) == [(2, b"2")]
+    assert state.read("a", 2) == []
+    assert state.read("c", 0) == []
+
+
+def test_log_keeps_the_last_capacity_events(state):
+    for i in range(1, 11):
+        state.append("a", b"%d" % i)
+    assert state.read("a", 0) == [(8, b"8"), (9, b"9"), (10, b"10")]
+    assert state.read("a", 8) == [(9, b"9"), (10, b"10")]
+
+
+def test_only_the_local_state_is_unshared():
+    assert LocalState.shared is False
+    assert SQLiteState.shared is True
+
+
+def test_leases(state):
+    assert state.acquire("leader:a", "p1", 10)
+    assert not state.acquire("leader:a", "p2", 10)
+    state.release("leader:a", "p1")
+    assert state.acquire("leader:a", "p2", 10)
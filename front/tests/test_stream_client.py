@@ -0,0 +1,166 @@
+import json, socket, threading, time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import pytest
+
+from stream_client import ModerationBatchClient, ModerationStreamClient
+
+
+class Server:
+    """
+    Stands in for ia's /moderate/stream: answers every connection with `status`.
+    With 200 it echoes each frame as an approval, unless `silent`.
+    """
+
+    def __init__(self, status=200, silent=False):
+        self.status = status
+        self.silent = silent
+        self.connections = 0
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen()
+        self.url = f"http://127.0.0.1:{self.listener.getsockname()[1]}/moderate/stream"
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        reader = sock.makefile("rb")
+        while reader.readline() not in (b"\r\n", b""):
+            pass  # Request headers
+        if self.status != 200:
+            sock.sendall(b"HTTP/1.1 %d Error\r\nContent-Length: 0\r\nConnection: close\r\n\r\n" % self.status)
+            sock.close()
+            return
+        sock.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n")
+        while True:
+            size = int(reader.readline().strip() or b"0", 16)
+            if size == 0:
+                break
+            frame = json.loads(reader.read(size))
+            reader.readline()
+            if self.silent:
+                continue
+            data = json.dumps({"id": frame["id"], "status": "success", "approved": True, "reasons": []}).encode() + b"\n"
+            sock.sendall(b"%x\r\n%s\r\n" % (len(data), data))
+        sock.sendall(b"0\r\n\r\n")
+        sock.close()
+
+    def close(self):
+        self.listener.close()
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(**kwargs):
+        servers.append(Server(**kwargs))
+        return servers[-1]
+    yield start
+    for s in servers:
+        s.close()
+
+
+def test_frames_are_answered(server):
+    client = ModerationStreamClient(server().url)
+    assert client.moderate("hola")["approved"] is True
+    assert client.moderate("chao")["status"] == "success"
+    assert client.available() and client.refused is None
+    client.close()
+
+
+@pytest.mark.parametrize("status", [404, 405, 411])
+def test_unsupported_statuses_refuse_the_stream(server, status):
+    client = ModerationStreamClient(server(status=status).url)
+    with pytest.raises(ConnectionError):
+        client.moderate("hola")
+    # Set by the reader thread, which may finish after the send on the closed connection failed
+    assert wait_for(lambda: client.refused == f"HTTP {status}")
+    assert not client.available()
+
+
+def test_server_errors_back_off(server):
+    ia = server(status=503)
+    client = ModerationStreamClient(ia.url)
+    with pytest.raises(ConnectionError):
+        client.moderate("hola")
+    assert client.refused is None
+    # Waiting to reconnect: calls fail fast without connecting
+    assert not client.available()
+    with pytest.raises(ConnectionError):
+        client.moderate("hola")
+    assert ia.connections == 1
+
+    # Once the backoff is over and the server recovers, the stream is used again
+    ia.status = 200
+    client.next_attempt = 0
+    assert client.available()
+    assert client.moderate("hola")["approved"] is True
+    assert client.backoff == 0
+
+
+def test_silent_stream_backs_off(server):
+    ia = server(silent=True)
+    client = ModerationStreamClient(ia.url)
+    with pytest.raises(FutureTimeout):
+        client.moderate("hola", timeout=0.1)
+    assert client.refused is None
+    assert client.conn is None and not client.available()
+    first = client.backoff
+
+    client.next_attempt = 0
+    with pytest.raises(FutureTimeout):
+        client.moderate("hola", timeout=0.1)
+    # Each connection that answers nothing doubles the wait
+    assert client.backoff == 2 * first
+    assert ia.connections == 2
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    def json(self):
+        return {"results": [{"approved": message != "malo", "reasons": []} for message in self.messages]}
+
+
+def test_batches_in_flight_concurrently(monkeypatch):
+    client = ModerationBatchClient("http://ia.invalid/moderate/batch", max_batch_size=1, max_in_flight=3)
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+    release = threading.Event()
+
+    def post(url, json=None, timeout=None):
+        with lock:
+            in_flight.append(json["mensajes"])
+            peak.append(len(in_flight))
+        release.wait(2)
+        with lock:
+            in_flight.remove(json["mensajes"])
+        return Response(json["mensajes"])
+
+    monkeypatch.setattr(client.session, "post", post)
+    futures = [client.submit(text) for text in ("a", "b", "malo", "c")]
+    wait_for(lambda: len(peak) == 3)
+    # Three batches are sent without waiting for each other; the fourth waits for a sender
+    assert max(peak) == 3
+    release.set()
+    assert [future.result(timeout=2)["approved"] for future in futures] == [True, True, False, True]
@@ -1,4 +1,10 @@
-from utils import cargar_modelo
+from utils import cargar_modelo, moderate_messages_detailed, get_predictions
+from batching import BatchScheduler
+from cache import PredictionCache
+from cascada import ClasificadorRapido
+from workers import WorkerPool
+from metrics import Gauge
+import torch
 from flask import Flask
 from dotenv import load_dotenv
 import os
@@ -7,4 +13,51 @@ import os
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 app = Flask(__name__)
-model, tokenizer = cargar_modelo()  # Load both model and tokenizer
+model, tokenizer = cargar_modelo(backend=os.getenv("MODEL_BACKEND", "fp32"))  # Load both model and tokenizer
+
+# Results of repeated messages (emote spam, copypastas) are served from memory
+cache = PredictionCache(
+    max_size=int(os.getenv("CACHE_MAX_SIZE", "50000")),
+    ttl_seconds=float(os.getenv("CACHE_TTL_SECONDS", "0")) or None
+)
+
+# Cascade mode: a cheap first stage decides clear-cut messages, BERT only sees the uncertain ones
+cascade = None
+if os.getenv("CASCADE_ENABLED", "0") in ("1", "true"):
+    cascade_path = os.getenv("CASCADE_MODEL", "modelo_final_guardado/cascada.npz")
+    if os.path.exists(cascade_path):
+        cascade = ClasificadorRapido.cargar(
+            cascade_path,
+            banda=(float(os.getenv("CASCADE_BAND_LOW", "0.05")), float(os.getenv("CASCADE_BAND_HIGH", "0.95")))
+        )
+    else:
+        print(f"Cascade model not found at {cascade_path}, train it with 'python cascada.py entrenar'. Using BERT only.")
+
+# Worker-pool mode: the model runs in IA_WORKERS processes sharing its weights, forked on the
+# first batch; the cache and the first stage stay in this process
+pool = None
+num_workers = int(os.getenv("IA_WORKERS", "0"))
+if num_workers > 0:
+    pool = WorkerPool(
+        lambda texts: get_predictions(texts, model, tokenizer),
+        num_workers,
+        model=model,
+        intra_op_threads=int(os.getenv("IA_WORKER_THREADS", "0")) or None,
+        inter_op_threads=int(os.getenv("IA_WORKER_INTEROP_THREADS", "1")),
+        initializer=getattr(model, "reset_session", None)  # Called with the worker's thread count
+    )
+    # Request threads of this process only tokenize and route, keep torch out of their way
+    torch.set_num_threads(1)
+
+# Group concurrent /moderate requests into a single forward pass
+batcher = BatchScheduler(
+    lambda texts: moderate_messages_detailed(
+        texts, model, tokenizer, cache=cache, cascade=cascade,
+        predictor=pool.run if pool is not None else None
+    ),
+    max_batch_size=int(os.getenv("BATCH_MAX_SIZE", "32")),
+    max_wait_ms=float(os.getenv("BATCH_MAX_WAIT_MS", "10")),
+    concurrency=num_workers if pool is not None else 1
+)
+
+Gauge("ia_queue_depth", "Messages waiting in the batching queue", batcher.queue.qsize)
@@ -0,0 +1,148 @@
+import os
+import torch
+from torch import nn
+from transformers.modeling_outputs import SequenceClassifierOutput
+
+# Inference backends accepted by cargar_modelo
+BACKENDS = ("fp32", "int8", "onnx", "early_exit")
+
+ONNX_FILENAME = "model.onnx"
+ONNX_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+
+def quantize_int8(model):
+    """
+    Dynamic INT8 quantization of the Linear layers of a loaded fp32 model (CPU only).
+    Weights are quantized ahead of time, activations on the fly.
+    """
+    from torch.ao.quantization import quantize_dynamic
+
+    quantized = quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    quantized.eval()
+    return quantized
+
+
+class _LogitsOnly(nn.Module):
+    """Export wrapper: positional inputs in, bare logits tensor out."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids
+        ).logits
+
+
+def export_onnx(model, tokenizer, onnx_path):
+    """
+    Export a loaded fp32 model to ONNX with dynamic batch and sequence axes.
+    """
+    sample = tokenizer(["hola chat"], return_tensors="pt", padding=True)
+    args = tuple(sample.get(name, torch.zeros_like(sample["input_ids"])) for name in ONNX_INPUTS)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ONNX_INPUTS}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    tmp_path = onnx_path + ".tmp"
+    torch.onnx.export(
+        _LogitsOnly(model).eval(),
+        args,
+        tmp_path,
+        input_names=list(ONNX_INPUTS),
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=17,
+        dynamo=False
+    )
+    # Only expose complete exports under the final name
+    os.replace(tmp_path, onnx_path)
+
+
+class OnnxModel:
+    """
+    ONNX Runtime session exposing the subset of the transformers model
+    interface used by get_predictions: model(**inputs).logits and eval().
+    """
+
+    def __init__(self, onnx_path, config=None, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The 'onnx' backend requires the onnxruntime package") from e
+
+        self.ort = ort
+        self.config = config
+        self.name_or_path = onnx_path
+        self.reset_session(num_threads)
+
+    def reset_session(self, num_threads=None):
+        """
+        (Re)create the runtime session, e.g. inside a forked worker: ONNX Runtime
+        thread pools do not survive fork.
+        """
+        options = self.ort.SessionOptions()
+        options.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = self.ort.InferenceSession(self.name_or_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask=None, token_type_ids=None, **kwargs):
+        feeds = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask if attention_mask is not None else torch.ones_like(input_ids),
+            "token_type_ids": token_type_ids if token_type_ids is not None else torch.zeros_like(input_ids),
+        }
+        feeds = {name: feeds[name].cpu().numpy().astype("int64") for name in self.input_names}
+        logits = self.session.run(["logits"], feeds)[0]
+        return SequenceClassifierOutput(logits=torch.from_numpy(logits))
+
+
+def load_onnx(model, tokenizer, model_dir):
+    """
+    Load the ONNX export cached in model_dir, exporting it first if it is
+    missing or older than model.safetensors.
+    """
+    onnx_path = os.path.join(model_dir, ONNX_FILENAME)
+    weights_path = os.path.join(model_dir, "model.safetensors")
+
+    stale = (
+        not os.path.exists(onnx_path)
+        or (os.path.exists(weights_path) and os.path.getmtime(weights_path) > os.path.getmtime(onnx_path))
+    )
+    if stale:
+        print(f"Exporting ONNX model to {onnx_path}...")
+        export_onnx(model, tokenizer, onnx_path)
+
+    return OnnxModel(onnx_path, config=model.config, num_threads=torch.get_num_threads())
+
+
+def apply_backend(model, tokenizer, model_dir, backend):
+    """
+    Turn a loaded fp32 model into the requested inference backend.
+
+    Parameters:
+    model: The loaded fp32 WeightedLossModel
+    tokenizer: The loaded tokenizer
+    model_dir (str): Model directory, where exported artifacts are cached
+    backend (str): One of BACKENDS
+
+    Returns:
+    A model callable as model(**inputs) returning an object with .logits
+    """
+    if backend == "fp32":
+        return model
+    if backend == "int8":
+        return quantize_int8(model)
+    if backend == "onnx":
+        return load_onnx(model, tokenizer, model_dir)
+    if backend == "early_exit":
+        from salida_temprana import load_early_exit
+        return load_early_exit(model, model_dir)
+    raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
@@ -0,0 +1,150 @@
+import threading, queue, time
+from concurrent.futures import Future
+import metrics
+
+
+class BatchScheduler:
+    """
+    In-process micro-batching queue for moderation requests.
+
+    Concurrent callers submit single messages; a background thread groups them
+    into batches of up to `max_batch_size` messages, waiting at most `max_wait_ms`
+    after the first message arrives, and runs them through `predict_fn` in a
+    single padded forward pass. Each caller gets back its own result. With
+    concurrency > 1, several collector threads fill and run batches in parallel.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=10, concurrency=1):
+        """
+        Parameters:
+        predict_fn (callable): Takes a list of messages and returns one result per message, in order
+        max_batch_size (int): Maximum number of messages per forward pass
+        max_wait_ms (float): Maximum time to wait for a batch to fill after its first message
+        concurrency (int): Number of batches that can be in flight at once (one collector
+            thread each), e.g. the number of inference worker processes
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.queue = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self._reset_stats()
+
+        self.concurrency = max(1, int(concurrency))
+        self.workers = []
+        for _ in range(self.concurrency):
+            worker = threading.Thread(target=self._run, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _reset_stats(self):
+        self.batches = 0
+        self.messages = 0
+        self.max_batch_seen = 0
+        self.batch_size_counts = {}
+        self.total_queue_wait = 0.0
+        self.total_batch_time = 0.0
+
+    def submit(self, text):
+        """
+        Queue a message for moderation.
+
+        Parameters:
+        text (str): Message to moderate
+
+        Returns:
+        Future: Resolves to this message's result from predict_fn
+        """
+        future = Future()
+        self.queue.put((text, future, time.perf_counter()))
+        return future
+
+    def moderate(self, text, timeout=None):
+        """
+        Moderate a message through the batching queue, blocking until its batch runs.
+
+        Returns:
+        This message's result from predict_fn
+        """
+        return self.submit(text).result(timeout=timeout)
+
+    def _collect_batch(self):
+        # Block until at least one message is available
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # Deadline reached: still take whatever is already queued
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _, _ in batch]
+            started = time.perf_counter()
+
+            try:
+                results = self.predict_fn(texts)
+                if len(results) != len(batch):
+                    raise RuntimeError(f"Expected {len(batch)} results, got {len(results)}")
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                metrics.errors.inc(where="batch_prediction")
+                metrics.log(f"Error in batch prediction: {str(e)}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            finished = time.perf_counter()
+            for _, _, enqueued in batch:
+                metrics.queue_wait_seconds.observe(started - enqueued)
+            metrics.batch_seconds.observe(finished - started)
+            metrics.batch_size.observe(len(batch))
+            with self.stats_lock:
+                size = len(batch)
+                self.batches += 1
+                self.messages += size
+                self.max_batch_seen = max(self.max_batch_seen, size)
+                self.batch_size_counts[size] = self.batch_size_counts.get(size, 0) + 1
+                self.total_queue_wait += sum(started - enqueued for _, _, enqueued in batch)
+                self.total_batch_time += finished - started
+
+    def stats(self, reset=False):
+        """
+        Queue depth and batch-size statistics, for tuning max_batch_size / max_wait_ms.
+
+        Parameters:
+        reset (bool): Clear the accumulated counters after reading them
+
+        Returns:
+        dict: Current queue depth and batch statistics
+        """
+        with self.stats_lock:
+            stats = {
+                "queue_depth": self.queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "concurrency": self.concurrency,
+                "batches": self.batches,
+                "messages": self.messages,
+                "avg_batch_size": self.messages / self.batches if self.batches else 0.0,
+                "max_batch_seen": self.max_batch_seen,
+                "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+                "avg_queue_wait_ms": 1000.0 * self.total_queue_wait / self.messages if self.messages else 0.0,
+                "avg_batch_time_ms": 1000.0 * self.total_batch_time / self.batches if self.batches else 0.0,
+            }
+            if reset:
+                self._reset_stats()
+        return stats
@@ -0,0 +1,305 @@
+"""
+Inference microbenchmarks of utils.py with a stored baseline and a regression gate.
+
+Replays a corpus built from the chat dumps (twitch_chat2.json) and the
+labeled categoria_*.json messages through:
+  - moderate_message: one message at a time (preprocessing included), per-message latency
+  - get_predictions:  batches of --batches messages of natural lengths (tokenization included)
+  - forward:          the model alone on batches padded to each of --longitudes tokens
+sweeping backend (--backends), torch intra-op threads (--threads), batch size
+and sequence length. Each case first makes --calentamiento untimed calls
+(allocator, oneDNN kernels and caches settle), then is timed --repeticiones
+times and reports the best round (the one least disturbed by the rest of the
+machine): its p50/p99 latency per call, and messages/s at that p50.
+
+By default the model is a tiny randomly initialised BERT with a WordPiece
+vocabulary trained on the corpus, so the suite runs offline in seconds
+without the Drive-hosted weights; its numbers only compare against runs of
+the same tiny model. --model-dir benchmarks the real fine-tuned model.
+
+Uso:
+  PYTHONPATH=.. python bench_inferencia.py correr [--salida resultado.json] [--backends fp32 int8] [--threads 1 4]
+                                                  [--batches 1 8 32] [--longitudes 16 64 128] [--model-dir DIR]
+  PYTHONPATH=.. python bench_inferencia.py comparar resultado.json [--baseline bench_baseline.json] [--tolerancia 0.25]
+
+comparar exits with status 1 when a case's p50 is slower than the baseline by
+more than the tolerance, and refuses (status 2) to compare runs of another
+model, corpus or CPU count than the baseline's. On shared or busy machines single cases can drift by
+up to ~30% between identical runs: rerun before trusting an isolated flag. The committed
+bench_baseline.json is a `correr` run of the tiny model with the default sweep
+on one reference machine; regenerate it there (correr --salida
+bench_baseline.json) when the reference machine or an intended performance
+change moves the numbers.
+"""
+import argparse, hashlib, json, os, platform, random, sys, tempfile, time
+import torch
+from transformers import BertConfig, BertTokenizerFast
+from utils import (WeightedLossModel, MODERATION_CATEGORIES, cargar_modelo, cargar_ejemplos_etiquetados,
+                   get_predictions, load_manifest, moderate_message, preprocesar_mensaje)
+from backends import BACKENDS, apply_backend
+
+BASELINE = os.path.join(os.path.dirname(__file__), "bench_baseline.json")
+
+# Runs that differ in these are not comparable: comparar refuses them
+CAMPOS_ESTRICTOS = ("modelo", "corpus", "cpus")
+
+# Tiny model: 2 layers of width 64, ~2k-token vocabulary
+TINY_VOCAB_SIZE = 2000
+TINY_CONFIG = dict(hidden_size=64, num_hidden_layers=2, num_attention_heads=2, intermediate_size=128,
+                   max_position_embeddings=130)
+
+
+def cargar_corpus(chat_path, semilla=0):
+    """
+    Replay corpus: the chat dump in arrival order followed by the labeled messages, preprocessed.
+    """
+    mensajes = []
+    if os.path.exists(chat_path):
+        with open(chat_path, 'r', encoding='utf-8') as f:
+            mensajes += [m["message"] for m in json.load(f) if m.get("message")]
+    try:
+        etiquetados = [mensaje for mensaje, _ in cargar_ejemplos_etiquetados()]
+    except FileNotFoundError:
+        etiquetados = []
+    random.Random(semilla).shuffle(etiquetados)
+    mensajes += etiquetados
+    mensajes = [texto for texto in (preprocesar_mensaje(m) for m in mensajes) if texto.strip()]
+    if not mensajes:
+        raise ValueError("Empty replay corpus: no chat dump or labeled messages found")
+    return mensajes
+
+
+def modelo_pequeno(corpus, semilla=0):
+    """
+    Tiny randomly initialised WeightedLossModel and a WordPiece tokenizer trained on the corpus.
+    """
+    from tokenizers import BertWordPieceTokenizer
+
+    wordpiece = BertWordPieceTokenizer(lowercase=True)
+    wordpiece.train_from_iterator(corpus, vocab_size=TINY_VOCAB_SIZE, min_frequency=1, show_progress=False)
+    tokenizer = BertTokenizerFast(tokenizer_object=wordpiece._tokenizer, unk_token="[UNK]", sep_token="[SEP]",
+                                  pad_token="[PAD]", cls_token="[CLS]", mask_token="[MASK]")
+    torch.manual_seed(semilla)
+    config = BertConfig(vocab_size=tokenizer.vocab_size, num_labels=len(MODERATION_CATEGORIES),
+                        problem_type="multi_label_classification", **TINY_CONFIG)
+    model = WeightedLossModel(config)
+    model.eval()
+    return model, tokenizer
+
+
+def preparar_backend(model, tokenizer, backend, model_dir, corpus):
+    """
+    The model under the requested backend. The tiny model has no model directory:
+    ONNX is exported to a temporary one and the early-exit heads are fitted on the spot.
+    """
+    if model_dir is not None:
+        return apply_backend(model, tokenizer, model_dir, backend)
+    if backend == "early_exit":
+        from salida_temprana import EarlyExitModel, ajustar_cabezas
+        heads = ajustar_cabezas(model, tokenizer, corpus[:512], capas=[1])
+        return EarlyExitModel(model, heads).eval()
+    return apply_backend(model, tokenizer, tempfile.mkdtemp(prefix="bench-inferencia-"), backend)
+
+
+def medir(llamada, unidades, min_segundos, min_llamadas, repeticiones, calentamiento):
+    """
+    Rounds of calls to `llamada(i)` for i = 0, 1, ..., each until both minimums are reached,
+    after `calentamiento` untimed calls.
+
+    Returns:
+    dict: p50/p99 milliseconds per call of the round with the lowest p50, and
+        messages/s at that p50 (`unidades` messages per call)
+    """
+    for i in range(calentamiento):
+        llamada(i)
+    mejor = None
+    for _ in range(repeticiones):
+        # Every round replays the same calls
+        tiempos = []
+        i = 0
+        inicio = time.perf_counter()
+        while len(tiempos) < min_llamadas or time.perf_counter() - inicio < min_segundos:
+            t0 = time.perf_counter()
+            llamada(i)
+            tiempos.append(time.perf_counter() - t0)
+            i += 1
+        tiempos.sort()
+        if mejor is None or tiempos[len(tiempos) // 2] < mejor[len(mejor) // 2]:
+            mejor = tiempos
+    p50 = mejor[len(mejor) // 2]
+    return {
+        "llamadas": len(mejor),
+        "mensajes_por_s": round(unidades / p50, 2),
+        "p50_ms": round(1000.0 * p50, 3),
+        "p99_ms": round(1000.0 * mejor[min(len(mejor) - 1, int(0.99 * len(mejor)))], 3)
+    }
+
+
+def casos(model, tokenizer, corpus, batches, longitudes, min_segundos, min_llamadas, repeticiones, calentamiento):
+    """
+    Run every case for one backend and thread count.
+    """
+    medidas = dict(min_segundos=min_segundos, min_llamadas=min_llamadas, repeticiones=repeticiones,
+                   calentamiento=calentamiento)
+
+    yield {"caso": "moderate_message", "batch": 1, "longitud": None}, medir(
+        lambda i: moderate_message(corpus[i % len(corpus)], model, tokenizer), 1, **medidas)
+
+    for batch in batches:
+        lotes = [corpus[i:i + batch] for i in range(0, len(corpus) - batch + 1, batch)] or [corpus[:batch]]
+        yield {"caso": "get_predictions", "batch": batch, "longitud": None}, medir(
+            lambda i: get_predictions(lotes[i % len(lotes)], model, tokenizer), batch, **medidas)
+
+    for longitud in longitudes:
+        for batch in batches:
+            inputs = tokenizer(corpus[:batch], return_tensors="pt", truncation=True, max_length=longitud,
+                               padding="max_length")
+
+            def forward(i):
+                with torch.no_grad():
+                    model(**inputs)
+
+            yield {"caso": "forward", "batch": batch, "longitud": longitud}, medir(forward, batch, **medidas)
+
+
+def identificar_modelo(model_dir):
+    """
+    The tiny model's configuration, or a fine-tuned model's directory name and a digest of its
+    SHA-256 manifest, so runs on other machines can tell whether they measured the same weights.
+    """
+    if model_dir is None:
+        return f"tiny {TINY_CONFIG}"
+    manifest = load_manifest(model_dir)
+    huella = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()[:16] if manifest else "no manifest"
+    return f"{os.path.basename(os.path.normpath(model_dir))} ({huella})"
+
+
+def entorno(args):
+    return {
+        "modelo": identificar_modelo(args.model_dir),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "procesador": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "corpus": os.path.basename(args.chat),
+        "calentamiento": args.calentamiento
+    }
+
+
+def correr(args):
+    corpus = cargar_corpus(args.chat)
+    if args.model_dir:
+        model, tokenizer = cargar_modelo(args.model_dir, verify=False)
+    else:
+        model, tokenizer = modelo_pequeno(corpus)
+    print(f"Corpus: {len(corpus)} mensajes; modelo: {args.model_dir or 'tiny (random init)'}")
+
+    resultados = []
+    for backend in args.backends:
+        try:
+            candidato = preparar_backend(model, tokenizer, backend, args.model_dir, corpus)
+        except Exception as e:
+            print(f"{backend}: skipped ({e})")
+            resultados.append({"backend": backend, "error": str(e)})
+            continue
+        for threads in args.threads:
+            torch.set_num_threads(threads)
+            if hasattr(candidato, "reset_session"):
+                candidato.reset_session(threads)
+            for clave, medida in casos(candidato, tokenizer, corpus, args.batches, args.longitudes,
+                                       args.min_segundos, args.min_llamadas, args.repeticiones,
+                                       args.calentamiento):
+                resultado = {"backend": backend, "threads": threads, **clave, **medida}
+                resultados.append(resultado)
+                print(f"{backend:10} {threads:2}t {clave['caso']:16} batch {clave['batch']:3} "
+                      f"long {clave['longitud'] or '-':>4}: {medida['mensajes_por_s']:10.1f} msg/s, "
+                      f"p50 {medida['p50_ms']:8.2f} ms, p99 {medida['p99_ms']:8.2f} ms")
+
+    reporte = {"entorno": entorno(args), "resultados": resultados}
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.salida}")
+    return reporte
+
+
+def clave_resultado(resultado):
+    return (resultado["backend"], resultado.get("threads"), resultado.get("caso"), resultado.get("batch"),
+            resultado.get("longitud"))
+
+
+def comparar(resultado, baseline, tolerancia):
+    """
+    Cases whose p50 latency is slower than the baseline's by more than `tolerancia` (relative).
+
+    Returns:
+    List[str]: One line per regression
+
+    Raises:
+    ValueError: When the runs differ in one of CAMPOS_ESTRICTOS
+    """
+    distintos = [f"{campo} {resultado['entorno'].get(campo)!r} vs {baseline['entorno'].get(campo)!r}"
+                 for campo in CAMPOS_ESTRICTOS if resultado["entorno"].get(campo) != baseline["entorno"].get(campo)]
+    if distintos:
+        raise ValueError("Not comparable with the baseline: " + "; ".join(distintos))
+    for campo in ("torch", "procesador", "calentamiento"):
+        if resultado["entorno"].get(campo) != baseline["entorno"].get(campo):
+            print(f"Warning: {campo} differs from the baseline "
+                  f"({resultado['entorno'].get(campo)} vs {baseline['entorno'].get(campo)})")
+
+    base = {clave_resultado(r): r for r in baseline["resultados"] if "error" not in r}
+    regresiones = []
+    comparados = 0
+    for actual in resultado["resultados"]:
+        referencia = base.get(clave_resultado(actual))
+        if referencia is None or "error" in actual:
+            continue
+        comparados += 1
+        nombre = "{} {}t {} batch {} long {}".format(*clave_resultado(actual))
+        cambio = actual["mensajes_por_s"] / referencia["mensajes_por_s"] - 1.0
+        latencia = actual["p50_ms"] / referencia["p50_ms"] - 1.0 if referencia["p50_ms"] else 0.0
+        marca = ""
+        if latencia > tolerancia:
+            marca = "  REGRESSION"
+            regresiones.append(f"{nombre}: p50 {latencia:+.1%}")
+        print(f"{nombre:45} throughput {cambio:+7.1%}  p50 {latencia:+7.1%}{marca}")
+    print(f"{comparados} cases compared, {len(regresiones)} regressions (tolerance {tolerancia:.0%})")
+    return regresiones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inference microbenchmarks with a regression gate")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    run = sub.add_parser("correr", help="Run the suite")
+    run.add_argument("--chat", default=os.path.join(os.path.dirname(__file__), '..', 'twitch_chat2.json'))
+    run.add_argument("--model-dir", default=None, help="Benchmark this fine-tuned model instead of the tiny one")
+    run.add_argument("--backends", nargs="+", default=["fp32", "int8"], choices=BACKENDS)
+    run.add_argument("--threads", nargs="+", type=int, default=[1])
+    run.add_argument("--batches", nargs="+", type=int, default=[1, 8, 32])
+    run.add_argument("--longitudes", nargs="+", type=int, default=[16, 64, 128])
+    run.add_argument("--min-segundos", type=float, default=0.3, help="Minimum timed seconds per round")
+    run.add_argument("--min-llamadas", type=int, default=20, help="Minimum timed calls per round")
+    run.add_argument("--repeticiones", type=int, default=5, help="Timed rounds per case (best is reported)")
+    run.add_argument("--calentamiento", type=int, default=10, help="Untimed calls before each case")
+    run.add_argument("--salida", default=None, help="Write the results as JSON to this file")
+
+    compare = sub.add_parser("comparar", help="Compare a results file against the baseline")
+    compare.add_argument("resultado")
+    compare.add_argument("--baseline", default=BASELINE)
+    compare.add_argument("--tolerancia", type=float, default=0.25, help="Relative slowdown flagged as a regression")
+
+    args = parser.parse_args()
+    if args.comando == "correr":
+        correr(args)
+    else:
+        with open(args.resultado, 'r', encoding='utf-8') as f:
+            resultado = json.load(f)
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        try:
+            regresiones = comparar(resultado, baseline, args.tolerancia)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(2)
+        sys.exit(1 if regresiones else 0)
@@ -0,0 +1,88 @@
+"""
+Benchmark of padded vs length-bucketed batches on a chat replay.
+
+Replays a chat dump (twitch_chat2.json or any Datos.py output) in arrival
+order, in batches of --batch messages, and reports tokens processed per
+second (tokenization + forward pass) for:
+  - antes:   every batch padded to its longest message
+  - despues: tokenize_buckets, each length bucket padded to its own maximum
+
+Uso: PYTHONPATH=.. python bench_tokenizacion.py [--chat ../twitch_chat2.json] [--batch 32] [--repeticiones 3]
+"""
+import argparse, json, os, time
+import torch
+from utils import cargar_modelo, predict_probabilities, preprocesar_mensaje, tokenize_buckets
+
+
+def cargar_chat(path, min_mensajes=0):
+    """
+    Messages of a chat dump in arrival order, cycled until there are at least min_mensajes.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        mensajes = [preprocesar_mensaje(m["message"]) for m in json.load(f) if m.get("message")]
+    if not mensajes:
+        raise ValueError(f"No messages found in {path}")
+    replay = list(mensajes)
+    while len(replay) < min_mensajes:
+        replay.extend(mensajes)
+    return replay
+
+
+def contar_tokens(lotes, tokenizer):
+    """
+    Real (non-padding) tokens and padded positions the model sees for each strategy.
+    """
+    reales = 0
+    antes = 0
+    despues = 0
+    for lote in lotes:
+        for _, inputs in tokenize_buckets(lote, tokenizer):
+            reales += int(inputs["attention_mask"].sum())
+            despues += inputs["input_ids"].numel()
+        antes += tokenizer(lote, truncation=True, max_length=128, padding=True, return_tensors="pt")["input_ids"].numel()
+    return reales, antes, despues
+
+
+def medir(lotes, model, tokenizer, bucketed, repeticiones):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for lote in lotes:
+            predict_probabilities(lote, model, tokenizer, bucketed=bucketed)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Padded vs length-bucketed batches on a chat replay")
+    parser.add_argument("--chat", default=os.path.join(os.path.dirname(__file__), '..', 'twitch_chat2.json'))
+    parser.add_argument("--model-dir", default="modelo_final_guardado")
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--min-mensajes", type=int, default=2048, help="Cycle the replay until it has this many messages")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Timed runs per strategy (best is reported)")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model, tokenizer = cargar_modelo(args.model_dir, verify=False)
+    mensajes = cargar_chat(args.chat, args.min_mensajes)
+    lotes = [mensajes[i:i + args.batch] for i in range(0, len(mensajes), args.batch)]
+
+    # Warm-up
+    for lote in lotes[:2]:
+        predict_probabilities(lote, model, tokenizer, bucketed=False)
+        predict_probabilities(lote, model, tokenizer, bucketed=True)
+
+    reales, posiciones_antes, posiciones_despues = contar_tokens(lotes, tokenizer)
+    t_antes = medir(lotes, model, tokenizer, False, args.repeticiones)
+    t_despues = medir(lotes, model, tokenizer, True, args.repeticiones)
+
+    print(f"Replay: {args.chat} ({len(mensajes)} mensajes, lotes de {args.batch}, {torch.get_num_threads()} threads)")
+    print(f"Tokens reales: {reales}")
+    print(f"antes:   {posiciones_antes} posiciones ({reales / posiciones_antes:.1%} útiles), "
+          f"{t_antes:.3f}s, {reales / t_antes:,.0f} tokens/s, {len(mensajes) / t_antes:,.0f} mensajes/s")
+    print(f"despues: {posiciones_despues} posiciones ({reales / posiciones_despues:.1%} útiles), "
+          f"{t_despues:.3f}s, {reales / t_despues:,.0f} tokens/s, {len(mensajes) / t_despues:,.0f} mensajes/s")
+    print(f"Aceleración: {t_antes / t_despues:.2f}x")
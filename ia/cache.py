@@ -0,0 +1,93 @@
+import threading, time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of moderation results, keyed on the preprocessed message.
+
+    Every lookup carries the version of the model/thresholds that would produce
+    the prediction; when it differs from the version the cached entries were
+    computed with, the whole cache is dropped.
+    """
+
+    def __init__(self, max_size=50000, ttl_seconds=None):
+        """
+        Parameters:
+        max_size (int): Maximum number of cached messages (least recently used are evicted first)
+        ttl_seconds (float): Optional lifetime of an entry, None to keep entries until evicted
+        """
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl_seconds) if ttl_seconds else None
+        self.entries = OrderedDict()  # key -> (stored_at, result)
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.version = version
+
+    def get(self, key, version):
+        """
+        Look up a cached result.
+
+        Parameters:
+        key (str): Preprocessed message
+        version: Current model/thresholds version
+
+        Returns:
+        The cached (approved, reasons) tuple, or None on a miss
+        """
+        with self.lock:
+            self._check_version(version)
+            entry = self.entries.get(key)
+            if entry is not None:
+                stored_at, result = entry
+                if self.ttl is None or time.monotonic() - stored_at <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, result):
+        """
+        Store a result computed with the given model/thresholds version.
+        """
+        with self.lock:
+            self._check_version(version)
+            self.entries[key] = (time.monotonic(), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns:
+        dict: Size, hit/miss counters and hit rate
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,398 @@
+"""
+Cheap first stage of the moderation cascade.
+
+Hashed character n-grams + one-vs-rest logistic regression (numpy only),
+trained from the labeled Clasificación Mati/categoria_*.json files and
+Platt-calibrated on a held-out split. It decides clear-cut messages in
+microseconds; messages whose calibrated probabilities fall inside the
+uncertainty band go on to the BERT model.
+
+It bans on a confident trained category, but only approves when that was
+checked on the held-out split: its approvals must agree with BERT's verdicts
+(or, without BERT, every banned category must have labeled examples, so none
+can slip through untrained). Otherwise every message it does not ban goes to
+BERT. The labeled set has no Garabato or Machismo examples, so without BERT
+as the judge the first stage never approves.
+
+Uso:
+  PYTHONPATH=.. python cascada.py entrenar [--salida modelo_final_guardado/cascada.npz] [--sin-bert]
+  PYTHONPATH=.. python cascada.py evaluar [--modelo modelo_final_guardado/cascada.npz] [--banda 0.05 0.95] [--sin-bert]
+"""
+import argparse, random, sys, threading, zlib
+import numpy as np
+from utils import MODERATION_CATEGORIES, NO_BANEABLE_INDEX, cargar_ejemplos_etiquetados, preprocesar_mensaje
+
+NGRAMAS = (2, 3, 4)
+N_FEATURES = 2 ** 18
+MAX_CARACTERES = 300  # Longer messages are truncated before hashing
+# Fraction of the held-out approvals the reference (BERT, or the labels) must also approve
+MIN_ACUERDO = 0.99
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-np.clip(x, -30, 30)))
+
+
+def hash_features(texto, n_features=N_FEATURES, ngramas=NGRAMAS):
+    """
+    Sparse L2-normalized bag of hashed character n-grams of a preprocessed message.
+
+    Returns:
+    tuple: (indices: int64 array, valores: float32 array)
+    """
+    texto = f" {texto[:MAX_CARACTERES]} "
+    cuentas = {}
+    for n in ngramas:
+        for i in range(len(texto) - n + 1):
+            h = zlib.crc32(texto[i:i + n].encode('utf-8')) % n_features  # Stable across processes
+            cuentas[h] = cuentas.get(h, 0) + 1
+    indices = np.fromiter(cuentas.keys(), dtype=np.int64, count=len(cuentas))
+    valores = np.fromiter(cuentas.values(), dtype=np.float32, count=len(cuentas))
+    norma = np.linalg.norm(valores)
+    return indices, (valores / norma if norma else valores)
+
+
+class ClasificadorRapido:
+    """
+    Linear model over hashed character n-grams with per-category Platt calibration.
+
+    Only categories that have labeled examples get a head (`entrenadas`). 'No
+    baneable' is never scored directly: a message is 'No baneable' when every
+    trained category is confidently negative, and only if `aprueba` (set by
+    validar_aprobacion) says such approvals agree with BERT; otherwise BERT
+    decides it.
+    """
+
+    def __init__(self, pesos, sesgos, platt_a, platt_b, entrenadas, banda=(0.05, 0.95), aprueba=False):
+        self.pesos = pesos          # [N_FEATURES, num_categories]
+        self.sesgos = sesgos        # [num_categories]
+        self.platt_a = platt_a      # [num_categories]
+        self.platt_b = platt_b      # [num_categories]
+        self.entrenadas = entrenadas  # bool [num_categories]
+        self.banda = banda
+        self.aprueba = aprueba      # Whether confident negatives may be approved without BERT
+        self.lock = threading.Lock()
+        self.decididos = 0
+        self.derivados = 0
+
+    @classmethod
+    def cargar(cls, path, banda=(0.05, 0.95)):
+        datos = np.load(path)
+        # Models saved before approvals were validated never approve
+        aprueba = bool(datos["aprueba"]) if "aprueba" in datos else False
+        return cls(datos["pesos"], datos["sesgos"], datos["platt_a"], datos["platt_b"],
+                   datos["entrenadas"].astype(bool), banda=banda, aprueba=aprueba)
+
+    def guardar(self, path):
+        np.savez_compressed(path, pesos=self.pesos, sesgos=self.sesgos, platt_a=self.platt_a,
+                            platt_b=self.platt_b, entrenadas=self.entrenadas, aprueba=self.aprueba)
+
+    def logits(self, texto):
+        indices, valores = hash_features(texto)
+        return valores @ self.pesos[indices] + self.sesgos
+
+    def probabilidades(self, texto):
+        """
+        Calibrated probability of every category for a preprocessed message.
+        """
+        return _sigmoid(self.platt_a * self.logits(texto) + self.platt_b)
+
+    def decidir(self, texto):
+        """
+        First-stage decision for a preprocessed message.
+
+        Returns:
+        tuple: (approved, reasons) when every trained category is outside the
+        uncertainty band (and, to approve, approvals are enabled), or None if
+        the message has to go to BERT
+        """
+        bajo, alto = self.banda
+        p = self.probabilidades(texto)[self.entrenadas]
+        if np.all((p <= bajo) | (p >= alto)):
+            positivas = np.flatnonzero(self.entrenadas)[p >= alto]
+            reasons = [MODERATION_CATEGORIES[int(i)] for i in positivas]
+            if reasons or self.aprueba:
+                with self.lock:
+                    self.decididos += 1
+                if reasons:
+                    return False, reasons
+                return True, ["No baneable"]
+        with self.lock:
+            self.derivados += 1
+        return None
+
+    def stats(self):
+        with self.lock:
+            total = self.decididos + self.derivados
+            return {
+                "banda": list(self.banda),
+                "aprueba": self.aprueba,
+                "decididos": self.decididos,
+                "derivados_a_bert": self.derivados,
+                "fraccion_decidida": self.decididos / total if total else 0.0,
+            }
+
+
+def _matriz(textos):
+    return [hash_features(texto) for texto in textos]
+
+
+def _logits_lote(filas, pesos, sesgos):
+    return np.stack([valores @ pesos[indices] for indices, valores in filas]) + sesgos
+
+
+def _platt(logits, y, pasos=500, lr=0.1):
+    """
+    Fit p = sigmoid(a * logit + b) on held-out data by gradient descent.
+    """
+    a, b = 1.0, 0.0
+    for _ in range(pasos):
+        err = _sigmoid(a * logits + b) - y
+        a -= lr * np.mean(err * logits)
+        b -= lr * np.mean(err)
+    return a, b
+
+
+def dividir(ejemplos, validacion=0.2, seed=0):
+    """
+    Shuffle the labeled examples and split off the held-out part, the same way
+    for training and for the evaluar command.
+
+    Returns:
+    tuple: (training examples, held-out examples)
+    """
+    ejemplos = list(ejemplos)
+    random.Random(seed).shuffle(ejemplos)
+    corte = int(len(ejemplos) * (1 - validacion))
+    return ejemplos[:corte], ejemplos[corte:]
+
+
+def matriz_etiquetas(ejemplos):
+    """[len(ejemplos), num_categories] 0/1 matrix of the categories of (mensaje, categorias) pairs"""
+    y = np.zeros((len(ejemplos), len(MODERATION_CATEGORIES)), dtype=np.float32)
+    for i, (_, categorias) in enumerate(ejemplos):
+        y[i, list(categorias)] = 1.0
+    return y
+
+
+def veredictos(textos, juez, lote=64):
+    """
+    Label preprocessed messages with the judge's verdicts, in the layout of matriz_etiquetas.
+
+    Parameters:
+    juez (callable): Takes a list of preprocessed messages and returns one
+        (approved, reasons) per message, e.g. BERT's get_predictions
+    """
+    indices = {categoria: i for i, categoria in MODERATION_CATEGORIES.items()}
+    y = np.zeros((len(textos), len(MODERATION_CATEGORIES)), dtype=np.float32)
+    for start in range(0, len(textos), lote):
+        for fila, (approved, reasons) in enumerate(juez(textos[start:start + lote]), start):
+            if approved:
+                y[fila, NO_BANEABLE_INDEX] = 1.0
+            else:
+                y[fila, [indices[r] for r in reasons if r in indices and r != 'No baneable']] = 1.0
+    return y
+
+
+def cargar_juez(model_dir="modelo_final_guardado"):
+    """
+    BERT as the reference of the first stage, or None if the model cannot be loaded.
+
+    Returns:
+    callable: get_predictions over preprocessed messages
+    """
+    from utils import cargar_modelo, get_predictions
+    try:
+        model, tokenizer = cargar_modelo(model_dir)
+    except Exception as e:
+        print(f"BERT no disponible ({e}): se usan solo las etiquetas")
+        return None
+    return lambda textos: get_predictions(textos, model, tokenizer)
+
+
+def _con_baneos(y, otras):
+    # Categories of y plus the banned ones of otras; 'No baneable' only where nothing else is set
+    y = np.maximum(y, otras)
+    baneado = np.delete(y, NO_BANEABLE_INDEX, axis=1).any(axis=1)
+    y[baneado, NO_BANEABLE_INDEX] = 0.0
+    return y
+
+
+def entrenar(ejemplos, epocas=20, lr=0.5, lote=64, validacion=0.2, seed=0, juez=None):
+    """
+    Train the first stage from (mensaje, categorias) pairs.
+
+    Parameters:
+    juez (callable): Optional reference classifier (see veredictos). Its verdicts are
+        added to the labels, so categories it finds get a head even without labeled
+        examples, and are the reference the held-out approvals are checked against
+
+    Returns:
+    tuple: (ClasificadorRapido with approvals off, held-out (textos, referencia) for
+    validar_aprobacion), where referencia are the judge's verdicts, or the labels
+    """
+    rng = random.Random(seed)
+    ejemplos_train, ejemplos_val = dividir(ejemplos, validacion, seed)
+    num_categorias = len(MODERATION_CATEGORIES)
+
+    textos_train = [preprocesar_mensaje(mensaje) for mensaje, _ in ejemplos_train]
+    textos_val = [preprocesar_mensaje(mensaje) for mensaje, _ in ejemplos_val]
+    y_train, y_val = matriz_etiquetas(ejemplos_train), matriz_etiquetas(ejemplos_val)
+    referencia = y_val
+    if juez is not None:
+        y_train = _con_baneos(y_train, veredictos(textos_train, juez))
+        referencia = veredictos(textos_val, juez)
+        y_val = _con_baneos(y_val, referencia)
+
+    filas_train, filas_val = _matriz(textos_train), _matriz(textos_val)
+
+    entrenadas = (y_train.sum(axis=0) + y_val.sum(axis=0)) > 0
+    entrenadas[NO_BANEABLE_INDEX] = False
+
+    # Rare categories get their positives up-weighted
+    positivos = y_train.sum(axis=0)
+    peso_positivo = np.where(positivos > 0, np.clip((len(y_train) - positivos) / np.maximum(positivos, 1), 1, 50), 1)
+
+    pesos = np.zeros((N_FEATURES, num_categorias), dtype=np.float32)
+    sesgos = np.zeros(num_categorias, dtype=np.float32)
+    orden = list(range(len(filas_train)))
+    for _ in range(epocas):
+        rng.shuffle(orden)
+        for start in range(0, len(orden), lote):
+            batch = orden[start:start + lote]
+            logits = _logits_lote([filas_train[i] for i in batch], pesos, sesgos)
+            objetivo = y_train[batch]
+            err = (_sigmoid(logits) - objetivo) * np.where(objetivo > 0, peso_positivo, 1.0)
+            err /= len(batch)
+            for fila, i in enumerate(batch):
+                indices, valores = filas_train[i]
+                pesos[indices] -= lr * np.outer(valores, err[fila])
+            sesgos -= lr * err.sum(axis=0)
+
+    platt_a = np.ones(num_categorias, dtype=np.float32)
+    platt_b = np.zeros(num_categorias, dtype=np.float32)
+    logits_val = _logits_lote(filas_val, pesos, sesgos) if filas_val else None
+    logits_train = _logits_lote(filas_train, pesos, sesgos)
+    for c in np.flatnonzero(entrenadas):
+        if logits_val is not None and 0 < y_val[:, c].sum() < len(y_val):
+            platt_a[c], platt_b[c] = _platt(logits_val[:, c], y_val[:, c])
+        else:
+            # Too few held-out positives: calibrate on the training split rather than
+            # keep the class-weighted (over-confident) raw scores
+            platt_a[c], platt_b[c] = _platt(logits_train[:, c], y_train[:, c])
+
+    modelo = ClasificadorRapido(pesos, sesgos, platt_a, platt_b, entrenadas)
+    return modelo, (textos_val, referencia)
+
+
+def sin_cabeza(modelo):
+    """Banned categories the first stage has no head for"""
+    return [MODERATION_CATEGORIES[i] for i in range(len(MODERATION_CATEGORIES))
+            if i != NO_BANEABLE_INDEX and not modelo.entrenadas[i]]
+
+
+def validar_aprobacion(modelo, textos, referencia, por_bert, min_acuerdo=MIN_ACUERDO):
+    """
+    Turn on the first stage's approvals only if they are safe on held-out messages: at
+    least `min_acuerdo` of them must be approved by the reference too. Labels cannot
+    vouch for categories without examples, so when the reference is not BERT every
+    banned category must also have a head.
+
+    Parameters:
+    por_bert (bool): Whether referencia are BERT's verdicts rather than the labels
+
+    Returns:
+    dict: evaluar() of the held-out messages with approvals on
+    """
+    modelo.aprueba = True
+    resultado = evaluar(modelo, textos, referencia)
+    modelo.aprueba = ((por_bert or not sin_cabeza(modelo)) and resultado["aprobados"] > 0
+                      and resultado["exactitud_aprobacion"] >= min_acuerdo)
+    return resultado
+
+
+def evaluar(modelo, textos, referencia):
+    """
+    Coverage and agreement of the first stage at its band on held-out messages.
+
+    A message is banned when the reference (BERT's verdicts or the labels) sets any
+    banned category, trained or not, and clean otherwise. exactitud_aprobacion is
+    the fraction of first-stage approvals the reference approves too, and a false
+    ban is a clean message the first stage bans; its rate is over all clean messages.
+    """
+    baneables = np.arange(len(MODERATION_CATEGORIES)) != NO_BANEABLE_INDEX
+    decididos = aprobados = aprobados_bien = baneados = baneados_bien = limpios = 0
+    for texto, fila in zip(textos, referencia):
+        baneado = bool(fila[baneables].any())
+        limpios += int(not baneado)
+        decision = modelo.decidir(texto)
+        if decision is None:
+            continue
+        decididos += 1
+        if decision[0]:
+            aprobados += 1
+            aprobados_bien += int(not baneado)
+        else:
+            baneados += 1
+            baneados_bien += int(baneado)
+    falsos_baneos = baneados - baneados_bien
+    return {
+        "mensajes": len(textos),
+        "decididos": decididos,
+        "cobertura": decididos / len(textos) if textos else 0.0,
+        "aprobados": aprobados,
+        "aprobados_baneables": aprobados - aprobados_bien,
+        "exactitud_aprobacion": aprobados_bien / aprobados if aprobados else 0.0,
+        "baneados": baneados,
+        "exactitud_baneo": baneados_bien / baneados if baneados else 0.0,
+        "limpios": limpios,
+        "falsos_baneos": falsos_baneos,
+        "tasa_falso_baneo": falsos_baneos / limpios if limpios else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="First stage of the moderation cascade")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_train = sub.add_parser("entrenar")
+    p_train.add_argument("--salida", default="modelo_final_guardado/cascada.npz")
+    p_train.add_argument("--epocas", type=int, default=20)
+    p_train.add_argument("--min-acuerdo", type=float, default=MIN_ACUERDO,
+                         help="Fraction of held-out approvals the reference must approve too")
+    p_eval = sub.add_parser("evaluar")
+    p_eval.add_argument("--modelo", default="modelo_final_guardado/cascada.npz")
+    for p in (p_train, p_eval):
+        p.add_argument("--banda", type=float, nargs=2, default=(0.05, 0.95), metavar=("BAJO", "ALTO"))
+        p.add_argument("--sin-bert", action="store_true", help="Use the labels as the reference instead of BERT")
+    args = parser.parse_args()
+
+    ejemplos = cargar_ejemplos_etiquetados()
+    juez = None if args.sin_bert else cargar_juez()
+    referencia_nombre = "BERT" if juez is not None else "las etiquetas"
+    if args.comando == "entrenar":
+        modelo, (textos_val, referencia) = entrenar(ejemplos, epocas=args.epocas, juez=juez)
+        modelo.banda = tuple(args.banda)
+        validacion = validar_aprobacion(modelo, textos_val, referencia, juez is not None, args.min_acuerdo)
+        print("Categorías entrenadas: " + ", ".join(MODERATION_CATEGORIES[int(i)] for i in np.flatnonzero(modelo.entrenadas)))
+        print(f"Validación contra {referencia_nombre}: {validacion}")
+        print(f"Aprobados baneables según {referencia_nombre}: {validacion['aprobados_baneables']}/{validacion['aprobados']}")
+        print(f"Falsos baneos en chat limpio: {validacion['falsos_baneos']}/{validacion['limpios']} "
+              f"({100 * validacion['tasa_falso_baneo']:.1f}%)")
+        if not modelo.aprueba:
+            # A first stage that cannot approve only adds latency in front of BERT
+            if juez is None and sin_cabeza(modelo):
+                motivo = f"sin ejemplos de {', '.join(sin_cabeza(modelo))}, solo BERT puede aprobar; entrena con BERT disponible"
+            else:
+                motivo = (f"sus aprobaciones coinciden con {referencia_nombre} en un "
+                          f"{100 * validacion['exactitud_aprobacion']:.1f}% (mínimo {100 * args.min_acuerdo:.1f}%)")
+            print(f"No se guarda el modelo: {motivo}")
+            sys.exit(1)
+        modelo.guardar(args.salida)
+        print(f"Modelo guardado en {args.salida} ({len(ejemplos)} mensajes etiquetados)")
+    else:
+        modelo = ClasificadorRapido.cargar(args.modelo, banda=tuple(args.banda))
+        # The held-out split of entrenar: the training messages would flatter the model
+        _, ejemplos_val = dividir(ejemplos)
+        textos = [preprocesar_mensaje(mensaje) for mensaje, _ in ejemplos_val]
+        referencia = veredictos(textos, juez) if juez is not None else matriz_etiquetas(ejemplos_val)
+        print(f"Validación contra {referencia_nombre}: {evaluar(modelo, textos, referencia)}")
@@ -1,6 +1,21 @@
-from app import app, model, tokenizer
-from utils import moderate_message
-from flask import Flask, jsonify, request
+from app import app, model, tokenizer, batcher, cache, cascade, pool
+from utils import moderate_messages_detailed
+from workers import WorkersUnavailable
+import metrics
+import os
+from flask import Flask, jsonify, request, Response
+import json, queue, threading, time
+
+def workers_unavailable(error):
+    """503 while no inference worker can run the model (they are being replaced)"""
+    metrics.errors.inc(where="workers_unavailable")
+    metrics.log(f"Inference workers unavailable: {str(error)}", sample_rate=metrics.LOG_SAMPLE_RATE)
+    response = jsonify({
+        "status": "error",
+        "error": str(error)
+    })
+    response.headers["Retry-After"] = "1"
+    return response, 503
 
 @app.route('/moderate', methods=['POST'])
 def moderate():
@@ -8,6 +23,7 @@ def moderate():
     Endpoint to moderate messages using a multi-label BERT model.
     Returns moderation status and list of reasons.
     """
+    started = time.perf_counter()
     try:
         # Get the message from request
         data = request.get_json()
@@ -20,25 +36,196 @@ def moderate():
         message = data['mensaje']
         
         # Get moderation result
-        approved, reasons = moderate_message(message, model, tokenizer)
+        result = batcher.moderate(message)
         
         # Create response
         response = {
             "status": "success",
-            "approved": approved,
-            "reasons": reasons,
+            "approved": result["approved"],
+            "reasons": result["reasons"],
+            "stage": result["stage"],
             "message": message
         }
         
-        print(f"Moderation result: {response}")
+        metrics.log(f"Moderation result: {response}", sample_rate=metrics.LOG_SAMPLE_RATE)
+        metrics.request_seconds.observe(time.perf_counter() - started, endpoint="moderate")
         return jsonify(response)
-        
+
+    except WorkersUnavailable as e:
+        return workers_unavailable(e)
+    except Exception as e:
+        metrics.errors.inc(where="moderate")
+        metrics.log(f"Error in moderation endpoint: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "error": str(e)
+        }), 500
+
+# Upper bound on messages accepted by a single /moderate/batch call
+BATCH_MAX_MESSAGES = int(os.getenv("BATCH_MAX_MESSAGES", "1000"))
+
+@app.route('/moderate/batch', methods=['POST'])
+def moderate_batch():
+    """
+    Endpoint to moderate a list of messages in one request.
+    Messages are scored in chunks of the scheduler's max batch size (one forward
+    pass per chunk) and results are returned in the same order as the input.
+    """
+    started = time.perf_counter()
+    try:
+        data = request.get_json()
+        messages = data.get('mensajes') if data else None
+        if not isinstance(messages, list) or not all(isinstance(m, str) for m in messages):
+            return jsonify({
+                "error": "'mensajes' must be a list of strings",
+                "status": "error"
+            }), 400
+
+        if len(messages) > BATCH_MAX_MESSAGES:
+            return jsonify({
+                "error": f"Too many messages, the limit is {BATCH_MAX_MESSAGES}",
+                "status": "error"
+            }), 413
+
+        results = []
+        chunk_size = batcher.max_batch_size
+        for start in range(0, len(messages), chunk_size):
+            chunk = messages[start:start + chunk_size]
+            for message, result in zip(chunk, moderate_messages_detailed(
+                    chunk, model, tokenizer, cache=cache, cascade=cascade,
+                    predictor=pool.run if pool is not None else None)):
+                result["message"] = message
+                results.append(result)
+
+        metrics.request_seconds.observe(time.perf_counter() - started, endpoint="batch")
+        return jsonify({
+            "status": "success",
+            "results": results
+        })
+
+    except WorkersUnavailable as e:
+        return workers_unavailable(e)
     except Exception as e:
-        print(f"Error in moderation endpoint: {str(e)}")
+        metrics.errors.inc(where="moderate_batch")
+        metrics.log(f"Error in batch moderation endpoint: {str(e)}")
         return jsonify({
             "status": "error",
             "error": str(e)
         }), 500
 
+# Seconds without results before a keep-alive frame is written to a stream
+STREAM_KEEPALIVE = 15
+
+def _stream_result_frame(frame_id, future):
+    try:
+        result = future.result()
+        frame = {"id": frame_id, "status": "success", **result}
+    except Exception as e:
+        frame = {"id": frame_id, "status": "error", "error": str(e)}
+    return json.dumps(frame, ensure_ascii=False) + "\n"
+
+@app.route('/moderate/stream', methods=['POST'])
+def moderate_stream():
+    """
+    Long-lived streaming endpoint. The request body is a pipelined NDJSON stream of
+    {"id": ..., "mensaje": ...} frames (sent with chunked transfer encoding); results are
+    streamed back as NDJSON frames keyed by id, in completion order, through the same
+    batching queue as /moderate. The stream ends once the client closes its side and
+    every pending result has been sent.
+
+    Needs a server that reads the request body while the response is being written
+    (full-duplex chunked I/O), e.g. Flask's development server. mod_wsgi does not
+    guarantee that and is not supported: server_app_ia.sh leaves out
+    --chunked-request, so mod_wsgi refuses the stream (411) and the front falls
+    back to /moderate/batch (see front/stream_client.py).
+    """
+    input_stream = request.stream
+    results = queue.Queue()
+    done = object()
+
+    def read_frames():
+        pending = 0
+        lock = threading.Lock()
+        finished_reading = threading.Event()
+
+        def on_done(future, frame_id, received):
+            nonlocal pending
+            metrics.request_seconds.observe(time.perf_counter() - received, endpoint="stream")
+            results.put(_stream_result_frame(frame_id, future))
+            with lock:
+                pending -= 1
+                last = finished_reading.is_set() and pending == 0
+            if last:
+                results.put(done)
+
+        try:
+            for line in input_stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    frame = json.loads(line)
+                    frame_id = frame["id"]
+                    message = frame["mensaje"]
+                except (ValueError, KeyError, TypeError) as e:
+                    results.put(json.dumps({"id": None, "status": "error", "error": f"Invalid frame: {str(e)}"}) + "\n")
+                    continue
+                with lock:
+                    pending += 1
+                received = time.perf_counter()
+                batcher.submit(message).add_done_callback(
+                    lambda f, frame_id=frame_id, received=received: on_done(f, frame_id, received))
+        except Exception as e:
+            metrics.errors.inc(where="moderate_stream")
+            metrics.log(f"Error reading moderation stream: {str(e)}")
+        finally:
+            with lock:
+                finished_reading.set()
+                last = pending == 0
+            if last:
+                results.put(done)
+
+    def generate():
+        # First frame flushes the response headers so the client can start reading
+        yield json.dumps({"type": "ready"}) + "\n"
+        threading.Thread(target=read_frames, daemon=True).start()
+        while True:
+            try:
+                item = results.get(timeout=STREAM_KEEPALIVE)
+            except queue.Empty:
+                yield json.dumps({"type": "keep-alive"}) + "\n"
+                continue
+            if item is done:
+                break
+            yield item
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/moderate/stats', methods=['GET'])
+def moderate_stats():
+    """
+    Queue depth and batch-size statistics of the batching scheduler, result
+    cache counters, first-stage coverage of the cascade, worker load and
+    backend statistics (e.g. average layers used with early exit).
+    Pass ?reset=1 to clear the batching counters after reading them.
+    """
+    reset = request.args.get('reset') in ('1', 'true')
+    return jsonify({
+        "status": "success",
+        "batching": batcher.stats(reset=reset),
+        "cache": cache.stats(),
+        "cascade": cascade.stats() if cascade is not None else None,
+        "workers": pool.stats() if pool is not None else None,
+        "model": model.stats() if hasattr(model, "stats") else None
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus metrics of this process: tokenization, forward-pass, queue-wait and
+    request latency histograms, and verdict counters per category and stage.
+    """
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == "__main__":
     app.run(port=7012, debug=True)
@@ -0,0 +1,21 @@
+"""
+Prometheus metrics of the moderation service (see comun/metricas.py).
+"""
+# The machinery is shared with the front: comun/ at the top of the checkout must be on
+# the Python path (--python-path in server_app_*.sh, pythonpath in pytest.ini, PYTHONPATH=.. for scripts)
+try:
+    from comun.metricas import (CONTENT_TYPE, LATENCY_BUCKETS, LOG_SAMPLE_RATE, Counter, Gauge, Histogram,
+                                log, render, take_delta, merge_delta, reset)
+except ImportError as e:
+    raise ImportError("The metrics need the top of the checkout on the Python path (e.g. PYTHONPATH=..)") from e
+
+tokenization_seconds = Histogram("ia_tokenization_seconds", "Seconds spent tokenizing a batch (or one length bucket of it)")
+forward_seconds = Histogram("ia_forward_seconds", "Seconds spent in one model forward pass")
+queue_wait_seconds = Histogram("ia_queue_wait_seconds", "Seconds a message waited in the batching queue before its batch started")
+batch_seconds = Histogram("ia_batch_seconds", "Seconds spent predicting one batch of the batching queue")
+batch_size = Histogram("ia_batch_size", "Messages per batch of the batching queue", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+request_seconds = Histogram("ia_request_seconds", "End-to-end seconds of a moderation request", labels=("endpoint",))
+verdicts = Counter("ia_verdicts_total", "Moderated messages per verdict category and deciding stage", labels=("category", "stage"))
+errors = Counter("ia_errors_total", "Errors per place they were raised", labels=("where",))
+early_exit_messages = Counter("ia_early_exit_messages_total", "Messages run through the early-exit model")
+early_exit_layers = Counter("ia_early_exit_layers_total", "Encoder layers those messages went through")
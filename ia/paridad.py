@@ -0,0 +1,101 @@
+"""
+Parity check between the fp32 model and a faster inference backend.
+
+Compares the per-category decisions (at the thresholds.json cutoffs) of both
+models on a sample of the labeled messages, so a backend can be switched on
+without silently changing moderation outcomes.
+
+Uso: PYTHONPATH=.. python paridad.py --backend int8 [--muestra 500] [--min-acuerdo 0.99]
+"""
+import argparse, random, sys, time
+import torch
+from utils import (cargar_modelo, cargar_ejemplos_etiquetados, predict_probabilities,
+                   preprocesar_mensaje, MODERATION_CATEGORIES, THRESHOLD_TENSOR, NO_BANEABLE_INDEX)
+from backends import apply_backend, BACKENDS
+
+
+def decisiones(textos, model, tokenizer, batch_size=32):
+    """
+    Per-category decisions of a model for a list of messages.
+
+    Returns:
+    tuple: ([n, num_categories] bool tensor, seconds spent in the model)
+    """
+    filas = []
+    inicio = time.perf_counter()
+    for start in range(0, len(textos), batch_size):
+        probabilities = predict_probabilities(textos[start:start + batch_size], model, tokenizer)
+        filas.append(probabilities >= THRESHOLD_TENSOR)
+    return torch.cat(filas), time.perf_counter() - inicio
+
+
+def verificar_paridad(reference, candidate, tokenizer, ejemplos, batch_size=32):
+    """
+    Compare the decisions of a candidate backend against the reference model.
+
+    Parameters:
+    reference: fp32 model
+    candidate: Model loaded with the backend under test
+    tokenizer: The loaded tokenizer
+    ejemplos (List[tuple]): (mensaje, categorias) pairs from cargar_ejemplos_etiquetados
+
+    Returns:
+    dict: Agreement overall and per category, approval flips, label accuracy and timings
+    """
+    textos = [preprocesar_mensaje(mensaje) for mensaje, _ in ejemplos]
+    etiquetas = torch.zeros(len(ejemplos), len(MODERATION_CATEGORIES), dtype=torch.bool)
+    for i, (_, categorias) in enumerate(ejemplos):
+        etiquetas[i, list(categorias)] = True
+
+    ref, ref_time = decisiones(textos, reference, tokenizer, batch_size)
+    cand, cand_time = decisiones(textos, candidate, tokenizer, batch_size)
+
+    def aprobados(d):
+        return ~torch.cat([d[:, :NO_BANEABLE_INDEX], d[:, NO_BANEABLE_INDEX + 1:]], dim=1).any(dim=1)
+
+    distintos = (ref != cand).any(dim=1)
+    return {
+        "mensajes": len(textos),
+        "acuerdo_total": 1.0 - distintos.float().mean().item(),
+        "acuerdo_por_categoria": {
+            MODERATION_CATEGORIES[i]: (ref[:, i] == cand[:, i]).float().mean().item()
+            for i in range(len(MODERATION_CATEGORIES))
+        },
+        "cambios_de_aprobacion": int((aprobados(ref) != aprobados(cand)).sum().item()),
+        "exactitud_etiquetas_fp32": (ref == etiquetas).all(dim=1).float().mean().item(),
+        "exactitud_etiquetas_backend": (cand == etiquetas).all(dim=1).float().mean().item(),
+        "ejemplos_distintos": [ejemplos[i][0] for i in distintos.nonzero().flatten().tolist()[:10]],
+        "segundos_fp32": ref_time,
+        "segundos_backend": cand_time,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parity check of an inference backend against fp32")
+    parser.add_argument("--backend", choices=[b for b in BACKENDS if b != "fp32"], required=True)
+    parser.add_argument("--model-dir", default="modelo_final_guardado")
+    parser.add_argument("--muestra", type=int, default=500, help="Number of labeled messages to compare (0 = all)")
+    parser.add_argument("--min-acuerdo", type=float, default=0.99, help="Minimum overall agreement to pass")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    ejemplos = cargar_ejemplos_etiquetados()
+    if args.muestra and args.muestra < len(ejemplos):
+        ejemplos = random.Random(args.seed).sample(ejemplos, args.muestra)
+
+    reference, tokenizer = cargar_modelo(args.model_dir)
+    candidate = apply_backend(reference, tokenizer, args.model_dir, args.backend)
+    resultado = verificar_paridad(reference, candidate, tokenizer, ejemplos)
+
+    print(f"Backend: {args.backend} ({resultado['mensajes']} mensajes)")
+    print(f"Acuerdo total con fp32: {resultado['acuerdo_total']:.4f}")
+    for categoria, acuerdo in resultado["acuerdo_por_categoria"].items():
+        print(f"  {categoria}: {acuerdo:.4f}")
+    print(f"Cambios de aprobación: {resultado['cambios_de_aprobacion']}")
+    print(f"Exactitud vs etiquetas: fp32 {resultado['exactitud_etiquetas_fp32']:.4f}, "
+          f"{args.backend} {resultado['exactitud_etiquetas_backend']:.4f}")
+    print(f"Tiempo: fp32 {resultado['segundos_fp32']:.2f}s, {args.backend} {resultado['segundos_backend']:.2f}s")
+    for mensaje in resultado["ejemplos_distintos"]:
+        print(f"  distinto: {mensaje}")
+
+    sys.exit(0 if resultado["acuerdo_total"] >= args.min_acuerdo else 1)
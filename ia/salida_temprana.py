@@ -0,0 +1,233 @@
+"""
+Early-exit inference for the fine-tuned BERT classifier.
+
+Lightweight linear heads read the [CLS] state of intermediate encoder layers;
+they are fitted (ridge regression) to reproduce the logits of the final
+classification head. At inference a message stops at the first exit layer
+whose prediction is confident for every category, i.e. every calibrated
+probability is at least `margen` away from its thresholds.json cutoff.
+
+Uso:
+  PYTHONPATH=.. python salida_temprana.py calibrar [--capas 2 4 6 8 10] [--margen 0.1] [--muestra 0]
+  PYTHONPATH=.. python salida_temprana.py evaluar [--margen 0.05 0.1 0.2]
+"""
+import argparse, os, random, time
+import torch
+from torch import nn
+from transformers.modeling_outputs import SequenceClassifierOutput
+import metrics
+import utils
+
+HEADS_FILENAME = "early_exit_heads.pt"
+
+
+def _layer_output(output):
+    # Encoder layers return a tuple in some transformers versions and a tensor in others
+    return output[0] if isinstance(output, tuple) else output
+
+
+class EarlyExitModel(nn.Module):
+    """
+    Wraps a loaded WeightedLossModel; exposes model(**inputs).logits like the
+    other backends, running each message only through the layers it needs.
+    """
+
+    def __init__(self, model, heads, margen=0.1):
+        """
+        Parameters:
+        model: The loaded fp32 WeightedLossModel
+        heads (dict): exit layer number (1-based) -> nn.Linear(hidden_size, num_categories)
+        margen (float): Minimum distance between every probability and its cutoff to exit
+        """
+        super().__init__()
+        self.model = model
+        self.heads = nn.ModuleDict({str(layer): head for layer, head in heads.items()})
+        self.exit_layers = sorted(heads)
+        self.margen = margen
+        self.config = model.config
+        self.name_or_path = getattr(model, "name_or_path", None)
+
+    def _confident(self, logits):
+        distance = (torch.sigmoid(logits) - utils.THRESHOLD_TENSOR).abs()
+        return (distance >= self.margen).all(dim=1)
+
+    def forward(self, input_ids, attention_mask=None, token_type_ids=None, **kwargs):
+        bert = self.model.bert
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        num_layers = len(bert.encoder.layer)
+
+        hidden = bert.embeddings(input_ids=input_ids, token_type_ids=token_type_ids)
+        mask = self.model.get_extended_attention_mask(attention_mask, input_ids.shape)
+        active = torch.arange(input_ids.shape[0])
+        logits = torch.empty((input_ids.shape[0], self.config.num_labels))
+        used = torch.full((input_ids.shape[0],), num_layers)
+
+        for index, layer in enumerate(bert.encoder.layer):
+            hidden = _layer_output(layer(hidden, attention_mask=mask))
+            depth = index + 1
+            if depth >= num_layers or str(depth) not in self.heads:
+                continue
+
+            head_logits = self.heads[str(depth)](hidden[:, 0])
+            confident = self._confident(head_logits)
+            if confident.any():
+                logits[active[confident]] = head_logits[confident]
+                used[active[confident]] = depth
+                keep = ~confident
+                hidden, mask, active = hidden[keep], mask[keep], active[keep]
+                if active.numel() == 0:
+                    break
+
+        if active.numel() > 0:
+            pooled = bert.pooler(hidden) if bert.pooler is not None else hidden[:, 0]
+            logits[active] = self.model.classifier(self.model.dropout(pooled))
+
+        # Counted in metrics, which forked workers send back to the parent process
+        metrics.early_exit_messages.inc(input_ids.shape[0])
+        metrics.early_exit_layers.inc(int(used.sum()))
+        self.last_layers_used = used
+        return SequenceClassifierOutput(logits=logits)
+
+    def stats(self):
+        messages = metrics.early_exit_messages.value()
+        return {
+            "exit_layers": self.exit_layers,
+            "margen": self.margen,
+            "messages": messages,
+            "avg_layers_used": metrics.early_exit_layers.value() / messages if messages else 0.0,
+        }
+
+
+def load_early_exit(model, model_dir):
+    """
+    Wrap a loaded model with the exit heads fitted by `python salida_temprana.py calibrar`.
+    """
+    path = os.path.join(model_dir, HEADS_FILENAME)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No {HEADS_FILENAME} in {model_dir}, run 'python salida_temprana.py calibrar' first")
+    saved = torch.load(path, map_location="cpu")
+    heads = {}
+    for layer, state in saved["heads"].items():
+        head = nn.Linear(state["weight"].shape[1], state["weight"].shape[0])
+        head.load_state_dict(state)
+        heads[int(layer)] = head
+    return EarlyExitModel(model, heads, margen=saved.get("margen", 0.1)).eval()
+
+
+def _cls_states(model, tokenizer, textos, capas, batch_size=32):
+    """
+    [CLS] hidden state at each requested layer and the final logits, for every message.
+    """
+    estados = {capa: [] for capa in capas}
+    finales = []
+    model.eval()
+    with torch.no_grad():
+        for start in range(0, len(textos), batch_size):
+            inputs = tokenizer(textos[start:start + batch_size], return_tensors="pt", truncation=True,
+                               max_length=128, padding=True)
+            outputs = model(**inputs, output_hidden_states=True)
+            for capa in capas:
+                estados[capa].append(outputs.hidden_states[capa][:, 0])
+            finales.append(outputs.logits)
+    return {capa: torch.cat(v) for capa, v in estados.items()}, torch.cat(finales)
+
+
+def ajustar_cabezas(model, tokenizer, textos, capas, ridge=1.0):
+    """
+    Fit one linear head per exit layer to the final head's logits (closed-form ridge regression).
+
+    Returns:
+    dict: layer -> nn.Linear
+    """
+    estados, objetivo = _cls_states(model, tokenizer, textos, capas)
+    heads = {}
+    for capa in capas:
+        x = estados[capa]
+        x = torch.cat([x, torch.ones(x.shape[0], 1)], dim=1)
+        a = x.T @ x + ridge * torch.eye(x.shape[1])
+        w = torch.linalg.solve(a, x.T @ objetivo)
+        head = nn.Linear(x.shape[1] - 1, objetivo.shape[1])
+        with torch.no_grad():
+            head.weight.copy_(w[:-1].T)
+            head.bias.copy_(w[-1])
+        heads[capa] = head
+    return heads
+
+
+def evaluar(model, early, tokenizer, textos, batch_size=32):
+    """
+    Average layers used, latency and agreement of early-exit decisions with the full model.
+    """
+    def decisiones(m):
+        filas = []
+        inicio = time.perf_counter()
+        capas = []
+        for start in range(0, len(textos), batch_size):
+            probabilities = utils.predict_probabilities(textos[start:start + batch_size], m, tokenizer, bucketed=False)
+            filas.append(probabilities >= utils.THRESHOLD_TENSOR)
+            if m is early:
+                capas.append(early.last_layers_used)
+        return torch.cat(filas), time.perf_counter() - inicio, (torch.cat(capas) if capas else None)
+
+    completo, t_completo, _ = decisiones(model)
+    temprano, t_temprano, capas = decisiones(early)
+
+    def aprobados(d):
+        i = utils.NO_BANEABLE_INDEX
+        return ~torch.cat([d[:, :i], d[:, i + 1:]], dim=1).any(dim=1)
+
+    return {
+        "mensajes": len(textos),
+        "capas_promedio": capas.float().mean().item(),
+        "capas_totales": len(model.bert.encoder.layer),
+        "acuerdo_categorias": (completo == temprano).all(dim=1).float().mean().item(),
+        "acuerdo_aprobacion": (aprobados(completo) == aprobados(temprano)).float().mean().item(),
+        "ms_por_mensaje_completo": 1000 * t_completo / len(textos),
+        "ms_por_mensaje_temprano": 1000 * t_temprano / len(textos),
+    }
+
+
+def _imprimir(resultado, margen):
+    print(f"margen {margen}: capas promedio {resultado['capas_promedio']:.2f}/{resultado['capas_totales']}, "
+          f"acuerdo categorías {resultado['acuerdo_categorias']:.4f}, "
+          f"acuerdo aprobación {resultado['acuerdo_aprobacion']:.4f}, "
+          f"{resultado['ms_por_mensaje_completo']:.2f} -> {resultado['ms_por_mensaje_temprano']:.2f} ms/mensaje")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Early-exit heads for the BERT classifier")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_cal = sub.add_parser("calibrar")
+    p_cal.add_argument("--capas", type=int, nargs="+", default=None, help="Exit layers (default: every second layer)")
+    p_cal.add_argument("--margen", type=float, default=0.1)
+    p_cal.add_argument("--ridge", type=float, default=1.0)
+    p_eval = sub.add_parser("evaluar")
+    p_eval.add_argument("--margen", type=float, nargs="+", default=[0.05, 0.1, 0.2])
+    for p in (p_cal, p_eval):
+        p.add_argument("--model-dir", default="modelo_final_guardado")
+        p.add_argument("--muestra", type=int, default=0, help="Number of labeled messages to use (0 = all)")
+        p.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model, tokenizer = utils.cargar_modelo(args.model_dir, verify=False)
+    textos = [utils.preprocesar_mensaje(mensaje) for mensaje, _ in utils.cargar_ejemplos_etiquetados()]
+    random.Random(args.seed).shuffle(textos)
+    if args.muestra:
+        textos = textos[:args.muestra]
+    corte = int(len(textos) * 0.8)
+    train, test = textos[:corte], textos[corte:]
+
+    if args.comando == "calibrar":
+        num_layers = len(model.bert.encoder.layer)
+        capas = args.capas or list(range(2, num_layers, 2))
+        heads = ajustar_cabezas(model, tokenizer, train, capas, ridge=args.ridge)
+        path = os.path.join(args.model_dir, HEADS_FILENAME)
+        torch.save({"heads": {capa: head.state_dict() for capa, head in heads.items()}, "margen": args.margen}, path)
+        print(f"Cabezas de salida en capas {capas} guardadas en {path} ({len(train)} mensajes)")
+        _imprimir(evaluar(model, EarlyExitModel(model, heads, args.margen).eval(), tokenizer, test), args.margen)
+    else:
+        early = load_early_exit(model, args.model_dir)
+        for margen in args.margen:
+            early.margen = margen
+            _imprimir(evaluar(model, early, tokenizer, test), margen)
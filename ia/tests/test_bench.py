@@ -0,0 +1,31 @@
+import pytest
+
+from bench_inferencia import comparar, medir
+
+ENTORNO = {"modelo": "tiny", "corpus": "twitch_chat2.json", "cpus": 4, "torch": "2", "procesador": "x86_64",
+           "calentamiento": 10}
+
+
+def reporte(p50_ms, **entorno):
+    return {"entorno": {**ENTORNO, **entorno},
+            "resultados": [{"backend": "fp32", "threads": 1, "caso": "forward", "batch": 8, "longitud": 16,
+                            "mensajes_por_s": 8000.0 / p50_ms, "p50_ms": p50_ms}]}
+
+
+def test_flags_slower_cases():
+    assert comparar(reporte(1.2), reporte(1.0), 0.25) == []
+    assert len(comparar(reporte(1.3), reporte(1.0), 0.25)) == 1
+
+
+@pytest.mark.parametrize("campo, valor", [("cpus", 1), ("modelo", "bert (0123456789abcdef)"), ("corpus", "otro.json")])
+def test_refuses_runs_that_are_not_comparable(campo, valor):
+    with pytest.raises(ValueError, match=campo):
+        comparar(reporte(1.0, **{campo: valor}), reporte(1.0), 0.25)
+
+
+def test_warm_up_calls_are_not_timed():
+    llamadas = []
+    medida = medir(llamadas.append, 1, min_segundos=0, min_llamadas=5, repeticiones=2, calentamiento=3)
+    # The warm-up replays the first calls, then every round replays them again
+    assert llamadas == [0, 1, 2] + [0, 1, 2, 3, 4] * 2
+    assert medida["llamadas"] == 5
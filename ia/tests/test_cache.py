@@ -0,0 +1,98 @@
+import pytest
+
+import cache
+from cache import PredictionCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+def test_hit_and_miss(clock):
+    predictions = PredictionCache()
+    assert predictions.get("hola", 1) is None
+    predictions.put("hola", 1, (True, []))
+    assert predictions.get("hola", 1) == (True, [])
+    stats = predictions.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_lru_eviction(clock):
+    predictions = PredictionCache(max_size=2)
+    predictions.put("a", 1, (True, []))
+    predictions.put("b", 1, (True, []))
+    predictions.get("a", 1)  # "b" is now the least recently used
+    predictions.put("c", 1, (False, ["Spam"]))
+    assert predictions.get("b", 1) is None
+    assert predictions.get("a", 1) == (True, [])
+    assert predictions.get("c", 1) == (False, ["Spam"])
+    assert predictions.stats()["evictions"] == 1
+    assert predictions.stats()["size"] == 2
+
+
+def test_ttl(clock):
+    predictions = PredictionCache(ttl_seconds=60)
+    predictions.put("hola", 1, (True, []))
+    clock.now += 60
+    assert predictions.get("hola", 1) == (True, [])
+    clock.now += 1
+    assert predictions.get("hola", 1) is None
+    assert predictions.stats()["size"] == 0
+
+
+def test_put_refreshes_ttl(clock):
+    predictions = PredictionCache(ttl_seconds=60)
+    predictions.put("hola", 1, (True, []))
+    clock.now += 50
+    predictions.put("hola", 1, (False, ["Insulto"]))
+    clock.now += 50
+    assert predictions.get("hola", 1) == (False, ["Insulto"])
+
+
+def test_no_ttl_keeps_entries(clock):
+    predictions = PredictionCache(ttl_seconds=None)
+    predictions.put("hola", 1, (True, []))
+    clock.now += 10 ** 6
+    assert predictions.get("hola", 1) == (True, [])
+
+
+def test_version_change_drops_the_cache(clock):
+    predictions = PredictionCache()
+    predictions.put("a", ("modelo", 1), (True, []))
+    predictions.put("b", ("modelo", 1), (True, []))
+    assert predictions.get("a", ("modelo", 2)) is None
+    assert predictions.stats()["size"] == 0
+    assert predictions.stats()["invalidations"] == 1
+
+    # Entries stored under the new version are kept, and going back does not revive the old ones
+    predictions.put("a", ("modelo", 2), (False, ["Spam"]))
+    assert predictions.get("a", ("modelo", 2)) == (False, ["Spam"])
+    assert predictions.get("b", ("modelo", 1)) is None
+    assert predictions.stats()["invalidations"] == 2
+
+
+def test_put_under_a_new_version(clock):
+    predictions = PredictionCache()
+    predictions.put("a", 1, (True, []))
+    predictions.put("b", 2, (True, []))
+    assert predictions.get("b", 2) == (True, [])
+    assert predictions.get("a", 2) is None
+
+
+def test_clear_and_minimum_size(clock):
+    predictions = PredictionCache(max_size=0)
+    assert predictions.max_size == 1
+    predictions.put("a", 1, (True, []))
+    predictions.clear()
+    assert predictions.get("a", 1) is None
@@ -0,0 +1,82 @@
+import numpy as np
+
+import cascada
+from cascada import ClasificadorRapido, entrenar, evaluar, validar_aprobacion
+from utils import MODERATION_CATEGORIES, NO_BANEABLE_INDEX
+
+CATEGORIAS = len(MODERATION_CATEGORIES)
+INSULTO = 5
+
+
+def clasificador(sesgos, entrenadas, aprueba):
+    """A first stage whose calibrated probabilities are sigmoid(sesgos) for every message"""
+    mascara = np.zeros(CATEGORIAS, dtype=bool)
+    mascara[list(entrenadas)] = True
+    return ClasificadorRapido(np.zeros((cascada.N_FEATURES, CATEGORIAS), dtype=np.float32),
+                              np.asarray(sesgos, dtype=np.float32), np.ones(CATEGORIAS, dtype=np.float32),
+                              np.zeros(CATEGORIAS, dtype=np.float32), mascara, aprueba=aprueba)
+
+
+def fila(*categorias):
+    y = np.zeros(CATEGORIAS, dtype=np.float32)
+    y[list(categorias)] = 1.0
+    return y
+
+
+def test_decidir():
+    negativos = [-10.0] * CATEGORIAS
+    assert clasificador(negativos, [1, INSULTO], aprueba=True).decidir("hola") == (True, ["No baneable"])
+    # Approvals off: confident negatives still go to BERT
+    assert clasificador(negativos, [1, INSULTO], aprueba=False).decidir("hola") is None
+
+    insulto = list(negativos)
+    insulto[INSULTO] = 10.0
+    assert clasificador(insulto, [1, INSULTO], aprueba=False).decidir("tonto") == (False, ["Insulto"])
+
+    dudoso = list(negativos)
+    dudoso[1] = 0.0
+    assert clasificador(dudoso, [1, INSULTO], aprueba=True).decidir("hola") is None
+
+
+def test_evaluar_counts_untrained_categories():
+    modelo = clasificador([-10.0] * CATEGORIAS, [1], aprueba=True)
+    # The second message is a Garabato: approving it is wrong even though Garabato has no head
+    resultado = evaluar(modelo, ["hola", "garabato"], [fila(NO_BANEABLE_INDEX), fila(0)])
+    assert resultado["aprobados"] == 2
+    assert resultado["aprobados_baneables"] == 1
+    assert resultado["exactitud_aprobacion"] == 0.5
+
+
+def test_validar_aprobacion():
+    modelo = clasificador([-10.0] * CATEGORIAS, range(NO_BANEABLE_INDEX), aprueba=False)
+    limpios = [fila(NO_BANEABLE_INDEX)] * 10
+    validar_aprobacion(modelo, ["hola"] * 10, limpios, por_bert=False)
+    assert modelo.aprueba
+
+    # One approval in ten that the reference bans is below the 99% agreement
+    validar_aprobacion(modelo, ["hola"] * 10, limpios[:9] + [fila(INSULTO)], por_bert=True)
+    assert not modelo.aprueba
+
+    # Labels cannot vouch for categories without a head
+    modelo = clasificador([-10.0] * CATEGORIAS, [1, INSULTO], aprueba=False)
+    validar_aprobacion(modelo, ["hola"] * 10, limpios, por_bert=False)
+    assert not modelo.aprueba
+    validar_aprobacion(modelo, ["hola"] * 10, limpios, por_bert=True)
+    assert modelo.aprueba
+
+
+def test_entrenar_with_a_judge():
+    ejemplos = [(f"hola chat {i}", {NO_BANEABLE_INDEX}) for i in range(60)]
+    ejemplos += [(f"eres tonto {i}", {NO_BANEABLE_INDEX}) for i in range(30)]  # Mislabeled as clean
+
+    def juez(textos):
+        return [(False, ["Insulto"]) if "tonto" in texto else (True, ["No baneable"]) for texto in textos]
+
+    modelo, (textos, referencia) = entrenar(ejemplos, epocas=5, juez=juez)
+    # The judge's verdicts give Insulto a head, and are the held-out reference
+    assert modelo.entrenadas[INSULTO] and not modelo.entrenadas[0]
+    assert not modelo.aprueba
+    assert all(bool(r[INSULTO]) == ("tonto" in t) for t, r in zip(textos, referencia))
+
+    sin_juez, _ = entrenar(ejemplos, epocas=1)
+    assert not sin_juez.entrenadas.any()
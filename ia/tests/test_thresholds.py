@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+import torch
+
+import utils
+
+
+class Tokenizer:
+    """Encodes each text, the decimal index of a row of the model's logits, as that one token"""
+    pad_token_id = 0
+
+    def __call__(self, texts, return_tensors=None, **kwargs):
+        input_ids = [[int(text)] for text in texts]
+        if return_tensors == "pt":
+            return {"input_ids": torch.tensor(input_ids)}
+        return {"input_ids": input_ids}
+
+
+class Model:
+    """Returns a fixed row of logits per token"""
+
+    def __init__(self, logits):
+        self.logits = logits
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, **kwargs):
+        return SimpleNamespace(logits=self.logits[input_ids[:, 0]])
+
+
+def per_category_loop(probabilities, thresholds):
+    """The per-message, per-category evaluation the threshold tensor replaced"""
+    results = []
+    for row in probabilities:
+        predicted_indices = []
+        for i, prob in enumerate(row):
+            category = utils.MODERATION_CATEGORIES[i]
+            threshold = thresholds.get(category, 0.5)  # Default threshold if missing
+            if prob >= threshold:
+                predicted_indices.append(i)
+
+        reasons = [utils.MODERATION_CATEGORIES[i] for i in predicted_indices]
+
+        approved = all(reason == 'No baneable' for reason in reasons) if reasons else True
+
+        results.append((approved, reasons if reasons else ["No baneable"]))
+    return results
+
+
+def test_matches_the_per_category_loop(monkeypatch):
+    generator = torch.Generator().manual_seed(0)
+    categories = len(utils.MODERATION_CATEGORIES)
+    logits = torch.randn(256, categories, generator=generator) * 3
+    # A logit of 0 is a probability of exactly 0.5: right at the cutoff of the 0.5 categories
+    logits[torch.rand(256, categories, generator=generator) < 0.2] = 0.0
+    # Rows with only 'No baneable' firing, and with nothing firing
+    logits[:8] = -20.0
+    logits[:4, utils.NO_BANEABLE_INDEX] = 20.0
+
+    cutoffs = (0.5, 0.3, 0.7, 0.5, 0.45, 0.5, 0.9, 0.5, 0.2, 0.5)
+    thresholds = {utils.MODERATION_CATEGORIES[i]: cutoff for i, cutoff in enumerate(cutoffs)}
+    del thresholds['Otros']  # Missing categories default to 0.5
+    monkeypatch.setattr(utils, "THRESHOLDS", thresholds)
+    monkeypatch.setattr(utils, "THRESHOLD_TENSOR", utils.build_threshold_tensor(thresholds))
+
+    texts = [str(i) for i in range(len(logits))]
+    results = utils.get_predictions(texts, Model(logits), Tokenizer())
+    assert results == per_category_loop(torch.sigmoid(logits), thresholds)
+    assert results[0] == (True, ['No baneable'])
+    assert results[5] == (True, ['No baneable'])
+    assert any(not approved for approved, _ in results)
+
+
+def test_threshold_tensor_order_and_defaults():
+    tensor = utils.build_threshold_tensor({'Spam': 0.25, 'No baneable': 0.75})
+    assert tensor.dtype == torch.float32
+    assert tensor.tolist() == [0.5, 0.25] + [0.5] * 8 + [0.75]
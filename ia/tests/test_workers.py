@@ -0,0 +1,72 @@
+import os, time
+
+import pytest
+
+import metrics
+import utils
+from workers import WorkerPool, WorkersUnavailable
+
+threads = []  # Set in each worker by its initializer
+
+
+def predict(texts):
+    if "muere" in texts:
+        os._exit(1)
+    metrics.early_exit_messages.inc(len(texts))
+    return [(text != "malo", [] if text != "malo" else ["Insulto"], threads) for text in texts]
+
+
+@pytest.fixture
+def pool():
+    pools = []
+
+    def create(**kwargs):
+        pools.append(WorkerPool(predict, 2, initializer=threads.append, restart_delay=0, **kwargs))
+        return pools[-1]
+    yield create
+    for p in pools:
+        p.close()
+
+
+def test_workers_are_forked_on_the_first_batch(pool):
+    workers = pool(intra_op_threads=3)
+    assert workers.stats()["workers"] == [] and not workers.started
+    assert [approved for approved, _, _ in workers.run(["hola", "malo"])] == [True, False]
+    assert workers.started and len(workers.stats()["workers"]) == 2
+
+
+def test_initializer_gets_the_thread_count(pool):
+    workers = pool(intra_op_threads=3)
+    assert workers.run(["hola"])[0][2] == [3]
+
+
+def test_metrics_come_back_from_the_workers(pool):
+    workers = pool()
+    before = metrics.early_exit_messages.value()
+    workers.run(["a", "b", "c"])
+    assert metrics.early_exit_messages.value() == before + 3
+
+
+def test_dead_worker_is_replaced(pool):
+    workers = pool()
+    workers.run(["hola"])
+    with pytest.raises(WorkersUnavailable):
+        workers.run(["muere"])
+    deadline = time.monotonic() + 5
+    while workers.stats()["restarts"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stats = workers.stats()
+    assert stats["restarts"] == 1
+    assert all(worker["alive"] for worker in stats["workers"])
+    assert workers.run(["hola"])[0][0] is True
+
+
+def test_unavailable_workers_are_not_approved():
+    def predictor(texts):
+        raise WorkersUnavailable("No inference workers alive")
+
+    with pytest.raises(WorkersUnavailable):
+        utils.moderate_messages_detailed(["hola"], None, None, predictor=predictor)
+    # Other errors still approve
+    assert utils.moderate_messages_detailed(["hola"], None, None, predictor=lambda texts: 1 / 0) == [
+        {"approved": True, "reasons": ["No baneable"], "stage": utils.STAGE_ERROR}]
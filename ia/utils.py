@@ -2,7 +2,10 @@ from transformers import AutoTokenizer, AutoModelForSequenceClassification, Auto
 import torch
 import numpy as np
 from torch import nn
-import os, shutil, hashlib, re, json
+import os, shutil, hashlib, re, json, time
+from backends import apply_backend
+from workers import WorkersUnavailable
+import metrics
 
 # Define moderation categories and their labels (updated to match fine-tuned model)
 MODERATION_CATEGORIES = {
@@ -39,6 +42,33 @@ def load_thresholds(threshold_file):
 
 THRESHOLDS = load_thresholds("modelo_final_guardado/thresholds.json")
 
+NO_BANEABLE_INDEX = 10
+
+# Stage that decided a moderation result
+STAGE_RAPIDO = "rapido"  # Cheap first stage of the cascade
+STAGE_BERT = "bert"
+STAGE_ERROR = "error"    # Fallback approval after an error
+
+def build_threshold_tensor(thresholds):
+    """
+    Build a [num_categories] tensor of per-category cutoffs, in MODERATION_CATEGORIES order,
+    so a whole [batch, num_categories] probability matrix can be compared in one operation.
+    """
+    return torch.tensor(
+        [thresholds.get(MODERATION_CATEGORIES[i], 0.5) for i in range(len(MODERATION_CATEGORIES))],  # Default threshold if missing
+        dtype=torch.float32
+    )
+
+THRESHOLD_TENSOR = build_threshold_tensor(THRESHOLDS)
+
+def prediction_version(model, cascade=None):
+    """
+    Identify the model, thresholds and first stage a prediction was made with.
+    Cached results computed under a different version are discarded.
+    """
+    cascade_version = (id(cascade), tuple(cascade.banda)) if cascade is not None else None
+    return (id(model), getattr(model, 'name_or_path', None), tuple(sorted(THRESHOLDS.items())), cascade_version)
+
 class WeightedLossModel(BertForSequenceClassification):
     def _init_(self, config, class_weights=None):
         super()._init_(config)
@@ -53,10 +83,91 @@ def get_file_hash(filepath):
     """Calculate SHA256 hash of a file"""
     sha256_hash = hashlib.sha256()
     with open(filepath, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
+        for byte_block in iter(lambda: f.read(1024 * 1024), b""):
             sha256_hash.update(byte_block)
     return sha256_hash.hexdigest()
 
+MANIFEST_FILENAME = "manifest.json"
+# Files derived locally from the downloaded ones, not part of the manifest
+DERIVED_FILES = {MANIFEST_FILENAME, "model.onnx"}
+
+def load_manifest(model_dir):
+    """
+    Load the SHA-256 manifest of a model directory.
+
+    Returns:
+    dict: filename -> sha256 hex digest (empty if there is no readable manifest)
+    """
+    manifest_path = os.path.join(model_dir, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(model_dir):
+    """
+    Hash every model file in model_dir and store the result as its manifest.
+    """
+    manifest = {
+        filename: get_file_hash(os.path.join(model_dir, filename))
+        for filename in sorted(os.listdir(model_dir))
+        if filename not in DERIVED_FILES and os.path.isfile(os.path.join(model_dir, filename))
+    }
+    tmp_path = os.path.join(model_dir, MANIFEST_FILENAME + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(model_dir, MANIFEST_FILENAME))
+    return manifest
+
+def check_safetensors_header(filepath):
+    """
+    Cheap structural check of a .safetensors file: parse its JSON header and
+    make sure the file is as long as the tensors it declares (catches truncated
+    downloads without deserializing any tensor).
+    """
+    with open(filepath, 'rb') as f:
+        header_size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_size))
+    data_size = max((entry['data_offsets'][1] for name, entry in header.items() if name != '__metadata__'), default=0)
+    if os.path.getsize(filepath) != 8 + header_size + data_size:
+        raise ValueError(f"{filepath} is truncated or has trailing data")
+
+def check_model_file(filepath, expected_hash=None):
+    """
+    Validate a model file against its manifest hash, or structurally when there is no hash.
+
+    Returns:
+    bool: True if the file is valid
+    """
+    try:
+        if expected_hash:
+            return get_file_hash(filepath) == expected_hash
+        if filepath.endswith('.safetensors'):
+            check_safetensors_header(filepath)
+        elif filepath.endswith('.json'):
+            with open(filepath, 'r', encoding='utf-8') as f:
+                json.load(f)
+        return True
+    except Exception as e:
+        print(f"{filepath} failed validation: {str(e)}")
+        return False
+
+def verify_manifest(model_dir):
+    """
+    Compare the files of model_dir against its manifest.
+
+    Returns:
+    List[str]: Files that are missing or whose hash does not match (empty if all valid
+    or if there is no manifest to check against)
+    """
+    manifest = load_manifest(model_dir)
+    return [
+        filename for filename, expected_hash in manifest.items()
+        if not os.path.exists(os.path.join(model_dir, filename))
+        or not check_model_file(os.path.join(model_dir, filename), expected_hash)
+    ]
+
 import gdown
 
 def gdown_download(file_id, destination):
@@ -77,10 +188,10 @@ def download_model_files(model_dir):
     Download all model files from a public Google Drive folder and validate them.
 
     Relies on the environment variable MODEL_FOLDER_ID and uses gdown to download the entire folder.
-    Validates JSON and safetensors files. Skips re-downloading valid files.
+    Files are checked against the SHA-256 manifest (the one shipped in the folder, or the local
+    one), falling back to a structural check of JSON and safetensors headers. Skips replacing
+    valid files and writes the manifest of the resulting directory.
     """
-    from safetensors.torch import load_file  # For safetensors validation
-
     folder_id = os.getenv("MODEL_FOLDER_ID")
     if not folder_id:
         raise ValueError("MODEL_FOLDER_ID environment variable is not set.")
@@ -97,89 +208,88 @@ def download_model_files(model_dir):
     # Download all files in the folder
     gdown.download_folder(url=url, output=temp_dir, quiet=False, use_cookies=False)
 
+    # Prefer the manifest published with the model, then the one we already had
+    expected = load_manifest(temp_dir) or load_manifest(model_dir)
+
     # Validate and move each file individually
     for filename in os.listdir(temp_dir):
+        if filename in DERIVED_FILES:
+            continue
         temp_file_path = os.path.join(temp_dir, filename)
         target_file_path = os.path.join(model_dir, filename)
 
         # If already exists and valid, skip
         if os.path.exists(target_file_path):
-            try:
-                if filename.endswith('.safetensors'):
-                    load_file(target_file_path)
-                elif filename.endswith('.json'):
-                    with open(target_file_path, 'r', encoding='utf-8') as f:
-                        json.load(f)
+            if check_model_file(target_file_path, expected.get(filename)):
                 print(f"{filename} exists and is valid, skipping download")
                 continue
-            except Exception as e:
-                print(f"{filename} exists but is corrupted, will replace: {str(e)}")
-                os.remove(target_file_path)
+            print(f"{filename} exists but is corrupted, will replace")
+            os.remove(target_file_path)
 
-        # Validate the downloaded file
-        try:
-            if filename.endswith('.safetensors'):
-                load_file(temp_file_path)
-            elif filename.endswith('.json'):
-                with open(temp_file_path, 'r', encoding='utf-8') as f:
-                    json.load(f)
-            
-            # Move the file if valid
+        # Validate the downloaded file, move it if valid
+        if check_model_file(temp_file_path, expected.get(filename)):
             shutil.move(temp_file_path, target_file_path)
             print(f"Successfully downloaded and verified {filename}")
-        except Exception as e:
-            print(f"Downloaded {filename} is corrupted: {str(e)}")
+        else:
+            print(f"Downloaded {filename} is corrupted")
             os.remove(temp_file_path)
 
     # Cleanup temp directory
     if os.path.exists(temp_dir):
         shutil.rmtree(temp_dir)
 
-def cargar_modelo(model_dir="modelo_final_guardado"):
+    write_manifest(model_dir)
+
+def cargar_modelo(model_dir="modelo_final_guardado", backend="fp32", verify=True):
     """
     Load the fine-tuned Tulio BERT model and tokenizer for moderation
+
+    The weights are read once: the model is built straight from the memory-mapped
+    model.safetensors, without materializing a randomly initialized copy first.
     
     Parameters:
     model_dir (str): Directory where model files are/will be stored
-    model_name (str): Name of the base model to use
+    backend (str): Inference backend: 'fp32' (eager PyTorch), 'int8' (dynamic
+        INT8-quantized PyTorch), 'onnx' (ONNX Runtime session exported to model_dir)
+        or 'early_exit' (fp32 with the exit heads fitted by salida_temprana.py)
+    verify (bool): Check the model files against their SHA-256 manifest before loading
     """
+    timings = {}
+    phase_start = time.perf_counter()
+
+    def end_phase(name):
+        nonlocal phase_start
+        now = time.perf_counter()
+        timings[name] = now - phase_start
+        phase_start = now
+
     try:
         # Download model files if they don't exist or are corrupted
         if not os.path.exists(model_dir) or not os.listdir(model_dir):
             print(f"Model files not found in {model_dir}, downloading...")
             download_model_files(model_dir)
-        
-        # Load base model and tokenizer
-        print("Loading base model and tokenizer...")
-        base_model = AutoModel.from_pretrained(model_dir)
-        tokenizer = AutoTokenizer.from_pretrained(model_dir)
-        
-        # Create classification head with 11 classes
-        print("Creating classification head...")
-        model = WeightedLossModel.from_pretrained(model_dir)
-        
-        # Load fine-tuned weights
-        print(f"Loading fine-tuned weights from {model_dir}...")
+        end_phase("download")
+
+        if verify:
+            corrupted = verify_manifest(model_dir)
+            if corrupted:
+                print(f"Model files do not match the manifest ({', '.join(corrupted)}), downloading...")
+                download_model_files(model_dir)
+        end_phase("verify")
+
         model_file = os.path.join(model_dir, 'model.safetensors')
         if not os.path.exists(model_file):
             raise FileNotFoundError(f"No model.safetensors file found in {model_dir}")
-        
+
+        print("Loading tokenizer...")
+        tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        end_phase("tokenizer")
+
+        # Single pass over the weights: safetensors is memory-mapped and its tensors
+        # are assigned directly to the model (no random init, no second state dict)
+        print(f"Loading fine-tuned weights from {model_file}...")
         try:
-            from safetensors.torch import load_file
-            state_dict = load_file(model_file)
-            # Handle both WeightedLossModel and BertForSequenceClassification state dicts
-            if 'bert' in state_dict:
-                model.load_state_dict(state_dict)
-            else:
-                # If it's a BertForSequenceClassification state dict, we need to adapt it
-                adapted_state_dict = {}
-                for k, v in state_dict.items():
-                    if k.startswith('bert.'):
-                        adapted_state_dict[k] = v
-                    elif k.startswith('classifier.'):
-                        adapted_state_dict[k] = v
-                model.load_state_dict(adapted_state_dict, strict=False)
-            print(f"Successfully loaded weights from {model_file}")
+            model = WeightedLossModel.from_pretrained(model_dir, low_cpu_mem_usage=True)
         except Exception as e:
             print(f"Error loading model weights: {str(e)}")
             print("Attempting to redownload model files...")
@@ -188,6 +298,15 @@ def cargar_modelo(model_dir="modelo_final_guardado"):
         
         # Set model to evaluation mode
         model.eval()
+        end_phase("weights")
+
+        if backend != "fp32":
+            print(f"Preparing '{backend}' inference backend...")
+            model = apply_backend(model, tokenizer, model_dir, backend)
+        end_phase("backend")
+
+        total = sum(timings.values())
+        print("Model startup timings: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()) + f", total {total:.2f}s")
         return model, tokenizer
         
     except Exception as e:
@@ -196,54 +315,153 @@ def cargar_modelo(model_dir="modelo_final_guardado"):
 
 import torch
 
-def get_prediction(text, model, tokenizer):
+# Upper bounds (in tokens) of the length buckets used by tokenize_buckets
+BUCKET_BOUNDARIES = (8, 16, 32, 64, 128)
+
+def tokenize_buckets(texts, tokenizer, max_length=128, boundaries=BUCKET_BOUNDARIES, min_bucket_size=4):
     """
-    Get moderation prediction and reasons for a message (multi-label, per-category thresholds)
+    Tokenize a batch of messages with one fast batch-encoding call and group them by length,
+    padding each group only to the length of its own longest message.
 
     Parameters:
-    text (str): Message to moderate
-    model: The loaded multi-label classification model
-    tokenizer: The loaded tokenizer
+    texts (List[str]): Messages to tokenize
+    tokenizer: The loaded (fast) tokenizer
+    max_length (int): Truncation length
+    boundaries (tuple): Increasing token-length limits of the buckets
+    min_bucket_size (int): Buckets with fewer messages are merged into the next longer
+        bucket, so a couple of stragglers don't cost a forward pass of their own
 
     Returns:
-    tuple: (approved: bool, reasons: List[str])
+    List[tuple]: (indices: List[int], inputs: dict of tensors) per non-empty bucket, where
+    indices are the positions of the bucket's messages in `texts`
     """
-    # Prepare the input
-    inputs = tokenizer(
-        text,
-        return_tensors="pt",
+    encodings = tokenizer(
+        list(texts),
         truncation=True,
-        max_length=128,
-        padding=True,
+        max_length=max_length,
         add_special_tokens=True
     )
+    input_ids = encodings["input_ids"]
+    lengths = [len(ids) for ids in input_ids]
+
+    groups = {}
+    for i, length in enumerate(lengths):
+        bucket = next((b for b in boundaries if length <= b), boundaries[-1])
+        groups.setdefault(bucket, []).append(i)
+
+    pad_values = {name: 0 for name in encodings.keys()}
+    pad_values["input_ids"] = tokenizer.pad_token_id or 0
+    merged = []
+    pending = []
+    for bucket in sorted(groups):
+        pending.extend(groups[bucket])
+        if len(pending) >= min_bucket_size:
+            merged.append(pending)
+            pending = []
+    if pending:
+        if merged:
+            merged[-1].extend(pending)
+        else:
+            merged.append(pending)
+
+    buckets = []
+    for indices in merged:
+        width = max(lengths[i] for i in indices)
+        inputs = {
+            name: torch.tensor(
+                [values[i] + [pad_values[name]] * (width - lengths[i]) for i in indices],
+                dtype=torch.long
+            )
+            for name, values in encodings.items()
+        }
+        buckets.append((indices, inputs))
+    return buckets
+
+def predict_probabilities(texts, model, tokenizer, bucketed=True):
+    """
+    Run the model on a batch of (already preprocessed) messages
+
+    Parameters:
+    bucketed (bool): Split the batch into length buckets (one forward pass per bucket)
+        instead of padding every message to the longest one
 
+    Returns:
+    torch.Tensor: [batch, num_categories] sigmoid probabilities, in input order
+    """
     model.eval()
-    with torch.no_grad():
-        try:
+    if not bucketed:
+        # Prepare the input, padded to the longest message of the batch
+        with metrics.tokenization_seconds.time():
+            inputs = tokenizer(
+                list(texts),
+                return_tensors="pt",
+                truncation=True,
+                max_length=128,
+                padding=True,
+                add_special_tokens=True
+            )
+        with torch.no_grad(), metrics.forward_seconds.time():
             outputs = model(**inputs)
-            logits = outputs.logits
-            probabilities = torch.sigmoid(logits).squeeze()  # For multi-label
+            return torch.sigmoid(outputs.logits)  # For multi-label, shape [batch, 11]
 
-            predicted_indices = []
-            for i, prob in enumerate(probabilities):
-                category = MODERATION_CATEGORIES[i]
-                threshold = THRESHOLDS.get(category, 0.5)  # Default threshold if missing
-                if prob >= threshold:
-                    predicted_indices.append(i)
+    probabilities = torch.empty((len(texts), len(MODERATION_CATEGORIES)))
+    with metrics.tokenization_seconds.time():
+        buckets = tokenize_buckets(texts, tokenizer)
+    with torch.no_grad():
+        for indices, inputs in buckets:
+            with metrics.forward_seconds.time():
+                outputs = model(**inputs)
+            probabilities[indices] = torch.sigmoid(outputs.logits).float()
+    return probabilities
 
-            reasons = [MODERATION_CATEGORIES[i] for i in predicted_indices]
+def get_predictions(texts, model, tokenizer):
+    """
+    Get moderation predictions for a batch of messages in a single forward pass
 
-            approved = all(reason == 'No baneable' for reason in reasons) if reasons else True
+    Parameters:
+    texts (List[str]): Messages to moderate
+    model: The loaded multi-label classification model
+    tokenizer: The loaded tokenizer
 
-            return approved, reasons if reasons else ["No baneable"]
+    Returns:
+    List[tuple]: One (approved: bool, reasons: List[str]) per message, in input order
+    """
+    if not texts:
+        return []
 
-        except Exception as e:
-            print(f"Error in prediction: {str(e)}")
-            return True, ["No baneable"]  # Fallback
+    probabilities = predict_probabilities(texts, model, tokenizer)
+
+    # One vectorized comparison for the whole batch
+    decisions = probabilities >= THRESHOLD_TENSOR
+    # Approved unless a category other than 'No baneable' fires
+    banned = torch.cat([decisions[:, :NO_BANEABLE_INDEX], decisions[:, NO_BANEABLE_INDEX + 1:]], dim=1).any(dim=1)
+
+    results = []
+    for approved, row in zip((~banned).tolist(), decisions.tolist()):
+        reasons = [MODERATION_CATEGORIES[i] for i, hit in enumerate(row) if hit]
+        results.append((approved, reasons if reasons else ["No baneable"]))
+    return results
+
+def get_prediction(text, model, tokenizer):
+    """
+    Get moderation prediction and reasons for a message (multi-label, per-category thresholds)
+
+    Parameters:
+    text (str): Message to moderate
+    model: The loaded multi-label classification model
+    tokenizer: The loaded tokenizer
+
+    Returns:
+    tuple: (approved: bool, reasons: List[str])
+    """
+    try:
+        return get_predictions([text], model, tokenizer)[0]
+    except Exception as e:
+        print(f"Error in prediction: {str(e)}")
+        return True, ["No baneable"]  # Fallback
 
 
-def moderate_message(text, model, tokenizer):
+def moderate_message(text, model, tokenizer, cache=None, cascade=None):
     """
     Wrapper function to moderate a message using the BERT model
     
@@ -251,22 +469,148 @@ def moderate_message(text, model, tokenizer):
     text (str): Message to moderate
     model: The loaded BERT model
     tokenizer: The loaded tokenizer
-    threshold (float): Confidence threshold for moderation
+    cache (PredictionCache): Optional result cache keyed on the preprocessed message
+    cascade (ClasificadorRapido): Optional cheap first stage, BERT only runs if it is unsure
     
     Returns:
     tuple: (approved: bool, reason: str)
     """
     try:
-        # Preprocess the message
-        text = preprocesar_mensaje(text)
-        return get_prediction(text, model, tokenizer)
+        if cache is None and cascade is None:
+            # Preprocess the message
+            text = preprocesar_mensaje(text)
+            return get_prediction(text, model, tokenizer)
+
+        result = moderate_messages_detailed([text], model, tokenizer, cache=cache, cascade=cascade)[0]
+        return result["approved"], result["reasons"]
     except Exception as e:
         print(f"Error in moderation: {str(e)}")
         # In case of error, approve the message to avoid blocking legitimate content
         return True, "appropriate"
 
+def moderate_messages_detailed(texts, model, tokenizer, cache=None, cascade=None, predictor=None):
+    """
+    Moderate several messages at once, sharing one padded forward pass
+
+    Each distinct message is resolved by the first of: the result cache, the cheap
+    first stage (when it is confident), and BERT. Only one copy of each message
+    reaches the model.
+
+    Parameters:
+    texts (List[str]): Messages to moderate
+    model: The loaded BERT model
+    tokenizer: The loaded tokenizer
+    cache (PredictionCache): Optional result cache
+    cascade (ClasificadorRapido): Optional cheap first stage
+    predictor (callable): Optional replacement for get_predictions(texts, model, tokenizer),
+        e.g. a WorkerPool running the model in other processes; its WorkersUnavailable
+        errors are raised instead of approving the messages
+
+    Returns:
+    List[dict]: One {"approved", "reasons", "stage"} per message, in input order, where
+    stage is the stage that made the decision (STAGE_RAPIDO or STAGE_BERT)
+    """
+    try:
+        texts = [preprocesar_mensaje(text) for text in texts]
+        version = prediction_version(model, cascade)
+        known = {}
+        pending = {}  # Insertion-ordered set of messages that need the model
+        for text in texts:
+            if text in known or text in pending:
+                continue
+            result = cache.get(text, version) if cache is not None else None
+            if result is None and cascade is not None:
+                decision = cascade.decidir(text)
+                if decision is not None:
+                    result = (decision[0], decision[1], STAGE_RAPIDO)
+                    if cache is not None:
+                        cache.put(text, version, result)
+            if result is None:
+                pending[text] = None
+            else:
+                known[text] = result
+
+        pending = list(pending)
+        if not pending:
+            predictions = []
+        elif predictor is not None:
+            predictions = predictor(pending)
+        else:
+            predictions = get_predictions(pending, model, tokenizer)
+        for text, (approved, reasons) in zip(pending, predictions):
+            result = (approved, reasons, STAGE_BERT)
+            if cache is not None:
+                cache.put(text, version, result)
+            known[text] = result
+
+        results = [
+            {"approved": known[text][0], "reasons": list(known[text][1]), "stage": known[text][2]}
+            for text in texts
+        ]
+        for result in results:
+            for reason in result["reasons"]:
+                metrics.verdicts.inc(category=reason, stage=result["stage"])
+        return results
+    except WorkersUnavailable:
+        # No process can run the model: the endpoint answers 503 instead of approving everything
+        raise
+    except Exception as e:
+        metrics.errors.inc(where="moderate_messages")
+        metrics.log(f"Error in batch moderation: {str(e)}")
+        metrics.verdicts.inc(len(texts), category="No baneable", stage=STAGE_ERROR)
+        # In case of error, approve the messages to avoid blocking legitimate content
+        return [{"approved": True, "reasons": ["No baneable"], "stage": STAGE_ERROR} for _ in texts]
+
+def moderate_messages(texts, model, tokenizer, cache=None, cascade=None):
+    """
+    Moderate several messages at once (see moderate_messages_detailed)
+
+    Returns:
+    List[tuple]: One (approved: bool, reasons: List[str]) per message, in input order
+    """
+    return [
+        (result["approved"], result["reasons"])
+        for result in moderate_messages_detailed(texts, model, tokenizer, cache=cache, cascade=cascade)
+    ]
+
 # Función de preprocesamiento del mensaje (no se si es)
 def preprocesar_mensaje(mensaje):
     mensaje = mensaje.lower()
     mensaje = re.sub(r'[^\w\s]', '', mensaje)  # eliminar puntuación
     return mensaje
+
+# categoria_0.json of Clasificación Mati is not Garabato: it holds the ordinary chat
+# lines of the labeling sessions (only a few dozen of its ~1100 messages contain a
+# profanity), and there is no categoria_10.json. Its messages are the clean examples.
+CATEGORIAS_NO_BANEABLES = (0,)
+
+def cargar_ejemplos_etiquetados(directorio=os.path.join(os.path.dirname(__file__), '..', 'Clasificación Mati'),
+                                no_baneables=CATEGORIAS_NO_BANEABLES):
+    """
+    Load the labeled messages from the categoria_<n>.json files.
+
+    Parameters:
+    directorio (str): Folder with one categoria_<n>.json file per category index
+    no_baneables (tuple): Category files whose messages are labeled 'No baneable' instead
+
+    Returns:
+    List[tuple]: (mensaje: str, categorias: set of category indices), one entry per distinct
+    message; 'No baneable' only when no other category applies
+    """
+    etiquetas = {}
+    for filename in sorted(os.listdir(directorio)):
+        match = re.fullmatch(r'categoria_(\d+)\.json', filename)
+        if not match or int(match.group(1)) not in MODERATION_CATEGORIES:
+            continue
+        categoria = int(match.group(1))
+        if categoria in no_baneables:
+            categoria = NO_BANEABLE_INDEX
+        with open(os.path.join(directorio, filename), 'r', encoding='utf-8') as f:
+            for entrada in json.load(f):
+                mensaje = entrada.get('message')
+                if mensaje:
+                    etiquetas.setdefault(mensaje, set()).add(categoria)
+    for categorias in etiquetas.values():
+        if len(categorias) > 1:
+            categorias.discard(NO_BANEABLE_INDEX)
+    return list(etiquetas.items())
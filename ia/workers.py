@@ -0,0 +1,221 @@
+import os, threading, itertools, time
+import multiprocessing
+from concurrent.futures import Future
+import torch
+import metrics
+
+
+def _worker_main(conn, predict_fn, intra_op_threads, inter_op_threads, initializer):
+    """
+    Loop of a forked inference worker: receive (request_id, texts), send back results
+    along with the metrics observed meanwhile (tokenization, forward pass), which the
+    parent exports.
+    """
+    torch.set_num_threads(intra_op_threads)
+    try:
+        torch.set_num_interop_threads(inter_op_threads)
+    except RuntimeError:
+        # Only allowed before inter-op work has started; the inherited setting is kept
+        pass
+    if initializer is not None:
+        initializer(intra_op_threads)
+    metrics.reset()  # Values inherited from the parent are already exported there
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        request_id, texts = message
+        try:
+            result = (request_id, True, predict_fn(texts))
+        except Exception as e:
+            result = (request_id, False, f"{type(e).__name__}: {str(e)}")
+        conn.send(result + (metrics.take_delta(),))
+
+
+class WorkersUnavailable(RuntimeError):
+    """No inference worker can run the batch: none is alive, or the one running it died"""
+
+
+class WorkerPool:
+    """
+    Pool of forked inference processes sharing one copy of the model weights.
+
+    The model is loaded once in the parent; its tensors are moved to shared memory
+    and the workers are forked from it on the first batch (not at import, while
+    mod_wsgi is still setting up its threads), so N workers don't cost N copies of
+    the weights. Each worker runs with its own torch intra-op/inter-op thread
+    counts, and every batch is routed to the worker with the fewest messages in
+    flight. A worker that dies is replaced; its pending batches fail with
+    WorkersUnavailable.
+    """
+
+    def __init__(self, predict_fn, num_workers, model=None, intra_op_threads=None, inter_op_threads=1, initializer=None,
+                 restart_delay=1.0):
+        """
+        Parameters:
+        predict_fn (callable): Takes a list of messages, returns one result per message (runs in the workers)
+        num_workers (int): Number of worker processes
+        model: Model used by predict_fn; its weights are moved to shared memory before forking
+        intra_op_threads (int): torch threads per worker (default: cores / num_workers)
+        inter_op_threads (int): torch inter-op threads per worker
+        initializer (callable): Optional per-worker setup run after fork with the worker's intra-op
+            thread count (e.g. OnnxModel.reset_session)
+        restart_delay (float): Seconds to wait before replacing a worker that died before answering
+            any batch, so a worker that cannot start is not forked in a loop
+        """
+        self.predict_fn = predict_fn
+        self.num_workers = max(1, int(num_workers))
+        if intra_op_threads is None:
+            intra_op_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.initializer = initializer
+        self.restart_delay = restart_delay
+
+        if isinstance(model, torch.nn.Module):
+            model.share_memory()
+
+        self.context = multiprocessing.get_context("fork")
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.workers = []
+        self.started = False
+        self.closed = False
+        self.restarts = 0
+
+    def _start_worker(self, index):
+        # Called with self.lock held
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(
+            target=_worker_main,
+            args=(child_conn, self.predict_fn, self.intra_op_threads, self.inter_op_threads, self.initializer),
+            name=f"ia-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        worker = {
+            "index": index,
+            "process": process,
+            "conn": parent_conn,
+            "send_lock": threading.Lock(),
+            "pending": {},       # request_id -> (future, number of messages)
+            "in_flight": 0,      # messages sent and not answered yet
+            "completed": 0,
+            "alive": True,
+        }
+        threading.Thread(target=self._read_results, args=(worker,), daemon=True).start()
+        return worker
+
+    def _read_results(self, worker):
+        while True:
+            try:
+                request_id, ok, payload, observed = worker["conn"].recv()
+            except (EOFError, OSError):
+                break
+            metrics.merge_delta(observed)
+            with self.lock:
+                future, size = worker["pending"].pop(request_id)
+                worker["in_flight"] -= size
+                worker["completed"] += size
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+        # The worker died: fail whatever it still had, and replace it
+        with self.lock:
+            worker["alive"] = False
+            pending = list(worker["pending"].values())
+            worker["pending"].clear()
+            worker["in_flight"] = 0
+        worker["process"].join(timeout=5)
+        if not self.closed:
+            metrics.errors.inc(where="worker_exit")
+            metrics.log(f"Inference worker {worker['index']} exited with code {worker['process'].exitcode} "
+                        f"and {len(pending)} pending batches")
+        for future, _ in pending:
+            future.set_exception(WorkersUnavailable(f"Inference worker {worker['index']} exited"))
+        self._replace(worker)
+
+    def _replace(self, worker):
+        if worker["completed"] == 0:
+            time.sleep(self.restart_delay)
+        with self.lock:
+            if self.closed:
+                return
+            self.workers[worker["index"]] = self._start_worker(worker["index"])
+            self.restarts += 1
+
+    def submit(self, texts):
+        """
+        Send a batch to the least-loaded live worker, forking the workers on the first call.
+
+        Returns:
+        Future: Resolves to predict_fn(texts)
+        """
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise WorkersUnavailable("The worker pool is closed")
+            if not self.started:
+                self.started = True
+                self.workers = [self._start_worker(index) for index in range(self.num_workers)]
+            alive = [w for w in self.workers if w["alive"]]
+            if not alive:
+                raise WorkersUnavailable("No inference workers alive")
+            worker = min(alive, key=lambda w: w["in_flight"])
+            request_id = next(self.request_ids)
+            worker["pending"][request_id] = (future, len(texts))
+            worker["in_flight"] += len(texts)
+        try:
+            with worker["send_lock"]:
+                worker["conn"].send((request_id, list(texts)))
+        except Exception as e:
+            with self.lock:
+                if worker["pending"].pop(request_id, None) is not None:
+                    worker["in_flight"] -= len(texts)
+            future.set_exception(WorkersUnavailable(f"Inference worker {worker['index']} unreachable: {str(e)}"))
+        return future
+
+    def run(self, texts):
+        """
+        Blocking submit(texts).result()
+        """
+        return self.submit(texts).result()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "num_workers": self.num_workers,
+                "intra_op_threads": self.intra_op_threads,
+                "inter_op_threads": self.inter_op_threads,
+                "started": self.started,
+                "restarts": self.restarts,
+                "workers": [
+                    {
+                        "pid": w["process"].pid,
+                        "alive": w["alive"],
+                        "in_flight": w["in_flight"],
+                        "completed": w["completed"],
+                    }
+                    for w in self.workers
+                ],
+            }
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            workers = list(self.workers)
+        for worker in workers:
+            try:
+                with worker["send_lock"]:
+                    worker["conn"].send(None)
+            except Exception:
+                pass
+        for worker in workers:
+            worker["process"].join(timeout=5)
@@ -1,7 +1,8 @@
 #!/bin/bash
 source "$HOME/miniforge3/bin/activate" stream-mod && \
 cd "$HOME/stream-mod/ia" && \
-mod_wsgi-express start-server application.wsgi --port 7012 \
+mod_wsgi-express start-server application.wsgi --port 7012 --threads 32 \
+	--python-path "$HOME/stream-mod" \
 	--server-root "$HOME/stream-mod/apache-app-ia" \
 	--access-log --log-to-terminal \
 	2>&1 | /usr/bin/cronolog "$HOME/stream-mod/apache-app-ia/logs/apache.%Y-%m-%d.log"
\ No newline at end of file